@@ -4,362 +4,193 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import configparser
-from scipy.stats import zscore
 import plotly.graph_objects as go
 import datetime
 import os
-import requests
-import yfinance as yf
+import sys
 from io import StringIO
 
-# ==============================================================================
-# CONFIGURAZIONE EODHD / YAHOO
-# ==============================================================================
-
-TICKER_MAPPING_EODHD = {
-    'SPY': 'SPY.US',
-    'ES=F': 'ES.CME',
-    '^VIX': 'VIX.INDX',
-    '^VIX3M': 'VIX3M.INDX'
-}
-
-def fetch_hybrid_data(ticker_yahoo, api_key, start_date, end_date):
-    """Fallback ibrido EODHD -> Yahoo Finance."""
-    eodhd_symbol = TICKER_MAPPING_EODHD.get(ticker_yahoo, ticker_yahoo)
-    data_eodhd = pd.DataFrame()
-    source_used = "N/A"
-    
-    # 1. TENTATIVO EODHD
-    if api_key:
-        try:
-            fmt = '%Y-%m-%d'
-            start_str = start_date.strftime(fmt) if isinstance(start_date, (datetime.date, datetime.datetime)) else start_date
-            end_str = end_date.strftime(fmt) if isinstance(end_date, (datetime.date, datetime.datetime)) else end_date
-            
-            url = f'https://eodhd.com/api/eod/{eodhd_symbol}'
-            params = {'api_token': api_key, 'fmt': 'json', 'from': start_str, 'to': end_str, 'period': 'd'}
-            
-            r = requests.get(url, params=params, timeout=5)
-            if r.status_code == 200:
-                json_data = r.json()
-                if json_data and isinstance(json_data, list) and len(json_data) > 0:
-                    df = pd.DataFrame(json_data)
-                    df = df.rename(columns={'date': 'Date', 'open': 'Open', 'high': 'High', 
-                                          'low': 'Low', 'close': 'Close', 'volume': 'Volume'})
-                    df['Date'] = pd.to_datetime(df['Date'])
-                    df.set_index('Date', inplace=True)
-                    
-                    if not df.empty:
-                        cols = ['Open', 'High', 'Low', 'Close', 'Volume']
-                        for c in cols:
-                            if c in df.columns: 
-                                df[c] = pd.to_numeric(df[c], errors='coerce')
-                        data_eodhd = df[cols]
-                        source_used = "EODHD"
-        except Exception:
-            pass 
-
-    # 2. TENTATIVO YAHOO (FALLBACK)
-    if data_eodhd.empty:
-        try:
-            df_yf = yf.download(ticker_yahoo, start=start_date, end=end_date, progress=False, auto_adjust=False)
-            if not df_yf.empty:
-                if isinstance(df_yf.columns, pd.MultiIndex):
-                     try:
-                        df_yf = df_yf.xs(ticker_yahoo, axis=1, level=1, drop_level=True)
-                     except KeyError:
-                        pass
-                
-                data_eodhd = df_yf[['Open', 'High', 'Low', 'Close', 'Volume']]
-                source_used = "Yahoo (Fallback)"
-        except Exception as e:
-            st.error(f"Errore download fallback ({ticker_yahoo}): {e}")
-
-    return data_eodhd, source_used
+# Rende importabile il pacchetto src anche con `streamlit run app/dashboard.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import artifact, strategy
+from src.data_cache import market_session_key
+from src.downsample import downsample_frame, lttb_indices, max_points_for_width, thin_events
+from src.metrics import calculate_metrics, hedge_cycles, ledger_frame, results_ledger
 
 # ==============================================================================
-# FUNZIONE STRATEGIA (CORE)
+# FUNZIONE STRATEGIA (WRAPPER STREAMLIT SUL CORE src.strategy)
 # ==============================================================================
 
-def run_full_strategy(params_dict, start_date, end_date):
-    # Recupero API KEY EODHD
-    eodhd_api_key = os.environ.get("EODHD_API_KEY")
-    if not eodhd_api_key:
+def _get_secret(name):
+    """Variabile d'ambiente o, in alternativa, st.secrets."""
+    value = os.environ.get(name)
+    if not value:
         try:
-            eodhd_api_key = st.secrets["EODHD_API_KEY"]
+            value = st.secrets[name]
         except Exception:
-            eodhd_api_key = None
+            value = None
+    return value
 
-    CAPITALE_INIZIALE = params_dict['capitale_iniziale']
-    all_tickers = ['SPY', 'ES=F', '^VIX', '^VIX3M']
-    fred_series_cmi = {'TED_Spread': 'TEDRATE', 'Yield_Curve_10Y2Y': 'T10Y2Y', 
-                       'VIX': 'VIXCLS', 'High_Yield_Spread': 'BAMLH0A0HYM2'}
+# Cache a due livelli (in memoria, LRU con numero massimo di voci):
+#   1. frame grezzo + CMI z-score, per (ticker, intervallo di date, seduta)
+#   2. frame con segnali, per parametri degli indicatori
+# Il backtest, che dipende da capitale, hedge % e stop loss, gira sempre ma e'
+# solo il kernel su array. La chiave di seduta cambia alla chiusura del mercato
+# USA, quindi i dati vengono riscaricati una volta per seduta; il TTL libera
+# comunque le voci delle sedute precedenti.
+DATA_CACHE_ENTRIES = 4
+INDICATOR_CACHE_ENTRIES = 16
+CACHE_TTL_SECONDS = 24 * 3600
 
-    # --- 1. DOWNLOAD DATI MERCATO ---
-    market_data_dfs = {}
+@st.cache_data(max_entries=DATA_CACHE_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def load_base_frame(tickers, start_date, end_date, session_key):
+    """Livello 1: download e CMI z-score (indipendenti dai parametri)."""
     try:
         my_bar = st.progress(0, text="Download dati in corso...")
     except:
         my_bar = None
 
-    for idx, ticker in enumerate(all_tickers):
-        data, source = fetch_hybrid_data(ticker, eodhd_api_key, start_date, end_date)
-        if not data.empty:
-            market_data_dfs[ticker] = data
-        if my_bar: 
-            my_bar.progress((idx + 1) / len(all_tickers), text=f"Scaricato {ticker} da {source}")
-            
-    if my_bar: my_bar.empty()
+    def _on_progress(done, total, label, source):
+        if my_bar:
+            my_bar.progress(done / total, text=f"Scaricato {label} da {source}")
 
+    market_data_dfs, cmi_data_dict = strategy.load_strategy_data(
+        start_date, end_date, _get_secret("EODHD_API_KEY"), _get_secret("FRED_API_KEY"),
+        progress_callback=_on_progress, tickers=tickers
+    )
+    if my_bar: my_bar.empty()
     if not market_data_dfs:
-        st.error("Download dati fallito.")
-        return None, None, None, None, None, None
+        # Eccezione invece di None: i fallimenti non devono restare in cache
+        raise ValueError("Download dati fallito.")
+    return strategy.compute_cmi_zscore(strategy.build_master_frame(market_data_dfs, cmi_data_dict))
 
-    # Unione dataframe
-    df = pd.DataFrame()
-    for ticker in all_tickers:
-        if ticker in market_data_dfs:
-            data = market_data_dfs[ticker]
-            prefix = ticker.replace('=F', '').replace('^', '')
-            for col in ['Open', 'High', 'Low', 'Close', 'Volume']:
-                if col in data.columns:
-                    df[f'{prefix}_{col}'] = data[col]
+@st.cache_data(max_entries=INDICATOR_CACHE_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def load_indicator_frame(start_date, end_date, session_key, cmi_ma_window, vix_upper, vix_lower):
+    """Livello 2: segnali CMI/VIX per una combinazione di parametri degli indicatori."""
+    df = load_base_frame(tuple(strategy.ALL_TICKERS), start_date, end_date, session_key)
+    if df is None:
+        return None
+    return strategy.compute_signals(df, {'cmi_ma_window': cmi_ma_window,
+                                         'vix_ratio_upper_threshold': vix_upper,
+                                         'vix_ratio_lower_threshold': vix_lower})
 
-    # --- 2. DOWNLOAD DATI MACRO (FRED) ---
-    cmi_data_dict = {}
+def run_full_strategy(params_dict, start_date, end_date):
+    """Esegue la strategia riusando dati e indicatori in cache; ricalcola solo il backtest."""
     try:
-        fred_api_key = os.environ.get("FRED_API_KEY")
-        if not fred_api_key:
-            fred_api_key = st.secrets["FRED_API_KEY"]
-    
-        for name, ticker in fred_series_cmi.items():
-            api_url = f"https://api.stlouisfed.org/fred/series/observations?series_id={ticker}&api_key={fred_api_key}&file_type=json&observation_start={start_date.strftime('%Y-%m-%d')}"
-            response = requests.get(api_url, timeout=30)
-            if response.status_code == 200:
-                obs = response.json().get('observations', [])
-                if obs:
-                    temp_df = pd.DataFrame(obs)[['date', 'value']]
-                    temp_df['date'] = pd.to_datetime(temp_df['date'])
-                    temp_df.set_index('date', inplace=True)
-                    temp_df['value'] = pd.to_numeric(temp_df['value'], errors='coerce')
-                    cmi_data_dict[name] = temp_df['value']
-    except Exception:
-        pass
-        
-    cmi_data = pd.concat(cmi_data_dict.values(), axis=1) if cmi_data_dict else pd.DataFrame()
-    if not cmi_data.empty:
-        cmi_data.columns = cmi_data_dict.keys()
-        df = df.join(cmi_data).ffill()
-    else:
-        df = df.ffill()
-    
-    # Verifica colonne essenziali
-    colonne_essenziali = ['SPY_Open', 'SPY_Close', 'ES_Open', 'ES_Close', 'VIX_Close', 'VIX3M_Close']
-    if not all(col in df.columns for col in colonne_essenziali):
-        if 'ES_Close' not in df.columns and 'SPY_Close' in df.columns:
-            df['ES_Close'] = df['SPY_Close']
-            df['ES_Open'] = df['SPY_Open']
-        else:
-            df.dropna(subset=[c for c in colonne_essenziali if c in df.columns], inplace=True)
-
-    # --- 3. CALCOLO INDICATORI ---
-    cmi_cols = [col for col in fred_series_cmi.keys() if col in df.columns]
-    if not cmi_cols:
+        df = load_indicator_frame(start_date, end_date, market_session_key(),
+                                  *(float(params_dict[name]) for name in strategy.INDICATOR_PARAMS))
+    except ValueError as e:
+        print(e)
         return None, None, None, None, None, None
-        
-    cmi_data_clean = df[cmi_cols].dropna()
-    cmi_data_zscore = cmi_data_clean.apply(zscore)
-    if 'Yield_Curve_10Y2Y' in cmi_data_zscore.columns:
-        cmi_data_zscore['Yield_Curve_10Y2Y'] *= -1
-        
-    df['CMI_ZScore'] = cmi_data_zscore.mean(axis=1)
-    df['CMI_MA'] = df['CMI_ZScore'].rolling(window=int(params_dict['cmi_ma_window'])).mean()
-    df.dropna(subset=['CMI_MA'], inplace=True)
-    
-    if df.empty: return None, None, None, None, None, None
-
-    df['Signal_CMI'] = np.where(df['CMI_ZScore'] > df['CMI_MA'], 1, 0)
-    
-    df['VIX_Ratio'] = df['VIX_Close'] / df['VIX3M_Close'].replace(0, np.nan)
-    
-    signal_vix = [0] * len(df)
-    in_hedge_signal = False
-    for i in range(len(df)):
-        ratio = df['VIX_Ratio'].iloc[i]
-        if pd.isna(ratio): continue
-        if ratio > params_dict['vix_ratio_upper_threshold']:
-            in_hedge_signal = True
-        elif ratio < params_dict['vix_ratio_lower_threshold']:
-            in_hedge_signal = False
-        if in_hedge_signal:
-            signal_vix[i] = 1
-            
-    df['Signal_VIX'] = signal_vix
-    df['Signal_Count'] = df['Signal_CMI'].fillna(0) + df['Signal_VIX']
-
-    # --- 4. BACKTEST LOOP (SINCRONIZZATO) ---
-    initial_spy_price = df['SPY_Open'].iloc[0]
-    spy_shares = CAPITALE_INIZIALE / initial_spy_price
-    cash_from_hedging = 0.0
-    es_contracts = 0
-    hedge_entry_price = 0.0
-    current_tranches = 0
-    
-    portfolio_history = [{'Date': df.index[0], 'Portfolio_Value': CAPITALE_INIZIALE, 'MES_Contracts': 0}]
-    hedge_trades_count = 0
-    hedge_stopped_out = False
-    stop_loss_events = 0
-    
-    df['Hedge_PnL'] = 0.0
-    df['MES_Contracts'] = 0.0 
-    df['Equity_at_Hedge_Entry'] = np.nan
-
-    for i in range(1, len(df)):
-        current_date = df.index[i]
-        
-        price_spy = df['SPY_Close'].iloc[i]
-        price_es_curr = df['ES_Close'].iloc[i]
-        price_es_prev = df['ES_Close'].iloc[i-1]
-        
-        # 1. Calcolo PnL della posizione tenuta da IERI a OGGI
-        if current_tranches > 0:
-            daily_hedge_pnl = es_contracts * (price_es_curr - price_es_prev) * params_dict['micro_es_multiplier']
-            cash_from_hedging += daily_hedge_pnl
-            df.loc[current_date, 'Hedge_PnL'] = daily_hedge_pnl
-            
-            # 2. Check Stop Loss (sulla chiusura di OGGI)
-            if price_es_curr > hedge_entry_price * (1 + params_dict['stop_loss_threshold_hedge']):
-                current_tranches = 0
-                es_contracts = 0
-                hedge_stopped_out = True
-                stop_loss_events += 1
-                
-        # 3. Gestione Segnale
-        target_tranches = df['Signal_Count'].iloc[i]
-        
-        if target_tranches == 0:
-            hedge_stopped_out = False 
+    if df is None:
+        return None, None, None, None, None, None
+    # st.cache_data restituisce una copia: run_backtest puo' scrivere sul frame
+    return strategy.run_backtest(df, params_dict)
 
-        if not hedge_stopped_out:
-            if target_tranches > current_tranches:
-                # AUMENTO ESPOSIZIONE
-                tranches_to_add = target_tranches - current_tranches
-                portfolio_value_now = (spy_shares * price_spy) + cash_from_hedging
-                notional_per_tranche = portfolio_value_now * params_dict['hedge_percentage_per_tranche']
-                
-                # Calcolo contratti (Short = negativo)
-                contracts_to_add = - (notional_per_tranche / (price_es_curr * params_dict['micro_es_multiplier'])) * tranches_to_add
-                
-                if current_tranches == 0:
-                    hedge_entry_price = price_es_curr 
-                    hedge_trades_count += 1
-                    df.loc[current_date, 'Equity_at_Hedge_Entry'] = portfolio_value_now
-                
-                es_contracts += contracts_to_add
-                current_tranches = target_tranches
-                
-            elif target_tranches < current_tranches:
-                # RIDUZIONE ESPOSIZIONE
-                ratio = target_tranches / current_tranches
-                es_contracts = es_contracts * ratio
-                current_tranches = target_tranches
+# Artefatto pubblicato dal job giornaliero (src.artifact): con i parametri di
+# default il segnale del giorno e' una lettura del file mappato in memoria. Il
+# frame e' condiviso tra le sessioni (st.cache_resource, sola lettura); se
+# KRITERION_ARTIFACT_URL e' impostato l'artefatto viene prima sincronizzato,
+# al massimo una volta ogni ARTIFACT_SYNC_SECONDS.
+ARTIFACT_SYNC_SECONDS = 15 * 60
 
-        portfolio_value = (spy_shares * price_spy) + cash_from_hedging
-        portfolio_history.append({'Date': current_date, 'Portfolio_Value': portfolio_value, 'MES_Contracts': es_contracts})
-        
-        # AGGIORNAMENTO DATAFRAME PRINCIPALE
-        df.loc[current_date, 'MES_Contracts'] = es_contracts
+@st.cache_data(ttl=ARTIFACT_SYNC_SECONDS, show_spinner=False)
+def sync_published_artifact(url, session_key):
+    return artifact.sync_artifact(url)
 
-    results_df_final = pd.DataFrame(portfolio_history).set_index('Date')
-    results_df_final['Strategy_Returns'] = results_df_final['Portfolio_Value'].pct_change()
-    
-    benchmark_returns = df['SPY_Close'].pct_change()
-    cumulative_benchmark = (1 + benchmark_returns).cumprod() * CAPITALE_INIZIALE
-    cumulative_benchmark.iloc[0] = CAPITALE_INIZIALE
-    
-    equity_curves = pd.DataFrame({'Strategy_Equity': results_df_final['Portfolio_Value'], 'Buy_And_Hold_Equity': cumulative_benchmark}).dropna()
-    
-    # [FIX] Uniamo solo Portfolio_Value (MES_Contracts è già stato inserito nel loop)
-    # Evita il ValueError: columns overlap
-    df_con_risultati = df.join(results_df_final[['Portfolio_Value']]).ffill()
+@st.cache_resource(max_entries=2, show_spinner=False)
+def open_published_frame(path):
+    return artifact.open_artifact(path)
 
-    return equity_curves, results_df_final['Strategy_Returns'].dropna(), benchmark_returns.dropna(), hedge_trades_count, stop_loss_events, df_con_risultati
+def load_published_frame(params_dict):
+    """Frame pubblicato per questi parametri e la seduta corrente, oppure None (calcolo live)."""
+    session_key = market_session_key()
+    url = _get_secret("KRITERION_ARTIFACT_URL")
+    if url:
+        sync_published_artifact(url, session_key)
+    manifest = artifact.current_manifest(params_dict, session_key)
+    if manifest is None:
+        return None
+    try:
+        return open_published_frame(artifact.artifact_path(manifest))
+    except (OSError, ValueError) as e:
+        print(f"Artefatto non leggibile, calcolo live: {e}")
+        return None
 
 # ==============================================================================
 # FUNZIONI DI PLOTTING E METRICHE
 # ==============================================================================
-def calculate_metrics(strategy_returns, benchmark_returns, total_trades, stop_loss_events, results_df, trading_days=252):
-    
-    # Calcolo Max DD Coperture
-    results_df['Hedge_Cycle_Equity'] = results_df['Equity_at_Hedge_Entry'].ffill()
-    results_df['Cumulative_Hedge_PnL_per_Cycle'] = results_df.groupby(results_df['Equity_at_Hedge_Entry'].notna().cumsum())['Hedge_PnL'].cumsum()
-    results_df['Hedge_DD_pct_on_Entry_Equity'] = results_df['Cumulative_Hedge_PnL_per_Cycle'] / results_df['Hedge_Cycle_Equity']
-    max_drawdown_hedge_pct = results_df['Hedge_DD_pct_on_Entry_Equity'].min()
-    
-    # Metriche Strategy
-    metrics = {
-        "Numero di Trade di Copertura": total_trades,
-        "Numero di Stop Loss": stop_loss_events,
-        "Max DD Coperture su Equity Iniziale Trade": f"{max_drawdown_hedge_pct:.2%}" if pd.notna(max_drawdown_hedge_pct) else "N/A"
-    }
-    
-    cumulative_returns = (1 + strategy_returns).cumprod()
-    total_return = cumulative_returns.iloc[-1] - 1
-    num_years = len(strategy_returns) / trading_days if len(strategy_returns) > 0 else 0
-    cagr = (cumulative_returns.iloc[-1]) ** (1/num_years) - 1 if num_years > 0 else 0
-    volatility = strategy_returns.std() * np.sqrt(trading_days)
-    sharpe_ratio = cagr / volatility if volatility > 0.0001 else 0
-    cumulative_max = cumulative_returns.cummax()
-    drawdown = (cumulative_returns - cumulative_max) / cumulative_max
-    max_drawdown = drawdown.min()
-    calmar_ratio = cagr / abs(max_drawdown) if max_drawdown != 0 else 0
-    
-    metrics.update({
-        "Rendimento Totale": f"{total_return:.2%}", 
-        "CAGR (ann.)": f"{cagr:.2%}", 
-        "Volatilità (ann.)": f"{volatility:.2%}", 
-        "Sharpe Ratio": f"{sharpe_ratio:.2f}", 
-        "Max Drawdown": f"{max_drawdown:.2%}", 
-        "Calmar Ratio": f"{calmar_ratio:.2f}"
-    })
-    
-    # Metriche Benchmark
-    bench_metrics = {}
-    bench_cumulative = (1 + benchmark_returns).cumprod()
-    bench_total_return = bench_cumulative.iloc[-1] - 1
-    bench_num_years = len(benchmark_returns) / trading_days if len(benchmark_returns) > 0 else 0
-    bench_cagr = (bench_cumulative.iloc[-1]) ** (1/bench_num_years) - 1 if bench_num_years > 0 else 0
-    bench_volatility = benchmark_returns.std() * np.sqrt(trading_days)
-    bench_sharpe = bench_cagr / bench_volatility if bench_volatility > 0.0001 else 0
-    bench_cummax = bench_cumulative.cummax()
-    bench_drawdown_series = (bench_cumulative - bench_cummax) / bench_cummax
-    bench_max_dd = bench_drawdown_series.min()
-    bench_calmar = bench_cagr / abs(bench_max_dd) if bench_max_dd != 0 else 0
-    
-    bench_metrics.update({
-        "Rendimento Totale": f"{bench_total_return:.2%}", 
-        "CAGR (ann.)": f"{bench_cagr:.2%}", 
-        "Volatilità (ann.)": f"{bench_volatility:.2%}", 
-        "Sharpe Ratio": f"{bench_sharpe:.2f}", 
-        "Max Drawdown": f"{bench_max_dd:.2%}", 
-        "Calmar Ratio": f"{bench_calmar:.2f}", 
-        "Numero di Trade di Copertura": 0, 
-        "Numero di Stop Loss": 0, 
-        "Max DD Coperture su Equity Iniziale Trade": "N/A"
-    })
-    
-    return metrics, bench_metrics
+# Etichette e formato delle metriche numeriche di src.metrics.calculate_metrics
+METRIC_FORMATS = {
+    'hedge_trades': ("Numero di Trade di Copertura", "{}"),
+    'stop_loss_events': ("Numero di Stop Loss", "{}"),
+    'max_hedge_drawdown': ("Max DD Coperture su Equity Iniziale Trade", "{:.2%}"),
+    'max_adverse_excursion': ("Max Escursione Avversa Ciclo di Copertura", "{:.2%}"),
+    'stop_loss_hit_rate': ("Cicli Chiusi da Stop Loss", "{:.0%}"),
+    'total_return': ("Rendimento Totale", "{:.2%}"),
+    'cagr': ("CAGR (ann.)", "{:.2%}"),
+    'volatility': ("Volatilità (ann.)", "{:.2%}"),
+    'sharpe': ("Sharpe Ratio", "{:.2f}"),
+    'max_drawdown': ("Max Drawdown", "{:.2%}"),
+    'calmar': ("Calmar Ratio", "{:.2f}"),
+}
+
+def format_metrics(metrics):
+    """Converte un dict di metriche numeriche in etichette e stringhe per la tabella."""
+    formatted = {}
+    for key, value in metrics.items():
+        label, fmt = METRIC_FORMATS[key]
+        formatted[label] = fmt.format(value) if pd.notna(value) else "N/A"
+    return formatted
+
+# Grafici: la serie dei prezzi e' sottocampionata lato server (LTTB) alla larghezza
+# del grafico e i marker degli eventi sono limitati, cosi' il payload inviato al
+# browser resta costante qualunque sia la lunghezza del backtest
+CHART_WIDTH_PX = 1400
+CHART_MAX_POINTS = max_points_for_width(CHART_WIDTH_PX, 'lttb')
+CHART_MAX_EVENTS = 400
+
+def _price_line(df, column, name):
+    """Traccia della serie di prezzo sottocampionata con LTTB."""
+    rows = lttb_indices(df[column].to_numpy(dtype=float), CHART_MAX_POINTS)
+    return go.Scatter(x=df.index[rows], y=df[column].to_numpy()[rows], mode='lines', name=name,
+                      line=dict(color='cyan', width=1))
+
+def _events(points):
+    """Al massimo CHART_MAX_EVENTS eventi, distribuiti sull'intera storia."""
+    return points.iloc[thin_events(len(points), CHART_MAX_EVENTS)]
+
+def _trade_events(df_results):
+    """
+    Operazioni della copertura con tipo ('kind'), ES_Close e MES_Contracts dopo l'operazione.
+
+    Dal registro degli eventi del backtest (O(operazioni)); per i frame che non
+    lo portano (artefatti, fette) dai cambi di MES_Contracts, senza distinguere
+    entrate, uscite e stop.
+    """
+    ledger = results_ledger(df_results)
+    if ledger is not None:
+        events = ledger_frame(ledger)
+        events = events[~events['kind'].isin(['REARM', 'MARK'])]
+        return events.rename(columns={'es_price': 'ES_Close', 'contracts': 'MES_Contracts'})
+    contracts = df_results['MES_Contracts'].to_numpy()
+    previous = np.append(0.0, contracts[:-1])
+    changed = contracts != previous
+    kind = np.where(contracts[changed] < previous[changed], 'ADD', 'REDUCE')
+    return df_results.loc[changed, ['ES_Close', 'MES_Contracts']].assign(kind=kind)
 
 def plotly_trades_chart(df_results, title):
-    trade_points = df_results[df_results['MES_Contracts'].diff() != 0].copy()
+    trade_points = _trade_events(df_results)
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=df_results.index, y=df_results['ES_Close'], mode='lines', name='Prezzo SPY/ES', line=dict(color='cyan', width=1)))
+    fig.add_trace(_price_line(df_results, 'ES_Close', 'Prezzo SPY/ES'))
     
-    aumento_copertura = trade_points[trade_points['MES_Contracts'] < trade_points['MES_Contracts'].shift(1).fillna(0)]
-    riduzione_copertura = trade_points[trade_points['MES_Contracts'] > trade_points['MES_Contracts'].shift(1).fillna(0)]
+    aumento_copertura = _events(trade_points[trade_points['kind'].isin(['ENTRY', 'ADD'])])
+    riduzione_copertura = _events(trade_points[trade_points['kind'].isin(['REDUCE', 'EXIT'])])
+    stop_loss = _events(trade_points[trade_points['kind'] == 'STOP'])
     
     fig.add_trace(go.Scatter(x=aumento_copertura.index, y=aumento_copertura['ES_Close'], mode='markers', name='Aumento Copertura', marker=dict(color='red', symbol='triangle-down', size=10)))
     fig.add_trace(go.Scatter(x=riduzione_copertura.index, y=riduzione_copertura['ES_Close'], mode='markers', name='Riduzione Copertura', marker=dict(color='lime', symbol='triangle-up', size=10)))
+    fig.add_trace(go.Scatter(x=stop_loss.index, y=stop_loss['ES_Close'], mode='markers', name='Stop Loss', marker=dict(color='yellow', symbol='x', size=10)))
     
     # Marker Posizione Aperta Oggi
     last_row = df_results.iloc[-1]
@@ -374,24 +205,31 @@ def plotly_trades_chart(df_results, title):
             text="In Posizione", showarrow=True, arrowhead=1, yshift=-20, font=dict(color="white")
         )
 
-    for _, row in trade_points.iterrows():
-        fig.add_annotation(x=row.name, y=row['SPY_Close'], text=f"<b>{int(row['MES_Contracts'])}</b>", showarrow=False, yshift=15, font=dict(color="white", size=10), bgcolor="rgba(0,0,0,0.5)")
+    # Contratti dopo ogni operazione: un'unica traccia di testo invece di un'annotazione
+    # per operazione, posizionata sul prezzo ES come i marker
+    labels = _events(trade_points)
+    fig.add_trace(go.Scatter(
+        x=labels.index, y=labels['ES_Close'], mode='text', name='Contratti', showlegend=False, hoverinfo='skip',
+        text=[f"<b>{n}</b>" for n in labels['MES_Contracts'].astype(int)], textposition='top center',
+        textfont=dict(color="white", size=10)
+    ))
     
     fig.update_layout(title=title, template='plotly_dark', yaxis_type="log", legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
     return fig
 
 def plotly_individual_signals_chart(df_results):
-    df = df_results.copy()
+    # Sola lettura: nessuna copia del frame
+    df = df_results
     cmi_trades = df[df['Signal_CMI'].diff() != 0]
     vix_trades = df[df['Signal_VIX'].diff() != 0]
     fig = go.Figure()
     
-    fig.add_trace(go.Scatter(x=df.index, y=df['ES_Close'], mode='lines', name='Prezzo ES', line=dict(color='cyan', width=1)))
+    fig.add_trace(_price_line(df, 'ES_Close', 'Prezzo ES'))
 
-    cmi_entries = cmi_trades[cmi_trades['Signal_CMI'] == 1]
-    cmi_exits = cmi_trades[cmi_trades['Signal_CMI'] == 0]
-    vix_entries = vix_trades[vix_trades['Signal_VIX'] == 1]
-    vix_exits = vix_trades[vix_trades['Signal_VIX'] == 0]
+    cmi_entries = _events(cmi_trades[cmi_trades['Signal_CMI'] == 1])
+    cmi_exits = _events(cmi_trades[cmi_trades['Signal_CMI'] == 0])
+    vix_entries = _events(vix_trades[vix_trades['Signal_VIX'] == 1])
+    vix_exits = _events(vix_trades[vix_trades['Signal_VIX'] == 0])
 
     fig.add_trace(go.Scatter(x=cmi_entries.index, y=cmi_entries['ES_Close'], mode='markers', name='Entrata CMI', marker=dict(color='orange', symbol='triangle-down', size=12)))
     fig.add_trace(go.Scatter(x=cmi_exits.index, y=cmi_exits['ES_Close'], mode='markers', name='Uscita CMI', marker=dict(color='orange', symbol='triangle-up', size=12)))
@@ -401,6 +239,10 @@ def plotly_individual_signals_chart(df_results):
     fig.update_layout(title='Prezzo ES con Segnali Individuali', template='plotly_dark', yaxis_type="log", legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
     return fig
 
+def line_chart_data(df):
+    """Dati per st.line_chart sottocampionati con min-max (picchi e drawdown restano esatti)."""
+    return downsample_frame(df, max_points_for_width(CHART_WIDTH_PX, 'minmax'), 'minmax')
+
 # ==============================================================================
 # INTERFACCIA STREAMLIT
 # ==============================================================================
@@ -435,13 +277,20 @@ if __name__ == '__main__':
             with st.spinner("Calcolo in corso..."):
                 end_date = datetime.date.today()
                 start_date_recent = end_date - datetime.timedelta(days=2*365)
-                results = run_full_strategy(params_dict, start_date_recent, end_date)
-                if results is not None and results[5] is not None:
-                    _, _, _, _, _, df_results = results
+                df_results = load_published_frame(params_dict)
+                if df_results is None:
+                    # Parametri diversi dai default o artefatto non ancora pubblicato
+                    df_results = run_full_strategy(params_dict, start_date_recent, end_date)[5]
+                if df_results is not None:
                     if not df_results.empty:
-                        df_last_year = df_results.last('365D')
+                        # Ultimo anno (come il vecchio .last('365D'), rimosso in pandas 3): vista, non copia
+                        df_last_year = df_results.loc[df_results.index > df_results.index[-1] - pd.Timedelta(days=365)]
                         latest_signal_row = df_results.iloc[-1]
                         st.subheader(f"Segnale per il {latest_signal_row.name.strftime('%Y-%m-%d')}")
+                        session_key = market_session_key()
+                        if latest_signal_row.name.strftime('%Y-%m-%d') < session_key:
+                            st.warning(f"Dati non aggiornati: l'ultima seduta chiusa e' del {session_key} "
+                                       "(download fallito o giorno festivo).")
                         col1, col2, col3 = st.columns(3)
                         col1.metric("Segnale CMI", int(latest_signal_row['Signal_CMI']))
                         col2.metric("Segnale VIX Ratio", int(latest_signal_row['Signal_VIX']))
@@ -454,8 +303,8 @@ if __name__ == '__main__':
                         st.markdown("---")
                         st.subheader("Grafici Indicatori (ultimo anno)")
                         vix_plot_df = pd.DataFrame({'VIX_Ratio': df_last_year['VIX_Ratio'], 'Soglia Superiore': params_dict['vix_ratio_upper_threshold'], 'Soglia Inferiore': params_dict['vix_ratio_lower_threshold']})
-                        st.line_chart(vix_plot_df, color=["#FF00FF", "#808080", "#808080"])
-                        st.line_chart(df_last_year[['CMI_ZScore', 'CMI_MA']])
+                        st.line_chart(line_chart_data(vix_plot_df), color=["#FF00FF", "#808080", "#808080"])
+                        st.line_chart(line_chart_data(df_last_year[['CMI_ZScore', 'CMI_MA']]))
                         st.plotly_chart(plotly_individual_signals_chart(df_last_year), use_container_width=True)
                     else:
                         st.warning("Il calcolo ha prodotto un set di dati vuoto.")
@@ -473,10 +322,14 @@ if __name__ == '__main__':
                     equity_curves, strategy_returns, benchmark_returns, trades, stop_losses, df_final_results = results
                     st.success("Esecuzione completata!")
                     strategy_metrics, benchmark_metrics = calculate_metrics(strategy_returns, benchmark_returns, trades, stop_losses, df_final_results)
-                    metrics_df = pd.DataFrame({'Strategia': strategy_metrics, 'Benchmark (SPY)': benchmark_metrics}).astype(str)
+                    metrics_df = pd.DataFrame({'Strategia': format_metrics(strategy_metrics), 'Benchmark (SPY)': format_metrics(benchmark_metrics)}).astype(str)
                     st.subheader("Grafico Operazioni")
                     st.plotly_chart(plotly_trades_chart(df_final_results, 'Backtest'), use_container_width=True)
                     st.subheader("Equity Line")
-                    st.line_chart(equity_curves)
+                    st.line_chart(line_chart_data(equity_curves))
                     st.subheader("Metriche")
                     st.table(metrics_df)
+                    ledger = results_ledger(df_final_results)
+                    if ledger is not None:
+                        st.subheader("Cicli di Copertura")
+                        st.dataframe(hedge_cycles(ledger), use_container_width=True)
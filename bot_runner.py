@@ -3,11 +3,145 @@
 
 import configparser
 import datetime
+import json
+import math
+import os
 import pandas as pd
 
-# Importa le funzioni dai tuoi moduli esistenti
-from app.dashboard import run_full_strategy
-from src.telegram_notifier import send_telegram_message
+# Importa le funzioni dal core headless (niente streamlit/plotly nel job giornaliero)
+from src import telemetry
+from src.artifact import publish_state_artifact
+from src.data_cache import market_session_key
+from src.incremental import SAMPLE_DAYS, run_incremental_signal
+from src.portfolio import load_portfolio_config, load_portfolio_data, portfolio_configured, run_portfolio
+from src.signal_service import load_snapshot
+from src.strategy import load_strategy_params
+from src.telegram_notifier import get_notifier, send_telegram_message
+
+DASHBOARD_URL = "https://kriterionquanthedging-ftyojbunrcy7wjgsj8ajrc.streamlit.app/"
+
+
+def hedge_status(contracts, signal_count_raw, contract_name="Micro ES"):
+    """Stato reale della copertura (attiva, stop loss o flat) e azione da eseguire."""
+    # Leggiamo i contratti effettivi. Se negativi, siamo Short (Coperti).
+    is_hedged_active = contracts < -0.01 # Usiamo una soglia float negativa
+
+    if is_hedged_active:
+        header_status = "🟢 COPERTURA ATTIVA"
+        azione = f"Mantenere {abs(contracts):.2f} contratti {contract_name} Short."
+    elif signal_count_raw > 0 and not is_hedged_active:
+        # C'è segnale ma contratti a 0 -> È scattato lo STOP LOSS
+        header_status = "🔴 NON ATTIVO (STOP LOSS)"
+        azione = "Posizione chiusa per Stop Loss. Attendere rientro o nuovo segnale."
+    else:
+        # Nessun segnale
+        header_status = "⚪ FLAT"
+        azione = "Nessuna copertura richiesta."
+    return header_status, azione
+
+
+def stale_data_warning(last_date, session=None):
+    """
+    Avviso da anteporre al messaggio se l'ultima barra e' precedente all'ultima
+    seduta chiusa (download fallito, dati dalla cache); stringa vuota altrimenti.
+    """
+    last_date = str(last_date)[:10]
+    session = session or market_session_key()
+    if last_date >= session:
+        return ""
+    print(f"ATTENZIONE: ultima barra del {last_date}, ultima seduta chiusa {session}.")
+    return (f"⚠️ **DATI NON AGGIORNATI**: ultima barra del {last_date}, attesa la seduta del {session} "
+            f"(download fallito o giorno festivo). La posizione sotto NON e' aggiornata.\n\n")
+
+
+def publish_signal_artifact(params, last):
+    """
+    Pubblica lo storico dello stato appena salvato come artefatto della seduta e
+    controlla che /contracts del servizio dei segnali serva il target notificato.
+
+    Returns:
+        dict: Il manifest pubblicato, oppure None se lo stato manca o il controllo fallisce.
+    """
+    manifest = publish_state_artifact(params)
+    if manifest is None:
+        print("ATTENZIONE: artefatto non pubblicato (stato incrementale non disponibile).")
+        return None
+    served = json.loads(load_snapshot(manifest)['bodies']['/contracts'])
+    if served['date'] != last['date'] or not math.isclose(served['contracts'], last['MES_Contracts'],
+                                                          rel_tol=1e-12, abs_tol=1e-12):
+        print(f"ERRORE: /contracts ({served['date']}: {served['contracts']}) diverso dal segnale notificato "
+              f"({last['date']}: {last['MES_Contracts']})")
+        return None
+    print(f"Artefatto pubblicato: {manifest['file']} (/contracts = {served['contracts']:.2f})")
+    return manifest
+
+
+def run_portfolio_signals(config_path='config.ini'):
+    """
+    Segnali di tutti i conti e sottostanti configurati con un solo download e
+    un solo calcolo degli indicatori; un messaggio per conto.
+    """
+    print("Avvio processo di generazione segnali multi-conto...")
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    bot_token = config.get('TELEGRAM', 'bot_token')
+    default_chat_id = config.get('TELEGRAM', 'chat_id')
+
+    params, underlyings, books = load_portfolio_config(config_path)
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=SAMPLE_DAYS)
+    print(f"Calcolo segnali dal {start_date} al {end_date} per {len(books)} libri...")
+    try:
+        with telemetry.span('bot.signal', books=len(books)):
+            df = load_portfolio_data(start_date, end_date, underlyings)
+            summary = run_portfolio(df, params, underlyings, books)[0] if df is not None else None
+    except ValueError as e:
+        print(f"Dati incompleti: {e}")
+        summary = None
+
+    if summary is None:
+        error_msg = "ERRORE: Calcolo dei segnali fallito. Nessun dato restituito dalla strategia."
+        print(error_msg)
+        send_telegram_message(error_msg, bot_token, default_chat_id)
+        return
+
+    outgoing = []
+    session = market_session_key()
+    for account, rows in summary.groupby('account', sort=False):
+        first = rows.iloc[0]
+        cmi_status_icon = "🟢" if first['Signal_CMI'] == 1 else "⚪"
+        vix_status_icon = "🟢" if first['Signal_VIX'] == 1 else "⚪"
+        sections = []
+        for _, row in rows.iterrows():
+            header_status, azione = hedge_status(row['contracts'], row['Signal_Count'], row['contract_name'])
+            sections.append(
+                f"**{row['underlying']}** - Stato: **{header_status}**\n"
+                f"📉 Contratti Reali: {row['contracts']:.2f} | SL: {row['stop_loss_threshold_hedge']*100:.0f}%\n"
+                f"💡 {azione}"
+            )
+        message = (
+            f"**Segnale Kriterion {account} - {first['date']}** 🔱\n\n"
+            + stale_data_warning(first['date'], session)
+            + f"*- CMI*: {cmi_status_icon}\n"
+            f"*- VIX Ratio*: {vix_status_icon}\n"
+            f"*- Segnale Raw*: {first['Signal_Count']} Tranche\n\n"
+            + "\n\n".join(sections)
+            + f"\n\n[Apri Dashboard Interattiva]({DASHBOARD_URL})"
+        )
+        print(f"\n--- Notifica Telegram ({account}) ---")
+        print(message)
+        chat_id = first['chat_id'] if pd.notna(first['chat_id']) else default_chat_id
+        outgoing.extend((chat, message) for chat in str(chat_id).split(',') if chat.strip())
+
+    # Tutti i conti in un solo invio: chat diverse in parallelo entro i limiti di Telegram
+    notifier = get_notifier(bot_token)
+    notifier.flush_outbox()
+    with telemetry.span('bot.notify', messages=len(outgoing)):
+        records = notifier.send_many(outgoing)
+    delivered = sum(record['ok'] for record in records)
+    print(f"\nConsegnati {delivered}/{len(records)} messaggi "
+          f"(latenza max {max((r['latency_s'] for r in records), default=0):.2f}s, "
+          f"in outbox: {len(notifier.pending())})")
 
 def run_automated_signal():
     """
@@ -17,42 +151,43 @@ def run_automated_signal():
     print("Avvio processo di generazione segnale automatico S&P...")
     config = configparser.ConfigParser()
     config.read('config.ini')
-    
-    # Carica i parametri della strategia dal config
-    params = dict(config['STRATEGY_PARAMS'])
-    for key, value in params.items():
-        try:
-            params[key] = float(value)
-        except (ValueError, TypeError):
-            pass
 
+    # Carica i parametri della strategia dal config
+    params = load_strategy_params('config.ini')
     # Assicuriamo che lo Stop Loss sia impostato (default 5% se manca)
-    if 'stop_loss_threshold_hedge' not in params:
-        params['stop_loss_threshold_hedge'] = 0.05
+    params.setdefault('stop_loss_threshold_hedge', 0.05)
 
     # Carica le credenziali del bot
     bot_token = config.get('TELEGRAM', 'bot_token')
     chat_id = config.get('TELEGRAM', 'chat_id')
+    # Rinvia prima i messaggi rimasti in outbox dai run precedenti
+    get_notifier(bot_token).flush_outbox()
 
     # Periodo di calcolo
     end_date = datetime.date.today()
-    start_date = end_date - datetime.timedelta(days=400) 
+    force_full = os.environ.get("KRITERION_FORCE_FULL", "").lower() in ("1", "true", "yes")
 
-    print(f"Calcolo segnali dal {start_date} al {end_date}...")
-    # Esegue la strategia (che ora ritorna df_final con la colonna 'MES_Contracts')
-    results = run_full_strategy(params, start_date, end_date)
+    print(f"Calcolo segnali al {end_date} (stato incrementale)...")
+    # Avanza lo stato persistito solo sulle barre nuove; ricalcolo completo al primo avvio,
+    # al cambio parametri e periodicamente per verifica
+    with telemetry.span('bot.signal') as attrs:
+        last, info = run_incremental_signal(params, end_date, force_full=force_full)
+        attrs.update(mode=info['mode'], new_bars=info['new_bars'])
+    print(f"Modalita': {info['mode']}, barre nuove: {info['new_bars']}, verifica: {info['verified']}")
 
     # Validazione risultati
-    if results is None or results[5] is None or results[5].empty:
+    if last is None:
         error_msg = "ERRORE: Calcolo dei segnali fallito. Nessun dato restituito dalla strategia."
         print(error_msg)
         send_telegram_message(error_msg, bot_token, chat_id)
         return
 
+    # Lo stesso calcolo alimenta dashboard e servizio dei segnali (nessun secondo run)
+    with telemetry.span('bot.publish'):
+        publish_signal_artifact(params, last)
+
     # Estrazione dati ultima candela
-    df_results = results[5]
-    last = df_results.iloc[-1]
-    current_date = last.name.strftime('%Y-%m-%d')
+    current_date = last['date']
     
     # Indicatori grezzi
     signal_cmi = int(last.get('Signal_CMI', 0))
@@ -60,31 +195,18 @@ def run_automated_signal():
     signal_count_raw = int(last.get('Signal_Count', 0))
     
     # --- LOGICA DI CONTROLLO STATO REALE ---
-    # Leggiamo i contratti effettivi. Se negativi, siamo Short (Coperti).
     contracts = last.get('MES_Contracts', 0)
-    is_hedged_active = contracts < -0.01 # Usiamo una soglia float negativa
     
     # Formattazione stati indicatori
     cmi_status_icon = "🟢" if signal_cmi == 1 else "⚪"
     vix_status_icon = "🟢" if signal_vix == 1 else "⚪"
 
     # Determinazione Stato Finale e Azione
-    if is_hedged_active:
-        header_status = "🟢 COPERTURA ATTIVA"
-        azione = f"Mantenere {abs(contracts):.2f} contratti Micro ES Short."
-    elif signal_count_raw > 0 and not is_hedged_active:
-        # C'è segnale ma contratti a 0 -> È scattato lo STOP LOSS
-        header_status = "🔴 NON ATTIVO (STOP LOSS)"
-        azione = "Posizione chiusa per Stop Loss. Attendere rientro o nuovo segnale."
-    else:
-        # Nessun segnale
-        header_status = "⚪ FLAT"
-        azione = "Nessuna copertura richiesta."
-    
-    dashboard_url = "https://kriterionquanthedging-ftyojbunrcy7wjgsj8ajrc.streamlit.app/"
+    header_status, azione = hedge_status(contracts, signal_count_raw)
 
     message = (
         f"**Segnale Kriterion S&P - {current_date}** 🔱\n\n"
+        f"{stale_data_warning(current_date)}"
         f"Stato: **{header_status}**\n\n"
         f"*- CMI*: {cmi_status_icon}\n"
         f"*- VIX Ratio*: {vix_status_icon}\n"
@@ -92,12 +214,26 @@ def run_automated_signal():
         f"📉 **Contratti Reali:** {contracts:.2f}\n"
         f"💡 **Azione:** {azione}\n\n"
         f"⚙️ _SL Impostato: {params['stop_loss_threshold_hedge']*100:.0f}%_\n"
-        f"[Apri Dashboard Interattiva]({dashboard_url})"
+        f"[Apri Dashboard Interattiva]({DASHBOARD_URL})"
     )
 
     print("\n--- Invio Notifica Telegram ---")
     print(message)
-    send_telegram_message(message, bot_token, chat_id)
+    with telemetry.span('bot.notify'):
+        send_telegram_message(message, bot_token, chat_id)
 
 if __name__ == '__main__':
-    run_automated_signal()
+    # Metriche della corsa in .cache/metrics.jsonl (KRITERION_METRICS_FILE);
+    # con KRITERION_PROFILE=cprofile|pyinstrument anche il profilo della corsa
+    telemetry.reset('bot')
+    try:
+        with telemetry.profile('bot'):
+            # Con sezioni [UNDERLYING:...] / [ACCOUNT:...] nel config: tutti i libri in un solo run
+            if portfolio_configured():
+                run_portfolio_signals()
+            else:
+                run_automated_signal()
+    finally:
+        record = telemetry.write_metrics()
+        if record is not None:
+            print("\n" + telemetry.format_summary(record))
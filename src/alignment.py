@@ -0,0 +1,263 @@
+# src/alignment.py
+"""
+Allineamento in un solo passaggio di prezzi e serie macro su un calendario di sedute.
+
+Il frame della strategia e' costruito su un unico indice: le sedute del
+primo ticker disponibile (SPY, lo strumento negoziato). Su quell'indice:
+
+- i prezzi di ogni ticker sono scritti in un blocco float64 preallocato e i
+  buchi vengono riempiti in avanti per al massimo PRICE_FILL_LIMIT sedute,
+  in un'unica operazione vettoriale su tutte le colonne; oltre il limite la
+  barra resta senza prezzo e, se manca un prezzo essenziale, viene scartata
+  invece di riusare quotazioni vecchie di settimane;
+- le serie FRED sono unite point-in-time (as-of all'indietro): una
+  osservazione datata D e' visibile solo dalla seduta in cui e' pubblicata,
+  D piu' il ritardo di rilascio della serie in giorni lavorativi
+  (RELEASE_LAGS). Le osservazioni cadute in giorni senza seduta non vanno
+  perse e l'ultimo valore pubblicato resta valido fino al successivo, anche
+  per le serie dismesse.
+
+Gli stessi array usati per l'allineamento danno il rapporto sui buchi (una
+riga per colonna), senza copie aggiuntive del frame.
+
+Uso da riga di comando:
+
+    python -m src.alignment --start 2024-01-01
+"""
+
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from src import telemetry
+
+# Sedute consecutive su cui un prezzo mancante viene riportato in avanti
+PRICE_FILL_LIMIT = 5
+# Giorni lavorativi tra la data di un'osservazione FRED e la sua pubblicazione:
+# i tassi e gli spread del giorno D escono dopo la chiusura USA o il giorno dopo
+DEFAULT_RELEASE_LAG = 1
+RELEASE_LAGS = {
+    'TED_Spread': 1,
+    'Yield_Curve_10Y2Y': 1,
+    'VIX': 1,
+    'High_Yield_Spread': 1,
+}
+GAP_REPORT_COLUMNS = ['source', 'first', 'last', 'observations', 'filled', 'unfilled', 'max_gap',
+                      'stale_sessions', 'release_lag']
+
+
+def _release_lag(name, release_lags):
+    if release_lags is None:
+        return RELEASE_LAGS.get(name, DEFAULT_RELEASE_LAG)
+    if isinstance(release_lags, dict):
+        return release_lags.get(name, DEFAULT_RELEASE_LAG)
+    return int(release_lags)
+
+
+def _days(index):
+    return index.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+
+
+def fill_forward_limited(column, limit):
+    """
+    Forward-fill in place di column per al massimo limit barre.
+
+    Returns:
+        np.ndarray: Eta' in barre del valore di ogni barra (0 se osservato, -1 prima della
+        prima osservazione).
+    """
+    rows = np.arange(len(column))
+    last = np.where(np.isnan(column), -1, rows)
+    np.maximum.accumulate(last, out=last)
+    age = rows - last
+    age[last < 0] = -1
+    fill = (age > 0) & (age <= limit)
+    column[fill] = column[last[fill]]
+    return age
+
+
+def asof_values(dates, observations, session_days, lag):
+    """
+    Valori visibili a ogni seduta con ritardo di rilascio lag.
+
+    Args:
+        dates (np.ndarray): Date delle osservazioni (datetime64[D], crescenti, senza NaN).
+        observations (np.ndarray): Valori delle osservazioni.
+        session_days (np.ndarray): Giorni delle sedute (datetime64[D], crescenti, distinti).
+        lag (int): Giorni lavorativi tra data dell'osservazione e pubblicazione.
+
+    Returns:
+        tuple: (valori per seduta, indice della seduta da cui e' visibile il valore usato, -1 se nessuno).
+    """
+    if not len(dates):
+        return np.full(len(session_days), np.nan), np.full(len(session_days), -1)
+    available = np.busday_offset(dates, lag, roll='forward')
+    pos = np.searchsorted(available, session_days, side='right') - 1
+    published = pos >= 0
+    pos[~published] = 0
+    values = observations[pos]
+    values[~published] = np.nan
+    visible_from = np.searchsorted(session_days, available, side='left')[pos]
+    visible_from[~published] = -1
+    return values, visible_from
+
+
+def _gap_row(present, age, limit, stale):
+    """Conteggi di una colonna: present barre con valore proprio, age eta' del valore (-1 = nessuno)."""
+    observations = int(np.count_nonzero(present))
+    filled = int(np.count_nonzero((age > 0) & (age <= limit)))
+    return {'observations': observations, 'filled': filled, 'unfilled': len(age) - observations - filled,
+            'max_gap': int(age.max(initial=-1)), 'stale_sessions': stale}
+
+
+def align_sources(price_columns, macro_columns, release_lags=None, price_fill_limit=PRICE_FILL_LIMIT):
+    """
+    Allinea prezzi e serie macro sul calendario del primo prezzo.
+
+    Il calendario puo' essere giornaliero o intraday: le serie macro cambiano
+    al piu' una volta per seduta e sono unite sui giorni distinti del
+    calendario, poi espanse sulle barre.
+
+    Args:
+        price_columns (list): Coppie (nome colonna, Series) dei prezzi; la prima definisce il calendario.
+        macro_columns (list): Coppie (nome colonna, Series) delle serie macro indicizzate per data.
+        release_lags (dict | int | None): Ritardi di rilascio per colonna macro (default RELEASE_LAGS),
+            oppure un unico ritardo per tutte (0 = valore visibile il giorno stesso).
+        price_fill_limit (int): Barre massime di forward-fill dei prezzi (sedute sul giornaliero).
+
+    Returns:
+        tuple: (DataFrame allineato, DataFrame del rapporto sui buchi con una riga per colonna).
+        Nel rapporto filled/unfilled contano le barre riempite e rimaste vuote, max_gap e' il
+        buco piu' lungo (in barre per i prezzi, in sedute per le serie macro), stale_sessions
+        le sedute dall'ultimo valore all'ultima barra; -1 indica una colonna mai osservata e
+        release_lag e' -1 per i prezzi.
+    """
+    calendar = price_columns[0][1].index if price_columns else pd.DatetimeIndex([], name='Date')
+    if not calendar.is_monotonic_increasing or calendar.has_duplicates:
+        calendar = calendar[~calendar.duplicated()].sort_values()
+    calendar_days = _days(calendar)
+    n, n_prices = len(calendar), len(price_columns)
+    names = [name for name, _ in price_columns] + [name for name, _ in macro_columns]
+    new_session = np.empty(n, dtype=bool)
+    new_session[:1] = True
+    np.not_equal(calendar_days[1:], calendar_days[:-1], out=new_session[1:])
+    session_of_bar = np.cumsum(new_session) - 1
+    session_days = calendar_days[new_session]
+    intraday = len(session_days) < n
+
+    # Ordine Fortran: ogni colonna e' contigua, ed e' il layout dei blocchi di pandas
+    values = np.empty((n, len(names)), order='F')
+    report = []
+
+    # Open e Close dello stesso ticker condividono l'indice: un solo get_indexer per ticker
+    last_index, indexer = calendar, None
+    for j, (name, series) in enumerate(price_columns):
+        column = series.to_numpy(dtype=float, na_value=np.nan)
+        if series.index is not last_index and not series.index.equals(last_index):
+            last_index = series.index
+            indexer = None if last_index.equals(calendar) else last_index.get_indexer(calendar)
+        if indexer is None:
+            values[:, j] = column
+        else:
+            values[:, j] = column[indexer] if len(column) else np.nan
+            values[indexer < 0, j] = np.nan
+        missing = np.isnan(values[:, j])
+        if not missing.any():
+            row = {'observations': n, 'filled': 0, 'unfilled': 0, 'max_gap': 0, 'stale_sessions': 0}
+            seen = (0, n - 1) if n else None
+        else:
+            age = fill_forward_limited(values[:, j], price_fill_limit)
+            observed = np.flatnonzero(~missing)
+            seen = (observed[0], observed[-1]) if len(observed) else None
+            stale = int(session_of_bar[-1] - session_of_bar[seen[1]]) if seen else -1
+            row = _gap_row(~missing, age, price_fill_limit, stale)
+        report.append(dict(row, source='market', release_lag=-1,
+                           first=calendar_days[seen[0]] if seen else None,
+                           last=calendar_days[seen[1]] if seen else None))
+
+    for k, (name, series) in enumerate(macro_columns, start=n_prices):
+        lag = _release_lag(name, release_lags)
+        observations = series.to_numpy(dtype=float, na_value=np.nan)
+        dates = _days(series.index)
+        valid = ~np.isnan(observations)
+        dates, observations = dates[valid], observations[valid]
+        if not series.index.is_monotonic_increasing:
+            order = np.argsort(dates, kind='stable')
+            dates, observations = dates[order], observations[order]
+        if len(dates) > 1 and not (dates[1:] > dates[:-1]).all():
+            # Piu' osservazioni nello stesso giorno: vale l'ultima
+            last_of_day = np.append(dates[1:] != dates[:-1], True)
+            dates, observations = dates[last_of_day], observations[last_of_day]
+        if n:
+            # Osservazioni successive all'ultima barra: non fanno parte della finestra
+            stop = np.searchsorted(dates, calendar_days[-1], side='right')
+            dates, observations = dates[:stop], observations[:stop]
+        by_session, visible_from = asof_values(dates, observations, session_days, lag)
+        values[:, k] = by_session[session_of_bar] if intraday else by_session
+        age = np.where(visible_from >= 0, np.arange(len(session_days)) - visible_from, -1)
+        row = _gap_row(age == 0, age, len(session_days), int(age[-1]) if n else -1)
+        if intraday:
+            # Conteggi in barre, come per i prezzi
+            bars = np.bincount(session_of_bar, minlength=len(session_days))
+            row.update(filled=int(bars[age > 0].sum()), unfilled=int(bars[age < 0].sum()),
+                       observations=int(bars[age == 0].sum()))
+        report.append(dict(row, source='fred', release_lag=lag,
+                           first=dates[0] if len(dates) else None, last=dates[-1] if len(dates) else None))
+
+    df = pd.DataFrame(values, index=calendar.rename('Date'), columns=names, copy=False)
+    gaps = pd.DataFrame(report, index=pd.Index(names, name='name'), columns=GAP_REPORT_COLUMNS)
+    for col in ('first', 'last'):
+        gaps[col] = pd.to_datetime(gaps[col])
+
+    for name, row in zip(names[:n_prices], report):
+        if row['unfilled']:
+            telemetry.event('align.unfilled', column=name, bars=row['unfilled'], max_gap=row['max_gap'])
+    return df, gaps
+
+
+def drop_incomplete(df, columns):
+    """Scarta le barre senza uno dei prezzi in columns (di solito solo le prime); ritorna (df, scartate)."""
+    keep = np.ones(len(df), dtype=bool)
+    for col in columns:
+        keep &= ~np.isnan(df[col].to_numpy())
+    if keep.all():
+        return df, 0
+    first = int(np.argmax(keep)) if keep.any() else len(keep)
+    if keep[first:].all():
+        # Solo testa incompleta: copia delle righe successive (una vista, con pandas < 3,
+        # darebbe SettingWithCopyWarning alle colonne aggiunte poi dagli indicatori)
+        return df.iloc[first:].copy(), first
+    return df[keep], int((~keep).sum())
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    # Import locale: src.strategy importa questo modulo
+    from src.strategy import align_master_frame, load_strategy_data
+
+    parser = argparse.ArgumentParser(description="Rapporto sui buchi di prezzi e serie macro allineati.")
+    parser.add_argument('--start', default=None, help="Data inizio (default: 2 anni fa)")
+    parser.add_argument('--end', default=None, help="Data fine (default: oggi)")
+    parser.add_argument('--fill-limit', type=int, default=PRICE_FILL_LIMIT)
+    args = parser.parse_args(argv)
+
+    end_date = datetime.date.fromisoformat(args.end) if args.end else datetime.date.today()
+    start_date = datetime.date.fromisoformat(args.start) if args.start else end_date - datetime.timedelta(days=730)
+    market_data_dfs, cmi_data_dict = load_strategy_data(start_date, end_date)
+    if not market_data_dfs:
+        print("Download dati fallito.")
+        return 1
+    df, gaps = align_master_frame(market_data_dfs, cmi_data_dict, price_fill_limit=args.fill_limit)
+    print(f"{len(df)} sedute dal {df.index[0]:%Y-%m-%d} al {df.index[-1]:%Y-%m-%d}")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(gaps)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,299 @@
+# src/artifact.py
+"""
+Artefatto precalcolato di segnali e backtest per i parametri di default.
+
+La dashboard ricalcolava ad ogni apertura download, indicatori e backtest
+degli ultimi due anni solo per mostrare il segnale del giorno. Qui il bot,
+dopo aver calcolato il segnale, pubblica una volta per seduta lo storico del
+proprio stato incrementale (src.incremental), cosi' dashboard e servizio dei
+segnali mostrano gli stessi numeri del messaggio Telegram:
+
+- un file Arrow IPC non compresso con lo storico per barra del bot
+  (chiusure, indicatori, segnali, contratti ed equity), versionato con la
+  data dell'ultima barra e l'impronta dei parametri;
+- un manifest.json con versione del formato, parametri, intervallo di
+  date, seduta e nome del file corrente.
+
+Il file viene scritto a parte e poi sostituito atomicamente, il manifest per
+ultimo, cosi' chi legge vede sempre un artefatto completo. La lettura mappa
+il file in memoria: le colonne numeriche senza valori null diventano array
+numpy che puntano direttamente nella mappa (nessuna copia), quindi aprire il
+segnale del giorno costa una lettura del manifest.
+
+Se dashboard e job non condividono il disco, la cartella pubblicata puo'
+essere servita via HTTP (ad esempio un branch del repository) e
+sincronizzata con sync_artifact.
+
+Uso da riga di comando:
+
+    python -m src.artifact publish
+    python -m src.artifact show
+    python -m src.artifact sync --url https://.../signal-artifacts
+"""
+
+import argparse
+import datetime
+import json
+import os
+
+import pyarrow as pa
+import requests
+
+from src.data_cache import market_session_key
+from src.incremental import (STATE_VERSION, STRATEGY_PARAM_KEYS, history_frame, load_state, params_fingerprint,
+                             run_incremental_signal)
+from src.strategy import load_strategy_params
+
+ARTIFACT_VERSION = 1
+ARTIFACT_DIR_DEFAULT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'artifacts'
+)
+MANIFEST_NAME = 'manifest.json'
+INDEX_COLUMN = 'Date'
+KEEP_ARTIFACTS = 5
+SYNC_TIMEOUT_SECONDS = 30
+
+
+def get_artifact_dir():
+    """Cartella degli artefatti (sovrascrivibile con KRITERION_ARTIFACT_DIR)."""
+    return os.environ.get('KRITERION_ARTIFACT_DIR', ARTIFACT_DIR_DEFAULT)
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_json(path, payload):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=1)
+    _write_atomic(path, write)
+
+
+# ==============================================================================
+# SCRITTURA
+# ==============================================================================
+
+def frame_to_table(df):
+    """
+    Tabella Arrow del frame con l'indice come prima colonna.
+
+    Le colonne sono convertite dagli array numpy: i NaN restano NaN (non null),
+    cosi' in lettura le colonne tornano numpy senza maschere ne' copie.
+    """
+    columns = {INDEX_COLUMN: pa.array(df.index.to_numpy())}
+    for col in df.columns:
+        columns[str(col)] = pa.array(df[col].to_numpy())
+    return pa.table(columns)
+
+
+def publish_artifact(df, params, start_date, end_date, directory=None, session_key=None, keep=KEEP_ARTIFACTS):
+    """
+    Pubblica un frame dei risultati come nuovo artefatto corrente.
+
+    Args:
+        df (pd.DataFrame): Frame per barra (storico del bot o df_con_risultati).
+        params (dict): Parametri con cui e' stato calcolato.
+        start_date, end_date (datetime.date): Intervallo richiesto.
+        directory (str): Cartella di destinazione (default get_artifact_dir()).
+        session_key (str): Seduta di riferimento (default market_session_key()).
+        keep (int): Artefatti da conservare oltre al corrente.
+
+    Returns:
+        dict: Il manifest scritto.
+    """
+    directory = directory or get_artifact_dir()
+    os.makedirs(directory, exist_ok=True)
+    fingerprint = params_fingerprint(params)
+    last_date = df.index[-1].date()
+    file_name = f"signals_{last_date:%Y%m%d}_{fingerprint[:12]}.arrow"
+    table = frame_to_table(df)
+
+    def write(tmp_path):
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    _write_atomic(os.path.join(directory, file_name), write)
+
+    manifest = {
+        'version': ARTIFACT_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'session': session_key or market_session_key(),
+        'fingerprint': fingerprint,
+        'params': {k: float(params[k]) for k in STRATEGY_PARAM_KEYS if k in params},
+        'start_date': str(start_date),
+        'end_date': str(end_date),
+        'last_date': last_date.isoformat(),
+        'file': file_name,
+        'rows': table.num_rows,
+        'columns': table.column_names[1:],
+    }
+    _write_json(os.path.join(directory, MANIFEST_NAME), manifest)
+    _prune(directory, file_name, keep)
+    return manifest
+
+
+def _prune(directory, current, keep):
+    """Rimuove gli artefatti piu' vecchi oltre i keep piu' recenti (il corrente resta sempre)."""
+    files = sorted((f for f in os.listdir(directory) if f.startswith('signals_') and f.endswith('.arrow')
+                    and f != current), key=lambda f: os.path.getmtime(os.path.join(directory, f)), reverse=True)
+    for name in files[keep:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def publish_state_artifact(params, state_path=None, directory=None):
+    """
+    Pubblica lo storico dello stato incrementale del bot come artefatto corrente.
+
+    Nessun ricalcolo: il frame e' history_frame dello stato salvato, la cui
+    ultima riga e' il last_signal notificato. Ritorna il manifest, oppure None
+    se lo stato manca o e' stato calcolato con altri parametri.
+    """
+    state = load_state(state_path)
+    if (state is None or state.get('version') != STATE_VERSION
+            or state.get('params_key') != params_fingerprint(params) or not state['history']['rows']):
+        return None
+    df = history_frame(state)
+    return publish_artifact(df, params, df.index[0].date(), df.index[-1].date(), directory)
+
+
+def publish_default_artifact(config_path='config.ini', end_date=None, directory=None):
+    """Avanza lo stato del bot con i parametri del config (come bot_runner) e ne pubblica lo storico."""
+    params = load_strategy_params(config_path)
+    params.setdefault('stop_loss_threshold_hedge', 0.05)
+    last_signal, _ = run_incremental_signal(params, end_date)
+    if last_signal is None:
+        return None
+    return publish_state_artifact(params, directory=directory)
+
+
+# ==============================================================================
+# LETTURA
+# ==============================================================================
+
+def read_manifest(directory=None):
+    try:
+        with open(os.path.join(directory or get_artifact_dir(), MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def artifact_path(manifest, directory=None):
+    return os.path.join(directory or get_artifact_dir(), manifest['file'])
+
+
+def open_artifact(path):
+    """Frame dell'artefatto mappato in memoria (colonne in sola lettura, senza copie)."""
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    df = table.to_pandas(split_blocks=True)
+    return df.set_index(INDEX_COLUMN)
+
+
+def current_manifest(params, session_key=None, directory=None):
+    """
+    Manifest dell'artefatto corrente se utilizzabile per params, altrimenti None.
+
+    Serve stessa versione del formato, stessa impronta dei parametri, la
+    seduta corrente (market_session_key) e il file presente su disco.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None or manifest.get('version') != ARTIFACT_VERSION:
+        return None
+    if manifest.get('fingerprint') != params_fingerprint(params):
+        return None
+    if manifest.get('session') != (session_key or market_session_key()):
+        return None
+    if not os.path.exists(artifact_path(manifest, directory)):
+        return None
+    return manifest
+
+
+def load_artifact(params, session_key=None, directory=None):
+    """Frame dei risultati pubblicato per params e seduta correnti, oppure None."""
+    manifest = current_manifest(params, session_key, directory)
+    if manifest is None:
+        return None
+    return open_artifact(artifact_path(manifest, directory))
+
+
+def sync_artifact(base_url, directory=None, timeout=SYNC_TIMEOUT_SECONDS):
+    """
+    Copia in locale l'artefatto corrente pubblicato all'URL base_url.
+
+    Scarica il manifest remoto e, se il file indicato non e' gia' presente,
+    il file stesso; il manifest locale viene sostituito solo a download
+    completato. Ritorna il manifest locale aggiornato, o None in caso di errore.
+    """
+    directory = directory or get_artifact_dir()
+    base_url = base_url.rstrip('/')
+    try:
+        response = requests.get(f"{base_url}/{MANIFEST_NAME}", timeout=timeout)
+        response.raise_for_status()
+        manifest = response.json()
+        if manifest.get('version') != ARTIFACT_VERSION:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = artifact_path(manifest, directory)
+        if not os.path.exists(path):
+            response = requests.get(f"{base_url}/{manifest['file']}", timeout=timeout)
+            response.raise_for_status()
+
+            def write(tmp_path):
+                with open(tmp_path, 'wb') as f:
+                    f.write(response.content)
+            _write_atomic(path, write)
+    except (requests.RequestException, ValueError, KeyError, OSError) as e:
+        print(f"Sincronizzazione artefatto fallita: {e}")
+        return None
+    _write_json(os.path.join(directory, MANIFEST_NAME), manifest)
+    _prune(directory, manifest['file'], KEEP_ARTIFACTS)
+    return manifest
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pubblica o ispeziona l'artefatto precalcolato dei segnali.")
+    parser.add_argument('action', choices=['publish', 'show', 'sync'])
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--dir', default=None, help="Cartella degli artefatti (default KRITERION_ARTIFACT_DIR).")
+    parser.add_argument('--end', default=None, help="Data fine (default: oggi)")
+    parser.add_argument('--url', default=None, help="URL base da cui sincronizzare (azione sync).")
+    args = parser.parse_args(argv)
+
+    if args.action == 'publish':
+        end_date = datetime.date.fromisoformat(args.end) if args.end else None
+        manifest = publish_default_artifact(args.config, end_date, args.dir)
+        if manifest is None:
+            print("ERRORE: calcolo della strategia fallito, nessun artefatto pubblicato.")
+            return 1
+    elif args.action == 'sync':
+        url = args.url or os.environ.get('KRITERION_ARTIFACT_URL')
+        if not url:
+            parser.error("serve --url o KRITERION_ARTIFACT_URL")
+        manifest = sync_artifact(url, args.dir)
+        if manifest is None:
+            return 1
+    else:
+        manifest = read_manifest(args.dir)
+        if manifest is None:
+            print("Nessun artefatto pubblicato.")
+            return 1
+    print(json.dumps(manifest, indent=1))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
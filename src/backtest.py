@@ -0,0 +1,415 @@
+# src/backtest.py
+"""
+Kernel del backtest della copertura con Micro ES su array NumPy.
+
+Replica esattamente il loop storico di run_full_strategy (tranche, stop loss
+e latch di stop-out) ma lavora su array preallocati invece di leggere e
+scrivere il DataFrame riga per riga: il DataFrame dei risultati viene
+assemblato una sola volta dal chiamante.
+
+Oltre alle colonne per barra il kernel registra il registro degli eventi
+della copertura (HedgeLedger): poche centinaia di righe su vent'anni, da cui
+statistiche per ciclo e marker dei grafici si calcolano in O(eventi).
+"""
+
+import numpy as np
+
+# Tipi di evento del registro, con i nomi degli eventi di src.streaming. MARK non e'
+# un'operazione: chiude il registro con la posizione ancora aperta all'ultima barra
+LEDGER_KINDS = ('ENTRY', 'ADD', 'REDUCE', 'EXIT', 'STOP', 'REARM', 'MARK')
+ENTRY, ADD, REDUCE, EXIT, STOP, REARM, MARK = range(len(LEDGER_KINDS))
+# Chiave di DataFrame.attrs con il registro del frame di run_backtest
+LEDGER_ATTR = 'hedge_ledger'
+
+
+class HedgeLedger:
+    """
+    Registro degli eventi della copertura in array paralleli, in ordine di barra.
+
+    Ogni evento ha la barra, il tipo (codice in LEDGER_KINDS), le tranche e i
+    contratti dopo l'evento, il prezzo ES e il valore del portafoglio della
+    barra. cycle_pnl e' il PnL cumulato della copertura dall'ENTRY del ciclo
+    (barra dell'evento inclusa); adverse e worst_day sono il minimo di quel
+    cumulato e il peggior PnL giornaliero (0 se nessuno negativo) sulle barre
+    dall'evento precedente: i minimi di un ciclo sono quindi riduzioni sui suoi
+    eventi, senza tornare alle barre.
+
+    Args:
+        n_bars (int): Barre del backtest che ha prodotto il registro.
+        columns (dict): Array per campo, con le chiavi di FIELDS.
+    """
+
+    FIELDS = ('bar', 'kind', 'tranches', 'contracts', 'es_price', 'portfolio_value', 'cycle_pnl', 'adverse',
+              'worst_day')
+
+    def __init__(self, n_bars, columns):
+        self.n_bars = n_bars
+        for field in self.FIELDS:
+            values = columns[field]
+            values.setflags(write=False)
+            setattr(self, field, values)
+        # Date degli eventi, assegnate da chi conosce l'indice (run_backtest)
+        self.dates = None
+
+    def __len__(self):
+        return len(self.bar)
+
+    def __deepcopy__(self, memo):
+        # Array in sola lettura: pandas copia DataFrame.attrs a ogni operazione, il registro si condivide
+        return self
+
+    def kind_names(self):
+        return np.array(LEDGER_KINDS, dtype=object)[self.kind]
+
+
+def run_backtest_kernel(spy_close, es_close, signal_count, initial_spy_price, capital,
+                        hedge_percentage_per_tranche, stop_loss_threshold_hedge, micro_es_multiplier):
+    """
+    Esegue la macchina a stati della copertura barra per barra.
+
+    Args:
+        spy_close, es_close (array-like): Chiusure SPY ed ES allineate.
+        signal_count (array-like): Tranche target per barra (Signal_Count).
+        initial_spy_price (float): Prezzo di acquisto iniziale di SPY (apertura prima barra).
+        capital (float): Capitale iniziale.
+        hedge_percentage_per_tranche (float): Nozionale coperto per tranche (frazione del portafoglio).
+        stop_loss_threshold_hedge (float): Rialzo dell'ES oltre l'entrata che chiude la copertura.
+        micro_es_multiplier (float): Moltiplicatore del contratto Micro ES.
+
+    Returns:
+        dict: Array per barra 'portfolio_value', 'mes_contracts', 'hedge_pnl',
+        'equity_at_hedge_entry'; contatori 'hedge_trades_count', 'stop_loss_events';
+        'ledger' (HedgeLedger degli eventi); 'final_state' con lo stato interno all'ultima barra.
+    """
+    # Liste Python per l'accesso scalare (molto piu' veloce di .iloc / indicizzazione NumPy)
+    spy = np.asarray(spy_close, dtype=float).tolist()
+    es = np.asarray(es_close, dtype=float).tolist()
+    targets = np.asarray(signal_count).tolist()
+    n = len(spy)
+
+    portfolio_values = np.empty(n)
+    mes_contracts = np.zeros(n)
+    hedge_pnl = np.zeros(n)
+    equity_at_hedge_entry = np.full(n, np.nan)
+
+    spy_shares = capital / initial_spy_price
+    cash_from_hedging = 0.0
+    es_contracts = 0
+    hedge_entry_price = 0.0
+    current_tranches = 0
+    hedge_trades_count = 0
+    hedge_stopped_out = False
+    stop_loss_events = 0
+
+    # Registro: barra, tipo e tranche dopo l'evento in una lista piatta (tre valori per
+    # evento); il resto si ricava dagli array per barra a fine loop (ledger_from_events)
+    events = []
+
+    if n:
+        portfolio_values[0] = capital
+
+    for i in range(1, n):
+        price_spy = spy[i]
+        price_es_curr = es[i]
+        price_es_prev = es[i - 1]
+
+        # 1. Calcolo PnL della posizione tenuta da IERI a OGGI
+        if current_tranches > 0:
+            daily_hedge_pnl = es_contracts * (price_es_curr - price_es_prev) * micro_es_multiplier
+            cash_from_hedging += daily_hedge_pnl
+            hedge_pnl[i] = daily_hedge_pnl
+
+            # 2. Check Stop Loss (sulla chiusura di OGGI)
+            if price_es_curr > hedge_entry_price * (1 + stop_loss_threshold_hedge):
+                current_tranches = 0
+                es_contracts = 0
+                hedge_stopped_out = True
+                stop_loss_events += 1
+                events.extend((i, STOP, 0))
+
+        # 3. Gestione Segnale
+        target_tranches = targets[i]
+
+        if target_tranches == 0 and hedge_stopped_out:
+            hedge_stopped_out = False
+            # Stop e target 0 nella stessa barra: il latch non resta armato, nessun REARM (come src.streaming)
+            if events[-3] != i:
+                events.extend((i, REARM, 0))
+
+        if not hedge_stopped_out:
+            if target_tranches > current_tranches:
+                # AUMENTO ESPOSIZIONE
+                tranches_to_add = target_tranches - current_tranches
+                portfolio_value_now = (spy_shares * price_spy) + cash_from_hedging
+                notional_per_tranche = portfolio_value_now * hedge_percentage_per_tranche
+
+                # Calcolo contratti (Short = negativo)
+                contracts_to_add = - (notional_per_tranche / (price_es_curr * micro_es_multiplier)) * tranches_to_add
+
+                if current_tranches == 0:
+                    hedge_entry_price = price_es_curr
+                    hedge_trades_count += 1
+                    equity_at_hedge_entry[i] = portfolio_value_now
+                    events.extend((i, ENTRY, target_tranches))
+                else:
+                    events.extend((i, ADD, target_tranches))
+
+                es_contracts += contracts_to_add
+                current_tranches = target_tranches
+
+            elif target_tranches < current_tranches:
+                # RIDUZIONE ESPOSIZIONE
+                ratio = target_tranches / current_tranches
+                es_contracts = es_contracts * ratio
+                current_tranches = target_tranches
+                events.extend((i, REDUCE if current_tranches else EXIT, current_tranches))
+
+        portfolio_values[i] = (spy_shares * price_spy) + cash_from_hedging
+        mes_contracts[i] = es_contracts
+
+    if current_tranches > 0:
+        events.extend((n - 1, MARK, current_tranches))
+    ledger = ledger_from_events(events, hedge_pnl, mes_contracts, np.asarray(es_close, dtype=float), portfolio_values)
+
+    return {
+        'portfolio_value': portfolio_values,
+        'mes_contracts': mes_contracts,
+        'hedge_pnl': hedge_pnl,
+        'equity_at_hedge_entry': equity_at_hedge_entry,
+        'hedge_trades_count': hedge_trades_count,
+        'stop_loss_events': stop_loss_events,
+        'ledger': ledger,
+        'final_state': {
+            'spy_shares': float(spy_shares),
+            'cash_from_hedging': float(cash_from_hedging),
+            'es_contracts': float(es_contracts),
+            'hedge_entry_price': float(hedge_entry_price),
+            'current_tranches': int(current_tranches),
+            'hedge_stopped_out': hedge_stopped_out,
+            'last_es_close': es[-1] if n else None,
+            'hedge_trades_count': hedge_trades_count,
+            'stop_loss_events': stop_loss_events,
+        },
+    }
+
+
+def ledger_from_events(events, hedge_pnl, mes_contracts, es_close, portfolio_values):
+    """
+    HedgeLedger dagli eventi del kernel (lista piatta barra, tipo, tranche) e dai suoi array per barra.
+
+    Il cumsum di hedge_pnl ripete le somme di cash_from_hedging del loop: il PnL
+    di un ciclo a una barra e' la sua variazione dall'ENTRY. Minimi del cumulato
+    e peggior PnL giornaliero sulle barre di ogni evento sono riduzioni
+    np.minimum.reduceat sugli intervalli (evento precedente del ciclo, evento].
+    """
+    n = len(hedge_pnl)
+    table = np.array(events, dtype=np.int64).reshape(-1, 3)
+    bar, kind = table[:, 0], table[:, 1].astype(np.int8)
+    cycle_pnl = np.zeros(len(bar))
+    adverse = np.zeros(len(bar))
+    worst_day = np.zeros(len(bar))
+
+    # REARM cade fuori dai cicli: gli altri eventi sono cicli contigui che iniziano con ENTRY
+    in_cycle = np.flatnonzero(kind != REARM)
+    if len(in_cycle):
+        b = bar[in_cycle]
+        entry = kind[in_cycle] == ENTRY
+        starts = np.flatnonzero(entry)
+        cumulative = np.append(np.cumsum(hedge_pnl), 0.0)
+        base = cumulative[b[starts]][np.cumsum(entry) - 1]
+        pnl = cumulative[b] - base
+        low = np.append(0.0, pnl[:-1])
+        low[starts] = 0.0
+        segment_start = np.append(0, b[:-1]) + 1
+        segment_start[starts] = b[starts] + 1
+        segment = np.flatnonzero(segment_start <= b)
+        worst = np.zeros(len(b))
+        if len(segment):
+            # Coppie (inizio, fine + 1): le riduzioni di indice pari sono gli intervalli
+            bounds = np.column_stack([segment_start[segment], b[segment] + 1]).ravel()
+            low[segment] = np.minimum(low[segment], np.minimum.reduceat(cumulative, bounds)[::2] - base[segment])
+            worst[segment] = np.minimum(np.minimum.reduceat(np.append(hedge_pnl, 0.0), bounds)[::2], 0.0)
+        cycle_pnl[in_cycle] = pnl
+        adverse[in_cycle] = low
+        worst_day[in_cycle] = worst
+
+    return HedgeLedger(n, {
+        'bar': bar,
+        'kind': kind,
+        'tranches': table[:, 2].astype(np.int8),
+        'contracts': mes_contracts[bar],
+        'es_price': es_close[bar],
+        'portfolio_value': portfolio_values[bar],
+        'cycle_pnl': cycle_pnl,
+        'adverse': adverse,
+        'worst_day': worst_day,
+    })
+
+
+def advance_hedge_state(state, price_spy, price_es_curr, target_tranches, hedge_percentage_per_tranche,
+                        stop_loss_threshold_hedge, micro_es_multiplier):
+    """
+    Avanza di una barra la macchina a stati della copertura (stessa logica del kernel).
+
+    Args:
+        state (dict): Stato nel formato di 'final_state' di run_backtest_kernel, aggiornato in place.
+        price_spy, price_es_curr (float): Chiusure della nuova barra.
+        target_tranches (int): Signal_Count della nuova barra.
+
+    Returns:
+        dict: 'hedge_pnl', 'portfolio_value', 'mes_contracts' della barra e i flag
+        'hedge_entry' / 'stop_loss' se la barra apre un ciclo o scatta lo stop.
+    """
+    price_es_prev = state['last_es_close']
+    daily_hedge_pnl = 0.0
+    hedge_entry = False
+    stop_loss = False
+
+    if state['current_tranches'] > 0:
+        daily_hedge_pnl = state['es_contracts'] * (price_es_curr - price_es_prev) * micro_es_multiplier
+        state['cash_from_hedging'] += daily_hedge_pnl
+
+        if price_es_curr > state['hedge_entry_price'] * (1 + stop_loss_threshold_hedge):
+            state['current_tranches'] = 0
+            state['es_contracts'] = 0.0
+            state['hedge_stopped_out'] = True
+            state['stop_loss_events'] += 1
+            stop_loss = True
+
+    if target_tranches == 0:
+        state['hedge_stopped_out'] = False
+
+    current_tranches = state['current_tranches']
+    if not state['hedge_stopped_out']:
+        if target_tranches > current_tranches:
+            tranches_to_add = target_tranches - current_tranches
+            portfolio_value_now = (state['spy_shares'] * price_spy) + state['cash_from_hedging']
+            notional_per_tranche = portfolio_value_now * hedge_percentage_per_tranche
+            contracts_to_add = - (notional_per_tranche / (price_es_curr * micro_es_multiplier)) * tranches_to_add
+
+            if current_tranches == 0:
+                state['hedge_entry_price'] = price_es_curr
+                state['hedge_trades_count'] += 1
+                hedge_entry = True
+
+            state['es_contracts'] += contracts_to_add
+            state['current_tranches'] = target_tranches
+
+        elif target_tranches < current_tranches:
+            ratio = target_tranches / current_tranches
+            state['es_contracts'] = state['es_contracts'] * ratio
+            state['current_tranches'] = target_tranches
+
+    state['last_es_close'] = price_es_curr
+    return {
+        'hedge_pnl': daily_hedge_pnl,
+        'portfolio_value': (state['spy_shares'] * price_spy) + state['cash_from_hedging'],
+        'mes_contracts': state['es_contracts'],
+        'hedge_entry': hedge_entry,
+        'stop_loss': stop_loss,
+    }
+
+
+def run_backtest_batch(spy_close, es_close, signal_count, initial_spy_price, capital,
+                       hedge_percentage_per_tranche, stop_loss_threshold_hedge, micro_es_multiplier):
+    """
+    Stessa macchina a stati di run_backtest_kernel su molti percorsi insieme.
+
+    Il loop resta sulle barre, ma ogni passo aggiorna in blocco tutti i
+    percorsi con operazioni NumPy (stesse operazioni e stesso ordine del
+    kernel, quindi risultati identici percorso per percorso). Un "percorso"
+    puo' essere una simulazione Monte Carlo o un conto/sottostante diverso:
+    capitale, hedge %, stop loss e moltiplicatore possono variare per colonna.
+
+    Args:
+        spy_close, es_close (np.ndarray): Matrici (n_barre, n_percorsi).
+        signal_count (np.ndarray): Tranche target (n_barre, n_percorsi), oppure (n_barre,)
+            se il segnale e' comune a tutti i percorsi.
+        initial_spy_price (float | np.ndarray): Prezzo iniziale del sottostante, scalare o per percorso.
+        capital, hedge_percentage_per_tranche, stop_loss_threshold_hedge, micro_es_multiplier:
+            Come run_backtest_kernel, scalari o vettori di lunghezza n_percorsi.
+
+    Returns:
+        dict: 'portfolio_value' (n_barre, n_percorsi); per percorso 'hedge_trades_count',
+        'stop_loss_events' e 'max_hedge_drawdown' (peggior PnL giornaliero della copertura
+        in % dell'equity all'ultima entrata, come calculate_metrics; NaN senza coperture);
+        'final_state' con lo stato interno all'ultima barra (vettori per percorso).
+    """
+    spy = np.asarray(spy_close, dtype=float)
+    es = np.asarray(es_close, dtype=float)
+    targets = np.asarray(signal_count)
+    if targets.ndim == 1:
+        targets = targets[:, None]
+    n, n_paths = spy.shape
+    capital = np.broadcast_to(np.asarray(capital, dtype=float), (n_paths,))
+
+    portfolio_values = np.empty((n, n_paths))
+    spy_shares = capital / np.broadcast_to(np.asarray(initial_spy_price, dtype=float), (n_paths,))
+    cash_from_hedging = np.zeros(n_paths)
+    es_contracts = np.zeros(n_paths)
+    hedge_entry_price = np.zeros(n_paths)
+    current_tranches = np.zeros(n_paths, dtype=targets.dtype if targets.dtype.kind in 'iu' else np.int64)
+    hedge_trades_count = np.zeros(n_paths, dtype=np.int64)
+    hedge_stopped_out = np.zeros(n_paths, dtype=bool)
+    stop_loss_events = np.zeros(n_paths, dtype=np.int64)
+    equity_at_entry = np.full(n_paths, np.nan)
+    max_hedge_drawdown = np.full(n_paths, np.nan)
+
+    if n:
+        portfolio_values[0] = capital
+
+    for i in range(1, n):
+        price_spy = spy[i]
+        price_es_curr = es[i]
+
+        # 1. PnL della posizione tenuta da ieri a oggi
+        active = current_tranches > 0
+        daily_hedge_pnl = np.where(active, es_contracts * (price_es_curr - es[i - 1]) * micro_es_multiplier, 0.0)
+        cash_from_hedging += daily_hedge_pnl
+
+        # 2. Stop loss sulla chiusura di oggi
+        stop = active & (price_es_curr > hedge_entry_price * (1 + stop_loss_threshold_hedge))
+        current_tranches[stop] = 0
+        es_contracts[stop] = 0.0
+        hedge_stopped_out |= stop
+        stop_loss_events += stop
+
+        # 3. Gestione segnale
+        target_tranches = targets[i]
+        hedge_stopped_out &= target_tranches != 0
+        free = ~hedge_stopped_out
+
+        increase = free & (target_tranches > current_tranches)
+        if increase.any():
+            portfolio_value_now = (spy_shares * price_spy) + cash_from_hedging
+            notional_per_tranche = portfolio_value_now * hedge_percentage_per_tranche
+            contracts_to_add = - (notional_per_tranche / (price_es_curr * micro_es_multiplier)) * (target_tranches - current_tranches)
+            entry = increase & (current_tranches == 0)
+            hedge_entry_price = np.where(entry, price_es_curr, hedge_entry_price)
+            hedge_trades_count += entry
+            equity_at_entry = np.where(entry, portfolio_value_now, equity_at_entry)
+            es_contracts = np.where(increase, es_contracts + contracts_to_add, es_contracts)
+
+        decrease = free & (target_tranches < current_tranches)
+        if decrease.any():
+            ratio = target_tranches / np.where(current_tranches > 0, current_tranches, 1)
+            es_contracts = np.where(decrease, es_contracts * ratio, es_contracts)
+
+        current_tranches = np.where(increase | decrease, target_tranches, current_tranches)
+        portfolio_values[i] = (spy_shares * price_spy) + cash_from_hedging
+        max_hedge_drawdown = np.fmin(max_hedge_drawdown, daily_hedge_pnl / equity_at_entry)
+
+    return {
+        'portfolio_value': portfolio_values,
+        'hedge_trades_count': hedge_trades_count,
+        'stop_loss_events': stop_loss_events,
+        'max_hedge_drawdown': max_hedge_drawdown,
+        'final_state': {
+            'spy_shares': spy_shares,
+            'cash_from_hedging': cash_from_hedging,
+            'es_contracts': es_contracts,
+            'hedge_entry_price': hedge_entry_price,
+            'current_tranches': current_tranches,
+            'hedge_stopped_out': hedge_stopped_out,
+        },
+    }
@@ -0,0 +1,429 @@
+# src/batch.py
+"""
+Esecuzione batch di backtest da specifiche di job, con archivio dei risultati.
+
+Ogni job indica parametri (sovrascrivono [STRATEGY_PARAMS] del config),
+intervallo di date e universo di sottostanti (preset di src.portfolio o
+definizioni esplicite). Le specifiche si leggono da una directory di file
+.json/.jsonl, da un singolo file o da stdin ('-'); un file .json puo'
+contenere un job o una lista di job, e la chiave "grid" espande il prodotto
+cartesiano dei valori indicati:
+
+    {"id": "sl-grid", "start": "2007-01-01", "universe": ["SPY", "QQQ"],
+     "params": {"hedge_percentage_per_tranche": 1.0},
+     "grid": {"stop_loss_threshold_hedge": [0.03, 0.05, 0.08]}}
+
+Per ogni job:
+
+- i dati (download via cache, uno per intervallo e universo) sono caricati
+  nel processo principale e ne viene calcolata un'impronta;
+- l'hash degli input (parametri della strategia, date, universo, impronta
+  dei dati) identifica il risultato: se l'archivio lo contiene gia' il job
+  viene saltato;
+- indicatori e backtest girano in un pool di processi limitato, con al
+  massimo IN_FLIGHT_PER_WORKER job in coda per processo.
+
+L'archivio e' una directory append-only:
+
+    jobs.jsonl                  una riga per job concluso (ok o fallito)
+    timeseries/<hash>.parquet   equity, rendimenti, contratti per barra e sottostante
+    metrics/<hash>.parquet      metriche di strategia e benchmark per sottostante
+
+I file Parquet sono scritti atomicamente prima della riga di jobs.jsonl
+(scritta con fsync): un job e' completo solo quando compare nel registro,
+quindi dopo un crash basta rilanciare lo stesso batch per riprendere dai job
+mancanti. I job falliti vengono ritentati al lancio successivo.
+
+Uso da riga di comando (main.py e' un alias):
+
+    python -m src.batch --jobs jobs/ --store results --workers 4
+    python -m src.batch --store results --show
+"""
+
+import argparse
+import datetime
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from src import telemetry
+from src.incremental import STRATEGY_PARAM_KEYS
+from src.metrics import HEDGE_METRIC_NAMES, calculate_metrics
+from src.portfolio import DEFAULT_UNDERLYING, load_portfolio_data, resolve_underlying
+from src.strategy import column_prefix, compute_indicators, load_strategy_params, run_backtest
+
+STORE_VERSION = 1
+STORE_DEFAULT = 'results'
+LEDGER_NAME = 'jobs.jsonl'
+TABLES = ['timeseries', 'metrics']
+IN_FLIGHT_PER_WORKER = 2
+DATA_CACHE_ENTRIES = 8
+
+
+# ==============================================================================
+# SPECIFICHE DEI JOB
+# ==============================================================================
+
+def _universe(value, params):
+    items = value if isinstance(value, list) else [value or DEFAULT_UNDERLYING]
+    universe = []
+    for item in items:
+        if isinstance(item, dict):
+            universe.append(resolve_underlying(item['name'], item))
+        elif item == DEFAULT_UNDERLYING:
+            # Libro storico: moltiplicatore da micro_es_multiplier, come in load_portfolio_config
+            universe.append(resolve_underlying(item, multiplier=params.get('micro_es_multiplier')))
+        else:
+            universe.append(resolve_underlying(str(item)))
+    return universe
+
+
+def expand_spec(spec, defaults, name='job'):
+    """
+    Job risolti da una specifica: parametri completi, date ISO e universo.
+
+    Args:
+        spec (dict): Specifica con 'params', 'start', 'end', 'universe', 'grid' e 'id' facoltativi.
+        defaults (dict): Parametri di default (da [STRATEGY_PARAMS]).
+        name (str): Prefisso dell'id se la specifica non ne indica uno.
+    """
+    base_id = spec.get('id', name)
+    params = {**defaults, **spec.get('params', {})}
+    start = str(spec.get('start', '2007-01-01'))
+    end = str(spec.get('end') or datetime.date.today().isoformat())
+    universe = _universe(spec.get('universe'), params)
+
+    grid = spec.get('grid') or {}
+    keys = list(grid)
+    combos = list(itertools.product(*(grid[k] for k in keys))) or [()]
+    jobs = []
+    for combo in combos:
+        overrides = dict(zip(keys, combo))
+        suffix = ''.join(f"_{k}={v}" for k, v in overrides.items())
+        jobs.append({
+            'id': f"{base_id}{suffix}",
+            'params': {k: float(v) for k, v in {**params, **overrides}.items() if k in STRATEGY_PARAM_KEYS},
+            'start': start,
+            'end': end,
+            'universe': universe,
+        })
+    return jobs
+
+
+def read_job_specs(source, defaults):
+    """Job da una directory (*.json, *.jsonl in ordine di nome), da un file o da stdin ('-')."""
+    if source == '-':
+        entries = [('stdin', line) for line in sys.stdin]
+    else:
+        paths = sorted(glob.glob(os.path.join(source, '*.json*'))) if os.path.isdir(source) else [source]
+        entries = []
+        for path in paths:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            with open(path, 'r', encoding='utf-8') as f:
+                if path.endswith('.jsonl'):
+                    entries.extend((stem, line) for line in f)
+                else:
+                    entries.append((stem, f.read()))
+
+    jobs = []
+    for stem, text in entries:
+        if not text.strip():
+            continue
+        payload = json.loads(text)
+        specs = payload if isinstance(payload, list) else [payload]
+        for i, spec in enumerate(specs):
+            jobs.extend(expand_spec(spec, defaults, stem if len(specs) == 1 else f"{stem}-{i}"))
+    return jobs
+
+
+def data_digest(df):
+    """Impronta del contenuto del frame di input (date, colonne e valori)."""
+    digest = hashlib.sha1(','.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def job_hash(job, digest):
+    """Hash degli input del job: stesso hash -> stesso risultato."""
+    payload = json.dumps({
+        'version': STORE_VERSION, 'params': job['params'], 'start': job['start'], 'end': job['end'],
+        'universe': job['universe'], 'data': digest,
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+# ==============================================================================
+# ESECUZIONE DI UN JOB (NEI PROCESSI DEL POOL)
+# ==============================================================================
+
+def run_job(job, frame):
+    """
+    Indicatori una volta, poi il backtest di ogni sottostante dell'universo.
+
+    Returns:
+        tuple: (DataFrame delle serie per barra, DataFrame delle metriche) con una
+        colonna 'underlying'.
+    """
+    df = compute_indicators(frame.copy(), job['params'])
+    if df is None or df.empty:
+        raise ValueError("Indicatori non calcolabili sull'intervallo richiesto.")
+
+    series, metrics_rows = [], []
+    for underlying in job['universe']:
+        prefix, hedge_prefix = column_prefix(underlying['ticker']), column_prefix(underlying['hedge_ticker'])
+        # run_backtest legge le colonne SPY_*/ES_*: vi si mappano sottostante e future del libro
+        view = df.assign(SPY_Open=df[f"{prefix}_Open"], SPY_Close=df[f"{prefix}_Close"],
+                         ES_Close=df[f"{hedge_prefix}_Close"])
+        params = dict(job['params'], micro_es_multiplier=underlying['multiplier'])
+        equity, strategy_returns, benchmark_returns, trades, stops, results = run_backtest(view, params)
+
+        series.append(pd.DataFrame({
+            'underlying': underlying['name'],
+            'equity': results['Portfolio_Value'],
+            'benchmark_equity': equity['Buy_And_Hold_Equity'],
+            'strategy_return': strategy_returns,
+            'benchmark_return': benchmark_returns,
+            'contracts': results['MES_Contracts'],
+            'signal_count': results['Signal_Count'],
+            'hedge_pnl': results['Hedge_PnL'],
+        }, index=results.index.rename('Date')).reset_index())
+
+        metrics, bench_metrics = calculate_metrics(strategy_returns, benchmark_returns, trades, stops, results)
+        metrics_rows.append({'underlying': underlying['name'], **metrics,
+                             **{f"benchmark_{k}": v for k, v in bench_metrics.items()
+                                if k not in HEDGE_METRIC_NAMES}})
+    return pd.concat(series, ignore_index=True), pd.DataFrame(metrics_rows)
+
+
+def _run_job_safe(job, frame):
+    started = time.perf_counter()
+    try:
+        timeseries, metrics = run_job(job, frame)
+        return {'ok': True, 'timeseries': timeseries, 'metrics': metrics,
+                'duration_s': time.perf_counter() - started}
+    except Exception as e:
+        return {'ok': False, 'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc(),
+                'duration_s': time.perf_counter() - started}
+
+
+# ==============================================================================
+# ARCHIVIO DEI RISULTATI
+# ==============================================================================
+
+def read_ledger(store):
+    """Righe del registro dei job (le righe troncate da un crash sono ignorate)."""
+    rows = []
+    try:
+        with open(os.path.join(store, LEDGER_NAME), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return rows
+
+
+def completed_hashes(store):
+    return {row['hash'] for row in read_ledger(store) if row.get('status') == 'ok'}
+
+
+def _write_part(store, table, key, df):
+    directory = os.path.join(store, table)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{key}.parquet")
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _append_ledger(store, row):
+    os.makedirs(store, exist_ok=True)
+    path = os.path.join(store, LEDGER_NAME)
+    # Dopo un crash l'ultima riga puo' essere troncata: la nuova riga parte a capo
+    prefix = ''
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            prefix = '' if f.read(1) == b'\n' else '\n'
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(prefix + json.dumps(row, default=str) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def record_result(store, job, key, result):
+    """Scrive le tabelle del job e poi la riga del registro (il job e' completo solo dopo)."""
+    row = {'hash': key, 'id': job['id'], 'params': job['params'], 'start': job['start'], 'end': job['end'],
+           'universe': [u['name'] for u in job['universe']], 'duration_s': round(result['duration_s'], 4),
+           'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')}
+    if result['ok']:
+        for table in TABLES:
+            _write_part(store, table, key, result[table])
+        row['status'] = 'ok'
+    else:
+        row.update(status='failed', error=result['error'])
+    _append_ledger(store, row)
+    return row
+
+
+def read_store(store, table='metrics'):
+    """Tabella dell'archivio per tutti i job completati, con colonne 'hash' e 'job_id'."""
+    frames = []
+    for row in read_ledger(store):
+        if row.get('status') != 'ok':
+            continue
+        path = os.path.join(store, table, f"{row['hash']}.parquet")
+        if os.path.exists(path):
+            frames.append(pd.read_parquet(path).assign(hash=row['hash'], job_id=row['id']))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+# ==============================================================================
+# BATCH
+# ==============================================================================
+
+@functools.lru_cache(maxsize=DATA_CACHE_ENTRIES)
+def _load_frame(start, end, universe_key):
+    underlyings = {name: dict(spec) for name, spec in universe_key}
+    df = load_portfolio_data(datetime.date.fromisoformat(start), datetime.date.fromisoformat(end), underlyings)
+    return df, (data_digest(df) if df is not None else None)
+
+
+def _job_frame(job):
+    universe_key = tuple((u['name'], tuple(sorted(u.items()))) for u in job['universe'])
+    return _load_frame(job['start'], job['end'], universe_key)
+
+
+def run_batch(jobs, store=STORE_DEFAULT, max_workers=None, on_result=None):
+    """
+    Esegue i job non ancora in archivio e ne registra i risultati.
+
+    Args:
+        jobs (list[dict]): Job risolti (vedi expand_spec / read_job_specs).
+        store (str): Directory dell'archivio.
+        max_workers (int | None): Processi del pool (default: numero di CPU; 1 = nel processo).
+        on_result (callable | None): on_result(riga del registro) a ogni job concluso o saltato.
+
+    Returns:
+        dict: Conteggi 'ok', 'failed', 'skipped'.
+    """
+    done = completed_hashes(store)
+    queued = set()
+    counts = {'ok': 0, 'failed': 0, 'skipped': 0}
+    max_workers = max_workers or os.cpu_count() or 1
+
+    def _finish(job, key, result):
+        row = record_result(store, job, key, result)
+        if row['status'] == 'ok':
+            done.add(key)
+        counts[row['status']] += 1
+        telemetry.incr(f"batch.{row['status']}")
+        if on_result:
+            on_result(row)
+
+    def _prepare(job):
+        """(hash, frame) del job, oppure None se gia' in archivio (o in coda) o se i dati mancano."""
+        try:
+            frame, digest = _job_frame(job)
+        except ValueError as e:
+            frame, digest = None, str(e)
+        if frame is None:
+            _finish(job, job_hash(job, None), {'ok': False, 'error': f"Dati non disponibili: {digest or ''}",
+                                               'duration_s': 0.0})
+            return None
+        key = job_hash(job, digest)
+        if key in done or key in queued:
+            counts['skipped'] += 1
+            telemetry.incr('batch.skipped')
+            if on_result:
+                on_result({'hash': key, 'id': job['id'], 'status': 'skipped'})
+            return None
+        return key, frame
+
+    with telemetry.span('batch.run', jobs=len(jobs), workers=max_workers):
+        if max_workers == 1:
+            for job in jobs:
+                prepared = _prepare(job)
+                if prepared is not None:
+                    with telemetry.span('batch.job'):
+                        _finish(job, prepared[0], _run_job_safe(job, prepared[1]))
+            return counts
+
+        pending = {}
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            for job in jobs:
+                prepared = _prepare(job)
+                if prepared is None:
+                    continue
+                key, frame = prepared
+                queued.add(key)
+                pending[pool.submit(_run_job_safe, job, frame)] = (job, key)
+                # Coda limitata: la memoria non cresce con la lunghezza del batch
+                while len(pending) >= max_workers * IN_FLIGHT_PER_WORKER:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        _finish(*pending.pop(future), future.result())
+            for future in wait(pending).done:
+                _finish(*pending.pop(future), future.result())
+    return counts
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest batch da specifiche di job, con archivio dei risultati.")
+    parser.add_argument('--jobs', default=None, help="Directory, file .json/.jsonl o '-' (stdin) con le specifiche.")
+    parser.add_argument('--store', default=STORE_DEFAULT, help="Directory dell'archivio dei risultati.")
+    parser.add_argument('--config', default='config.ini', help="Config con i parametri di default.")
+    parser.add_argument('--workers', type=int, default=None, help="Processi del pool (default: numero di CPU).")
+    parser.add_argument('--dry-run', action='store_true', help="Elenca i job risolti senza eseguirli.")
+    parser.add_argument('--show', action='store_true', help="Stampa le metriche in archivio.")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        metrics = read_store(args.store, 'metrics')
+        if metrics.empty:
+            print("Archivio vuoto.")
+            return 1
+        columns = ['job_id', 'underlying', 'total_return', 'cagr', 'sharpe', 'max_drawdown', 'hedge_trades',
+                   'stop_loss_events', 'benchmark_cagr']
+        with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_rows', None):
+            print(metrics[[c for c in columns if c in metrics.columns]].to_string(index=False))
+        return 0
+    if not args.jobs:
+        parser.error("serve --jobs (o --show)")
+
+    jobs = read_job_specs(args.jobs, load_strategy_params(args.config))
+    if args.dry_run:
+        for job in jobs:
+            print(json.dumps({**job, 'universe': [u['name'] for u in job['universe']]}))
+        return 0
+
+    print(f"{len(jobs)} job, archivio {args.store}")
+    telemetry.reset('batch')
+
+    def _progress(row):
+        detail = f" ({row['error']})" if row.get('error') else ""
+        print(f"[{row['status']}] {row['id']}{detail}")
+
+    counts = run_batch(jobs, args.store, args.workers, on_result=_progress)
+    telemetry.write_metrics(store=args.store, **counts)
+    print(f"Completati {counts['ok']}, saltati {counts['skipped']}, falliti {counts['failed']}")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
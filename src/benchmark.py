@@ -0,0 +1,335 @@
+# src/benchmark.py
+"""
+Benchmark offline degli stadi della pipeline.
+
+Per ogni fixture (sintetica da src.synthetic_data oppure registrata, cioe'
+una directory della cache locale di una esecuzione reale) misura tempo e
+picco di memoria di:
+
+    cache_load -> build_master_frame -> cmi_zscore -> vix_hysteresis ->
+    signals -> cmi_windows -> backtest -> streaming -> metrics -> charts
+
+(cmi_windows: CMI_MA e Signal_CMI per CMI_WINDOWS finestre in un passaggio;
+streaming: replay barra per barra delle stesse barre in src.streaming)
+
+Ogni stadio riceve una copia fresca del proprio input (preparata fuori dal
+cronometro) e viene ripetuto --repeat volte; il picco di memoria viene
+misurato con tracemalloc in una esecuzione separata, per non alterare i
+tempi. I risultati sono salvati in JSON e confrontati con una baseline.
+
+Uso da riga di comando:
+
+    python -m src.benchmark --fixtures 1y,20y,intraday --repeat 5 --save-baseline
+    python -m src.benchmark --recorded .cache/market_data --baseline benchmarks/baseline.json
+    python -m src.benchmark --fixtures intraday --skip charts
+    python -m src.benchmark --fetch --fetch-latency 0.2
+
+Con --fetch viene misurato anche il download completo (cache disattivata)
+contro il server locale di src.mock_server che serve la fixture.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src import data_cache
+from src.indicator_calculator import vix_hysteresis_signal
+from src.metrics import calculate_metrics
+from src.streaming import StreamingHedgeEngine, cmi_schedule_from_daily, frame_bars
+from src.strategy import (FRED_SERIES_CMI, build_master_frame, cmi_signal_matrix, compute_cmi_zscore,
+                          compute_signals, load_strategy_data, load_strategy_params, run_backtest)
+from src.synthetic_data import FIXTURE_SIZES, fixture, recorded_market_data
+
+BASELINE_DEFAULT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'benchmarks', 'baseline.json')
+DEFAULT_REPEAT = 5
+# Un rallentamento conta come regressione solo oltre la tolleranza relativa
+# e oltre MIN_REGRESSION_SECONDS in assoluto (rumore degli stadi brevissimi).
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.002
+# Uno stadio che supera il budget non viene ripetuto ne' rimisurato con
+# tracemalloc (es. i grafici sulla fixture intraday).
+STAGE_BUDGET_SECONDS = 30
+STAGES = ['fetch', 'cache_load', 'build_master_frame', 'cmi_zscore', 'vix_hysteresis', 'signals', 'cmi_windows',
+          'backtest', 'streaming', 'metrics', 'charts']
+# Finestre CMI dello stadio cmi_windows (una griglia tipica di sweep)
+CMI_WINDOWS = list(range(21, 253, 21))
+
+
+# ==============================================================================
+# MISURA
+# ==============================================================================
+
+def measure(fn, make_args, repeat=DEFAULT_REPEAT, budget=STAGE_BUDGET_SECONDS, trace_memory=True):
+    """
+    Tempi (min/mediana) e picco di memoria di fn(*make_args()).
+
+    Returns:
+        tuple: (risultato dell'ultima esecuzione, dict con 'min_s', 'median_s',
+        'runs' e 'peak_mb', None se lo stadio ha superato il budget).
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+        if sum(times) > budget:
+            break
+
+    peak_mb = None
+    if trace_memory and times[0] <= budget:
+        args = make_args()
+        tracemalloc.start()
+        try:
+            fn(*args)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+
+    return result, {'min_s': min(times), 'median_s': statistics.median(times), 'runs': len(times), 'peak_mb': peak_mb}
+
+
+def _cache_load(market_data_dfs, cmi_data_dict):
+    """Lettura di tutte le serie da una cache gia' popolata (nessun download)."""
+    def _never(start, end):
+        raise RuntimeError("download inatteso durante il benchmark della cache")
+
+    loaded = {}
+    for key, data in _cache_keys(market_data_dfs, cmi_data_dict).items():
+        loaded[key], _ = data_cache.cached_download(key, _never, data.index[0], data.index[-1])
+    return loaded
+
+
+def _cache_keys(market_data_dfs, cmi_data_dict):
+    keys = {f"eod_{ticker}": data for ticker, data in market_data_dfs.items()}
+    keys.update({f"fred_{FRED_SERIES_CMI[name]}": series.to_frame('value') for name, series in cmi_data_dict.items()})
+    return keys
+
+
+def _charts(df_results):
+    # La dashboard importa streamlit/plotly: stadio saltato se non installati
+    from app.dashboard import plotly_individual_signals_chart, plotly_trades_chart
+    plotly_trades_chart(df_results, 'Backtest')
+    plotly_individual_signals_chart(df_results)
+
+
+def _streaming(bars, params, schedule):
+    return StreamingHedgeEngine(params, cmi_schedule=schedule).run(bars)
+
+
+def benchmark_fixture(market_data_dfs, cmi_data_dict, params, repeat=DEFAULT_REPEAT, skip=(),
+                      fetch_latency=None):
+    """
+    Misura gli stadi su una fixture. Gli stadi in skip che producono input per
+    i successivi vengono comunque eseguiti, ma non misurati; 'fetch' viene
+    misurato solo se fetch_latency non e' None.
+
+    Returns:
+        dict: {stadio: misure}.
+    """
+    results = {}
+
+    def _stage(name, fn, make_args):
+        if name in skip:
+            return fn(*make_args())
+        result, results[name] = measure(fn, make_args, repeat)
+        return result
+
+    if fetch_latency is not None and 'fetch' not in skip:
+        fetched = _measure_fetch(market_data_dfs, cmi_data_dict, repeat, fetch_latency)
+        if fetched is not None:
+            results['fetch'] = fetched
+    if 'cache_load' not in skip:
+        results['cache_load'] = _measure_cache_load(market_data_dfs, cmi_data_dict, repeat)
+
+    master = _stage('build_master_frame', build_master_frame, lambda: (market_data_dfs, cmi_data_dict))
+    zscored = _stage('cmi_zscore', compute_cmi_zscore, lambda: (master.copy(),))
+    if zscored is None:
+        return results
+
+    ratio = (zscored['VIX_Close'] / zscored['VIX3M_Close'].replace(0, np.nan)).to_numpy()
+    _stage('vix_hysteresis', vix_hysteresis_signal,
+           lambda: (ratio, params['vix_ratio_upper_threshold'], params['vix_ratio_lower_threshold']))
+    signals = _stage('signals', compute_signals, lambda: (zscored.copy(), params))
+    if signals is None:
+        return results
+    _stage('cmi_windows', cmi_signal_matrix, lambda: (zscored, CMI_WINDOWS))
+
+    backtest = _stage('backtest', run_backtest, lambda: (signals.copy(), params))
+    _, strategy_returns, benchmark_returns, trades, stop_losses, df_results = backtest
+    schedule = cmi_schedule_from_daily(signals['Signal_CMI'])
+    _stage('streaming', _streaming, lambda: (list(frame_bars(signals)), params, schedule))
+    _stage('metrics', calculate_metrics,
+           lambda: (strategy_returns, benchmark_returns, trades, stop_losses, df_results))
+
+    if 'charts' not in skip:
+        try:
+            _, results['charts'] = measure(_charts, lambda: (df_results,), repeat)
+        except ImportError as e:
+            print(f"Stadio charts saltato: {e}")
+
+    for stage in results.values():
+        stage['rows'] = len(signals)
+    return results
+
+
+def _measure_fetch(market_data_dfs, cmi_data_dict, repeat, latency):
+    """Download di tutte le serie dal server locale, senza cache."""
+    from src.mock_server import build_dataset, start_server
+
+    index = next(iter(market_data_dfs.values())).index
+    if not (index == index.normalize()).all():
+        print("Stadio fetch saltato: le API giornaliere non servono barre intraday.")
+        return None
+    server = start_server(build_dataset(market_data_dfs, cmi_data_dict), latency=latency)
+    overrides = dict(server.client_env(), KRITERION_CACHE_DISABLE='1')
+    previous = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        # Il server gira nello stesso processo: tracemalloc misurerebbe anche lui (e lo rallenta)
+        _, measured = measure(load_strategy_data, lambda: (index[0].date(), index[-1].date(), 'mock', 'mock'),
+                              repeat, trace_memory=False)
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        server.shutdown()
+        server.server_close()
+    return measured
+
+
+def _measure_cache_load(market_data_dfs, cmi_data_dict, repeat):
+    """Popola una cache temporanea con la fixture e misura la sola lettura."""
+    with tempfile.TemporaryDirectory() as tmp_dir, data_cache.use_cache_dir(tmp_dir):
+        for key, data in _cache_keys(market_data_dfs, cmi_data_dict).items():
+            data_cache.cached_download(key, lambda s, e, d=data: (d, 'Fixture'), data.index[0], data.index[-1])
+        _, measured = measure(_cache_load, lambda: (market_data_dfs, cmi_data_dict), repeat)
+    return measured
+
+
+# ==============================================================================
+# BASELINE E CONFRONTO
+# ==============================================================================
+
+def environment_info():
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Confronta i tempi minimi (meno sensibili al rumore della mediana) con la baseline.
+
+    Returns:
+        pd.DataFrame: Una riga per (fixture, stadio) con tempi, rapporto e flag 'regression'.
+    """
+    rows = []
+    for name, stages in current['results'].items():
+        for stage, values in stages.items():
+            base = baseline.get('results', {}).get(name, {}).get(stage)
+            row = {'fixture': name, 'stage': stage, 'min_s': values['min_s'], 'median_s': values['median_s'],
+                   'peak_mb': values['peak_mb'] if values['peak_mb'] is not None else np.nan,
+                   'baseline_s': np.nan, 'ratio': np.nan, 'regression': False}
+            if base:
+                row['baseline_s'] = base['min_s']
+                row['ratio'] = values['min_s'] / base['min_s'] if base['min_s'] > 0 else np.nan
+                row['regression'] = bool(values['min_s'] > base['min_s'] * (1 + tolerance)
+                                         and values['min_s'] - base['min_s'] > MIN_REGRESSION_SECONDS)
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _save_json(path, payload):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=1, sort_keys=True)
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline degli stadi della strategia di copertura.")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--fixtures', default='1y,20y',
+                        help=f"Fixture sintetiche separate da virgola ({', '.join(FIXTURE_SIZES)}).")
+    parser.add_argument('--recorded', action='append', default=[], metavar='CACHE_DIR',
+                        help="Directory della cache locale da usare come fixture registrata. Ripetibile.")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--fetch', action='store_true', help="Misura anche il download contro src.mock_server.")
+    parser.add_argument('--fetch-latency', type=float, default=0.0, help="Latenza simulata per richiesta (s).")
+    parser.add_argument('--skip', default='', help=f"Stadi da non misurare ({', '.join(STAGES)}).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help="File JSON con i risultati di questa esecuzione.")
+    parser.add_argument('--baseline', default=BASELINE_DEFAULT)
+    parser.add_argument('--save-baseline', action='store_true', help="Sovrascrive la baseline con questa esecuzione.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    params = load_strategy_params(args.config)
+    skip = {name.strip() for name in args.skip.split(',') if name.strip()}
+    if skip - set(STAGES):
+        parser.error(f"Stadi sconosciuti: {', '.join(sorted(skip - set(STAGES)))}")
+    fixtures = {}
+    for name in (n.strip() for n in args.fixtures.split(',') if n.strip()):
+        if name not in FIXTURE_SIZES:
+            parser.error(f"Fixture sconosciuta: {name}")
+        fixtures[name] = lambda name=name: fixture(name, seed=args.seed)
+    for cache_dir in args.recorded:
+        fixtures[f"recorded:{os.path.basename(os.path.normpath(cache_dir))}"] = \
+            lambda cache_dir=cache_dir: recorded_market_data(cache_dir)
+
+    current = {'environment': environment_info(), 'repeat': args.repeat, 'results': {}}
+    for name, load in fixtures.items():
+        market_data_dfs, cmi_data_dict = load()
+        if not market_data_dfs:
+            print(f"Fixture {name} vuota, saltata.")
+            continue
+        print(f"Benchmark {name}...")
+        current['results'][name] = benchmark_fixture(market_data_dfs, cmi_data_dict, params, args.repeat, skip,
+                                                     args.fetch_latency if args.fetch else None)
+
+    if args.out:
+        _save_json(args.out, current)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    report = compare(current, baseline, args.tolerance)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.4f}'.format):
+        print(report.to_string(index=False))
+
+    if args.save_baseline:
+        _save_json(args.baseline, current)
+        print(f"Baseline salvata in {args.baseline}")
+
+    if args.fail_on_regression and report['regression'].any():
+        print("Regressioni rilevate.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
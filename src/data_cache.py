@@ -0,0 +1,259 @@
+# src/data_cache.py
+"""
+Cache locale su disco per le serie di mercato (EODHD/Yahoo) e macro (FRED).
+
+Ogni serie e' salvata in un file colonnare (Parquet se pyarrow e' disponibile,
+altrimenti pickle) e un indice JSON registra l'intervallo di date coperto.
+Alle chiamate successive viene scaricata solo la coda mancante dopo l'ultima
+barra in cache (ed eventualmente la testa, se si chiede una data di inizio
+precedente), poi i pezzi vengono uniti e riscritti.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import threading
+
+import pandas as pd
+
+from src import telemetry
+
+CACHE_DIR_DEFAULT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'market_data'
+)
+INDEX_FILENAME = 'index.json'
+
+# Se l'intervallo richiesto arriva ad oggi, la barra odierna puo' essere ancora
+# parziale: la coda viene riscaricata al massimo ogni TODAY_REFRESH_SECONDS.
+TODAY_REFRESH_SECONDS = 3600
+
+# Chiusura del mercato USA (ora di New York) dopo la quale la seduta del giorno
+# si considera completa, con un margine per la pubblicazione dei dati EOD.
+MARKET_CLOSE_TIME = datetime.time(16, 30)
+MARKET_TIMEZONE = 'America/New_York'
+
+_index_lock = threading.Lock()
+
+
+def get_cache_dir():
+    """Directory della cache (sovrascrivibile con KRITERION_CACHE_DIR)."""
+    return os.environ.get('KRITERION_CACHE_DIR', CACHE_DIR_DEFAULT)
+
+
+@contextlib.contextmanager
+def use_cache_dir(cache_dir):
+    """Punta temporaneamente la cache a cache_dir (fixture registrate, benchmark)."""
+    previous = os.environ.get('KRITERION_CACHE_DIR')
+    os.environ['KRITERION_CACHE_DIR'] = cache_dir
+    try:
+        yield cache_dir
+    finally:
+        if previous is None:
+            os.environ.pop('KRITERION_CACHE_DIR', None)
+        else:
+            os.environ['KRITERION_CACHE_DIR'] = previous
+
+
+def cache_enabled():
+    """La cache si disattiva impostando KRITERION_CACHE_DISABLE=1."""
+    return os.environ.get('KRITERION_CACHE_DISABLE', '').lower() not in ('1', 'true', 'yes')
+
+
+def market_session_key(now=None):
+    """
+    Data (ISO) dell'ultima seduta USA chiusa: cambia solo dopo la chiusura.
+
+    Usata come chiave delle cache in memoria, cosi' i risultati restano validi
+    per tutta la seduta e vengono ricalcolati alla chiusura successiva.
+    Le festivita' non sono considerate: nei giorni festivi la chiave cambia
+    ma i dati restano gli stessi.
+    """
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz=MARKET_TIMEZONE)
+    now = now.tz_localize(MARKET_TIMEZONE) if now.tzinfo is None else now.tz_convert(MARKET_TIMEZONE)
+    session = now.date() if now.time() >= MARKET_CLOSE_TIME else now.date() - datetime.timedelta(days=1)
+    while session.weekday() >= 5:
+        session -= datetime.timedelta(days=1)
+    return session.isoformat()
+
+
+def _storage_format():
+    try:
+        import pyarrow  # noqa: F401
+        return 'parquet'
+    except ImportError:
+        return 'pickle'
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return pd.Timestamp(value).date()
+
+
+def _safe_name(key):
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in key)
+
+
+def _atomic_write(path, write_fn):
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# ==============================================================================
+# INDICE DEGLI INTERVALLI COPERTI
+# ==============================================================================
+
+def read_index():
+    """Ritorna l'indice {chiave: metadati} (vuoto se assente o corrotto)."""
+    path = os.path.join(get_cache_dir(), INDEX_FILENAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _update_index(key, entry):
+    with _index_lock:
+        index = read_index()
+        index[key] = entry
+
+        def _write(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, indent=1, sort_keys=True)
+
+        _atomic_write(os.path.join(get_cache_dir(), INDEX_FILENAME), _write)
+
+
+# ==============================================================================
+# LETTURA / SCRITTURA SERIE
+# ==============================================================================
+
+def _read_frame(entry):
+    path = os.path.join(get_cache_dir(), entry['file'])
+    try:
+        if entry.get('format') == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+    except Exception as e:
+        telemetry.event('cache.read_error', file=entry['file'], error=repr(e))
+        return None
+
+
+def load_cached(key):
+    """Serie salvata per key cosi' com'e' su disco (None se assente), senza scaricare nulla."""
+    entry = read_index().get(key)
+    return _read_frame(entry) if entry else None
+
+
+def _write_frame(key, df, covered_start, covered_end):
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    fmt = _storage_format()
+    filename = f"{_safe_name(key)}.{'parquet' if fmt == 'parquet' else 'pkl'}"
+    path = os.path.join(get_cache_dir(), filename)
+
+    if fmt == 'parquet':
+        _atomic_write(path, lambda p: df.to_parquet(p))
+    else:
+        _atomic_write(path, lambda p: df.to_pickle(p))
+
+    _update_index(key, {
+        'file': filename,
+        'format': fmt,
+        'start': covered_start.isoformat(),
+        'end': covered_end.isoformat(),
+        'first_bar': df.index[0].strftime('%Y-%m-%d'),
+        'last_bar': df.index[-1].strftime('%Y-%m-%d'),
+        'rows': int(len(df)),
+        'updated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    })
+
+
+def _needs_tail(entry, end):
+    covered_end = _to_date(entry['end'])
+    if end > covered_end:
+        return True
+    if end >= datetime.date.today():
+        updated_at = datetime.datetime.fromisoformat(entry['updated_at'])
+        age = datetime.datetime.now(datetime.timezone.utc) - updated_at
+        return age.total_seconds() > TODAY_REFRESH_SECONDS
+    return False
+
+
+def cached_download(key, fetch_fn, start_date, end_date):
+    """
+    Scarica una serie passando dalla cache locale.
+
+    Args:
+        key (str): Identificativo univoco della serie (es. 'eod_SPY', 'fred_T10Y2Y').
+        fetch_fn (callable): fetch_fn(start, end) -> (DataFrame indicizzato per data, sorgente).
+        start_date, end_date: Estremi dell'intervallo richiesto (inclusi).
+
+    Returns:
+        tuple: (DataFrame limitato all'intervallo richiesto, sorgente dei dati). Se la
+        coda mancante non si scarica la sorgente e' "Cache(stale)": dati fermi all'ultima
+        barra in cache.
+    """
+    start = _to_date(start_date)
+    end = _to_date(end_date)
+
+    if not cache_enabled():
+        telemetry.incr('cache.disabled', key=key)
+        return fetch_fn(start, end)
+
+    entry = read_index().get(key)
+    cached = _read_frame(entry) if entry else None
+
+    if cached is None or cached.empty:
+        telemetry.incr('cache.miss', key=key)
+        data, source = fetch_fn(start, end)
+        if data is not None and not data.empty:
+            _write_frame(key, data.sort_index(), start, end)
+        return data, source
+
+    covered_start = _to_date(entry['start'])
+    covered_end = _to_date(entry['end'])
+    pieces = []
+    sources = []
+
+    # Testa mancante: si chiede una data di inizio precedente a quella coperta
+    if start < covered_start:
+        head, source = fetch_fn(start, covered_start)
+        if head is not None and not head.empty:
+            pieces.append(head)
+            sources.append(source)
+            covered_start = start
+    pieces.append(cached)
+
+    # Coda mancante: si riparte dall'ultima barra in cache (che puo' essere stata parziale)
+    stale = False
+    if _needs_tail(entry, end):
+        last_bar = _to_date(entry['last_bar'])
+        tail, source = fetch_fn(last_bar, end)
+        if tail is not None and not tail.empty:
+            pieces.append(tail)
+            sources.append(source)
+            covered_end = max(covered_end, end)
+        else:
+            # Coda non scaricata: si restituisce la cache, ma segnata come vecchia
+            stale = True
+            telemetry.incr('cache.stale', key=key)
+    cache_source = "Cache(stale)" if stale else "Cache"
+
+    if sources:
+        merged = pd.concat(pieces)
+        merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+        _write_frame(key, merged, covered_start, covered_end)
+        source_used = f"{cache_source}+" + "/".join(sorted(set(sources)))
+        telemetry.incr('cache.partial', key=key)
+    else:
+        merged = cached
+        source_used = cache_source
+        if not stale:
+            telemetry.incr('cache.hit', key=key)
+
+    return merged.loc[pd.Timestamp(start):pd.Timestamp(end)], source_used
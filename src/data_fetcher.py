@@ -0,0 +1,332 @@
+# src/data_fetcher.py
+"""
+Acquisizione dati di mercato (EODHD -> Yahoo) e macro (FRED).
+
+Tutte le richieste di una corsa partono in parallelo su un pool di thread
+limitato, con una sessione HTTP condivisa (connessioni riutilizzate), un
+limite di concorrenza per sorgente, retry con backoff esponenziale e una
+scadenza globale. La latenza complessiva diventa quella della richiesta piu'
+lenta invece della somma di tutte.
+"""
+
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from src import telemetry
+from src.data_cache import cached_download
+
+# ==============================================================================
+# CONFIGURAZIONE EODHD / YAHOO / FRED
+# ==============================================================================
+
+TICKER_MAPPING_EODHD = {
+    'SPY': 'SPY.US',
+    'ES=F': 'ES.CME',
+    '^VIX': 'VIX.INDX',
+    '^VIX3M': 'VIX3M.INDX',
+    'QQQ': 'QQQ.US',
+    'NQ=F': 'NQ.CME',
+    'IWM': 'IWM.US',
+    'RTY=F': 'RTY.CME',
+}
+
+# URL di base, sovrascrivibili con KRITERION_<SORGENTE>_BASE_URL (es. per puntare
+# al server locale di src.mock_server). Con KRITERION_YAHOO_BASE_URL impostato il
+# fallback Yahoo usa direttamente l'endpoint chart JSON invece di yfinance.
+BASE_URLS = {
+    'eodhd': 'https://eodhd.com/api',
+    'fred': 'https://api.stlouisfed.org/fred',
+    'yahoo': None,
+}
+
+# Richieste contemporanee massime per sorgente. yfinance usa stato globale
+# condiviso tra le chiamate a yf.download, quindi il fallback resta seriale.
+SOURCE_CONCURRENCY = {'eodhd': 4, 'yahoo': 1, 'fred': 4}
+MAX_WORKERS = 8
+MAX_RETRIES = 2
+BACKOFF_SECONDS = 0.5
+DEFAULT_DEADLINE_SECONDS = 60
+
+_source_semaphores = {name: threading.BoundedSemaphore(n) for name, n in SOURCE_CONCURRENCY.items()}
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Sessione HTTP condivisa con pool di connessioni persistenti."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(SOURCE_CONCURRENCY), pool_maxsize=MAX_WORKERS)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def base_url(source):
+    """URL di base della sorgente, letto a ogni chiamata (override da variabile d'ambiente)."""
+    return os.environ.get(f"KRITERION_{source.upper()}_BASE_URL") or BASE_URLS[source]
+
+
+def _remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _get_with_retry(source, url, params, timeout, deadline=None):
+    """
+    GET con retry/backoff su errori di rete, 429 e 5xx.
+    Ritorna l'ultima risposta ottenuta (o None se nessuna) senza sollevare.
+    """
+    response = None
+    for attempt in range(MAX_RETRIES + 1):
+        remaining = _remaining(deadline)
+        if remaining is not None and remaining <= 0:
+            break
+        request_timeout = timeout if remaining is None else min(timeout, remaining)
+        with _source_semaphores[source]:
+            try:
+                response = get_session().get(url, params=params, timeout=request_timeout)
+            except requests.exceptions.RequestException as e:
+                response = None
+                telemetry.event('http.error', source=source, error=repr(e))
+        telemetry.incr('http.request', source=source, status=response.status_code if response is not None else 'error')
+        if response is not None and response.status_code != 429 and response.status_code < 500:
+            return response
+        if attempt < MAX_RETRIES:
+            telemetry.incr('http.retry', source=source)
+            pause = BACKOFF_SECONDS * (2 ** attempt)
+            if response is not None and response.status_code == 429:
+                # Rispetta Retry-After quando il server lo indica
+                try:
+                    pause = max(pause, float(response.headers.get('Retry-After', 0)))
+                except (TypeError, ValueError):
+                    pass
+            remaining = _remaining(deadline)
+            if remaining is not None:
+                pause = min(pause, max(remaining, 0))
+            time.sleep(pause)
+    return response
+
+
+def _date_str(value):
+    fmt = '%Y-%m-%d'
+    return value.strftime(fmt) if isinstance(value, (datetime.date, datetime.datetime)) else value
+
+
+# ==============================================================================
+# DOWNLOAD SINGOLA SERIE
+# ==============================================================================
+
+def fetch_hybrid_data(ticker_yahoo, api_key, start_date, end_date, deadline=None):
+    """Fallback ibrido EODHD -> Yahoo Finance (span 'fetch.market' con la sorgente usata)."""
+    with telemetry.span('fetch.market', ticker=ticker_yahoo) as attrs:
+        data, source_used = _fetch_hybrid_data(ticker_yahoo, api_key, start_date, end_date, deadline)
+        attrs.update(source=source_used, rows=len(data))
+    return data, source_used
+
+
+def _fetch_hybrid_data(ticker_yahoo, api_key, start_date, end_date, deadline=None):
+    eodhd_symbol = TICKER_MAPPING_EODHD.get(ticker_yahoo, ticker_yahoo)
+    data_eodhd = pd.DataFrame()
+    source_used = "N/A"
+    fallback_reason = "nessuna chiave EODHD"
+
+    # 1. TENTATIVO EODHD
+    if api_key:
+        try:
+            url = f"{base_url('eodhd')}/eod/{eodhd_symbol}"
+            params = {'api_token': api_key, 'fmt': 'json', 'from': _date_str(start_date),
+                      'to': _date_str(end_date), 'period': 'd'}
+
+            r = _get_with_retry('eodhd', url, params, timeout=5, deadline=deadline)
+            fallback_reason = f"HTTP {r.status_code}" if r is not None else "nessuna risposta"
+            if r is not None and r.status_code == 200:
+                fallback_reason = "risposta vuota"
+                json_data = r.json()
+                if json_data and isinstance(json_data, list) and len(json_data) > 0:
+                    df = pd.DataFrame(json_data)
+                    df = df.rename(columns={'date': 'Date', 'open': 'Open', 'high': 'High',
+                                            'low': 'Low', 'close': 'Close', 'volume': 'Volume'})
+                    df['Date'] = pd.to_datetime(df['Date'])
+                    df.set_index('Date', inplace=True)
+
+                    if not df.empty:
+                        cols = ['Open', 'High', 'Low', 'Close', 'Volume']
+                        for c in cols:
+                            if c in df.columns:
+                                df[c] = pd.to_numeric(df[c], errors='coerce')
+                        data_eodhd = df[cols]
+                        source_used = "EODHD"
+        except Exception as e:
+            fallback_reason = repr(e)
+            telemetry.event('fetch.error', source='eodhd', ticker=ticker_yahoo, error=repr(e))
+
+    # 2. TENTATIVO YAHOO (FALLBACK)
+    if data_eodhd.empty:
+        telemetry.incr('fetch.fallback', ticker=ticker_yahoo)
+        telemetry.event('fetch.fallback', ticker=ticker_yahoo, reason=fallback_reason)
+        remaining = _remaining(deadline)
+        if remaining is not None and remaining <= 0:
+            return data_eodhd, source_used
+        if base_url('yahoo'):
+            data_yahoo = fetch_yahoo_chart(ticker_yahoo, start_date, end_date, deadline=deadline)
+            if not data_yahoo.empty:
+                return data_yahoo, "Yahoo (Fallback)"
+            return data_eodhd, source_used
+        try:
+            import yfinance as yf
+
+            with _source_semaphores['yahoo']:
+                df_yf = yf.download(ticker_yahoo, start=start_date, end=end_date, progress=False, auto_adjust=False)
+            if not df_yf.empty:
+                if isinstance(df_yf.columns, pd.MultiIndex):
+                    try:
+                        df_yf = df_yf.xs(ticker_yahoo, axis=1, level=1, drop_level=True)
+                    except KeyError:
+                        pass
+
+                data_eodhd = df_yf[['Open', 'High', 'Low', 'Close', 'Volume']]
+                source_used = "Yahoo (Fallback)"
+        except Exception as e:
+            # Eseguito nei thread del pool: niente chiamate Streamlit qui
+            print(f"Errore download fallback ({ticker_yahoo}): {e}")
+            telemetry.event('fetch.error', source='yahoo', ticker=ticker_yahoo, error=repr(e))
+
+    return data_eodhd, source_used
+
+
+def fetch_yahoo_chart(ticker_yahoo, start_date, end_date, deadline=None):
+    """Barre giornaliere dall'endpoint chart JSON di Yahoo (v8) su base_url('yahoo')."""
+    start = pd.Timestamp(_date_str(start_date))
+    end = pd.Timestamp(_date_str(end_date))
+    params = {'period1': int(start.timestamp()), 'period2': int(end.timestamp()), 'interval': '1d'}
+    response = _get_with_retry('yahoo', f"{base_url('yahoo')}/v8/finance/chart/{ticker_yahoo}", params,
+                               timeout=10, deadline=deadline)
+    if response is None or response.status_code != 200:
+        return pd.DataFrame()
+    try:
+        result = response.json()['chart']['result'][0]
+        quote = result['indicators']['quote'][0]
+        index = pd.to_datetime(result['timestamp'], unit='s').normalize().rename('Date')
+        df = pd.DataFrame({'Open': quote['open'], 'High': quote['high'], 'Low': quote['low'],
+                           'Close': quote['close'], 'Volume': quote['volume']}, index=index, dtype=float)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return pd.DataFrame()
+    # Come yf.download: la data finale e' esclusa
+    return df[df.index < end]
+
+
+def fetch_fred_series(series_id, api_key, start_date, end_date=None, deadline=None):
+    """Scarica una serie FRED come DataFrame con colonna 'value' (span 'fetch.fred')."""
+    with telemetry.span('fetch.fred', series=series_id) as attrs:
+        data, source = _fetch_fred_series(series_id, api_key, start_date, end_date, deadline)
+        attrs.update(source=source, rows=len(data))
+    return data, source
+
+
+def _fetch_fred_series(series_id, api_key, start_date, end_date=None, deadline=None):
+    params = {'series_id': series_id, 'api_key': api_key, 'file_type': 'json',
+              'observation_start': _date_str(start_date)}
+    if end_date is not None:
+        params['observation_end'] = _date_str(end_date)
+
+    response = _get_with_retry('fred', f"{base_url('fred')}/series/observations", params, timeout=30, deadline=deadline)
+    if response is not None and response.status_code == 200:
+        obs = response.json().get('observations', [])
+        if obs:
+            temp_df = pd.DataFrame(obs)[['date', 'value']]
+            temp_df['date'] = pd.to_datetime(temp_df['date'])
+            temp_df.set_index('date', inplace=True)
+            temp_df['value'] = pd.to_numeric(temp_df['value'], errors='coerce')
+            return temp_df, "FRED"
+    return pd.DataFrame(), "N/A"
+
+
+# ==============================================================================
+# DOWNLOAD CONCORRENTE DI TUTTE LE SERIE
+# ==============================================================================
+
+def fetch_all_data(tickers, fred_series, eodhd_api_key, fred_api_key, start_date, end_date,
+                   progress_callback=None, deadline_seconds=DEFAULT_DEADLINE_SECONDS):
+    """
+    Scarica in parallelo (passando dalla cache locale) serie di mercato e FRED.
+
+    Args:
+        tickers (list): Ticker Yahoo da scaricare (es. ['SPY', 'ES=F', ...]).
+        fred_series (dict): {nome colonna: series_id FRED}.
+        eodhd_api_key (str | None): Chiave EODHD; senza chiave si usa solo Yahoo.
+        fred_api_key (str | None): Chiave FRED; senza chiave la parte macro e' saltata.
+        start_date, end_date: Intervallo richiesto per i dati di mercato.
+        progress_callback (callable | None): progress_callback(completati, totali, etichetta, sorgente),
+            invocata dal thread chiamante a ogni download concluso.
+        deadline_seconds (float | None): Scadenza globale; le serie non arrivate in tempo sono scartate.
+
+    Returns:
+        tuple: ({ticker: DataFrame}, {nome: Series FRED}, {etichetta: sorgente}).
+    """
+    deadline = None if deadline_seconds is None else time.monotonic() + deadline_seconds
+    # Come in origine le serie FRED arrivano fino all'ultima osservazione disponibile
+    fred_end = datetime.date.today()
+
+    jobs = {}
+    for ticker in tickers:
+        jobs[('market', ticker)] = (
+            f"eod_{ticker}",
+            lambda s, e, t=ticker: fetch_hybrid_data(t, eodhd_api_key, s, e, deadline=deadline),
+            start_date, end_date
+        )
+    if fred_api_key:
+        for name, series_id in fred_series.items():
+            jobs[('fred', name)] = (
+                f"fred_{series_id}",
+                lambda s, e, sid=series_id: fetch_fred_series(sid, fred_api_key, s, e, deadline=deadline),
+                start_date, fred_end
+            )
+
+    results = {}
+    sources = {}
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='fetch')
+    try:
+        with telemetry.span('fetch.all', jobs=len(jobs)):
+            futures = {executor.submit(cached_download, *args): job for job, args in jobs.items()}
+            try:
+                for done, future in enumerate(as_completed(futures, timeout=_remaining(deadline)), start=1):
+                    kind, label = futures[future]
+                    try:
+                        data, source = future.result()
+                    except Exception as e:
+                        data, source = pd.DataFrame(), "N/A"
+                        telemetry.event('fetch.error', label=label, error=repr(e))
+                    results[(kind, label)] = data
+                    sources[label] = source
+                    if progress_callback:
+                        progress_callback(done, len(futures), label, source)
+            except FuturesTimeoutError:
+                missing = [label for kind, label in futures.values() if (kind, label) not in results]
+                print(f"Scadenza globale di {deadline_seconds}s superata, serie mancanti: {missing}")
+                telemetry.event('fetch.deadline', seconds=deadline_seconds, missing=','.join(missing))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Ricompone i risultati nell'ordine dichiarato (indipendente dall'ordine di arrivo)
+    market_data_dfs = {}
+    for ticker in tickers:
+        data = results.get(('market', ticker))
+        if data is not None and not data.empty:
+            market_data_dfs[ticker] = data
+    cmi_data_dict = {}
+    for name in fred_series:
+        data = results.get(('fred', name))
+        if data is not None and not data.empty:
+            cmi_data_dict[name] = data['value']
+
+    return market_data_dfs, cmi_data_dict, sources
@@ -0,0 +1,119 @@
+# src/downsample.py
+"""
+Sottocampionamento delle serie per i grafici.
+
+Un backtest dal 2007 ha migliaia di barre giornaliere (centinaia di migliaia
+intraday), ma un grafico largo qualche migliaio di pixel non puo' mostrarne
+di piu'. Qui si scelgono gli indici dei punti da disegnare, cosi' il payload
+inviato al browser resta limitato qualunque sia la lunghezza della storia:
+
+- LTTB (Largest-Triangle-Three-Buckets): un punto per bucket, quello che
+  forma il triangolo piu' grande con il punto scelto prima e la media del
+  bucket successivo; conserva la forma visiva della curva.
+- min-max: minimo e massimo di ogni bucket; conserva esattamente i picchi e
+  i minimi (drawdown) ed e' completamente vettoriale.
+
+Le funzioni lavorano sulle posizioni delle barre, quindi le pause notturne o
+dei weekend non pesano nella scelta dei punti.
+"""
+
+import numpy as np
+
+DEFAULT_WIDTH_PX = 1400
+
+
+def max_points_for_width(width_px=DEFAULT_WIDTH_PX, method='lttb'):
+    """Punti utili per un grafico largo width_px: uno per pixel (LTTB) o due (min e max)."""
+    return int(width_px) * (2 if method == 'minmax' else 1)
+
+
+def lttb_indices(y, n_out):
+    """
+    Indici scelti da LTTB, ordinati, sempre con il primo e l'ultimo punto.
+
+    Args:
+        y (array-like): Valori della serie (i NaN non vengono scelti se il bucket ha valori).
+        n_out (int): Punti desiderati.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=float)
+    # n_out - 2 bucket interni su [1, n - 1); primo e ultimo punto fissi
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    # Media di ogni bucket (e del solo ultimo punto dopo l'ultimo bucket) con somme cumulate
+    bounds = np.append(edges, n)
+    finite = np.where(np.isnan(y), 0.0, y)
+    sums = np.concatenate(([0.0], np.cumsum(finite)))
+    counts = np.concatenate(([0], np.cumsum(~np.isnan(y))))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_y = (sums[bounds[1:]] - sums[bounds[:-1]]) / (counts[bounds[1:]] - counts[bounds[:-1]])
+    avg_x = (bounds[1:] + bounds[:-1] - 1) / 2
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y[i + 1] - y[a]))
+        if np.isnan(area).all():
+            a = start
+        else:
+            a = start + int(np.nanargmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """Indici di minimo e massimo di n_out // 2 bucket, ordinati, con primo e ultimo punto."""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    size = int(np.max(np.diff(edges)))
+    # Matrice (bucket, posizione) degli indici; i bucket corti ripetono l'ultimo indice
+    index = np.minimum(edges[:-1, None] + np.arange(size), (edges[1:] - 1)[:, None])
+    values = y[index]
+    missing = np.isnan(values)
+    rows = np.arange(n_buckets)
+    lows = index[rows, np.argmin(np.where(missing, np.inf, values), axis=1)]
+    highs = index[rows, np.argmax(np.where(missing, -np.inf, values), axis=1)]
+    return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+
+def downsample_indices(y, max_points, method='lttb'):
+    """Indici da disegnare per una serie: 'lttb' o 'minmax' (vedi le funzioni sopra)."""
+    if method == 'minmax':
+        return minmax_indices(y, max_points)
+    if method == 'lttb':
+        return lttb_indices(y, max_points)
+    raise ValueError(f"Metodo di sottocampionamento non supportato: {method}")
+
+
+def downsample_frame(df, max_points, method='minmax', columns=None):
+    """
+    Righe di df da disegnare per tutte le colonne numeriche (o columns).
+
+    Il budget di punti e' diviso tra le colonne e gli indici scelti per
+    ciascuna sono uniti, cosi' ogni curva mantiene la sua forma.
+    """
+    columns = list(columns if columns is not None else df.select_dtypes('number').columns)
+    if len(df) <= max_points or not columns:
+        return df
+    budget = max(max_points // len(columns), 3)
+    rows = np.unique(np.concatenate([downsample_indices(df[col].to_numpy(dtype=float), budget, method)
+                                     for col in columns]))
+    return df.iloc[rows]
+
+
+def thin_events(n_events, max_events):
+    """Posizioni di al massimo max_events eventi distribuiti uniformemente, ultimo incluso."""
+    if n_events <= max_events:
+        return np.arange(n_events)
+    return np.unique(np.linspace(0, n_events - 1, max_events).round().astype(np.int64))
@@ -0,0 +1,490 @@
+# src/incremental.py
+"""
+Motore incrementale del segnale giornaliero con stato persistito su disco.
+
+Il bot calcolava ogni giorno 400 giorni di z-score, la media mobile del CMI,
+l'isteresi VIX e l'intero backtest per leggere solo l'ultima riga. Qui lo
+stato necessario per proseguire viene salvato in un file JSON:
+
+- buffer delle righe macro nella finestra campione (SAMPLE_DAYS giorni) con
+  somme e somme dei quadrati correnti per lo z-score e la somma sulle ultime
+  cmi_ma_window righe per la CMI_MA;
+- latch dell'isteresi sul VIX Ratio;
+- stato della copertura (tranche, contratti, prezzo di entrata, stop-out);
+- storico per barra dei valori notificati (HISTORY_DAYS giorni), da cui si
+  pubblica l'artefatto servito a dashboard e servizio dei segnali; il seed
+  lo ricostruisce per intero avanzando barra per barra dall'inizio.
+
+Ogni nuova barra aggiorna lo stato in O(1). Ogni VERIFY_EVERY_BARS barre un
+ricalcolo completo sulla stessa finestra controlla che segnali e indicatori
+coincidano e rigioca la copertura dall'ultimo checkpoint verificato; in caso
+di deriva lo stato viene risincronizzato. Se i parametri cambiano lo stato
+viene ricostruito da zero.
+
+Nota: lo z-score e' calcolato sul campione della finestra che termina alla
+barra corrente, come faceva il bot; la copertura invece prosegue sul proprio
+percorso invece di ripartire ogni giorno dal capitale iniziale, quindi i
+contratti possono differire da un replay completo della sola finestra.
+"""
+
+import datetime
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from src import telemetry
+from src.backtest import advance_hedge_state, run_backtest_kernel
+from src.indicator_calculator import vix_hysteresis_signal
+from src.strategy import FRED_SERIES_CMI, build_master_frame, compute_indicators, load_strategy_data
+
+STATE_VERSION = 2
+STATE_FILE_DEFAULT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'strategy_state.json'
+)
+SAMPLE_DAYS = 400
+VERIFY_EVERY_BARS = 20
+TOP_UP_DAYS = 10
+HISTORY_DAYS = 2 * 365
+SIGNAL_TOLERANCE = 1e-9
+
+# Segno con cui ogni componente entra nel CMI (curva dei rendimenti invertita)
+CMI_SIGNS = {'Yield_Curve_10Y2Y': -1.0}
+
+# Colonne dello storico per barra (stesso nome delle colonne di run_backtest)
+HISTORY_COLUMNS = ['SPY_Close', 'ES_Close', 'CMI_ZScore', 'CMI_MA', 'Signal_CMI', 'VIX_Ratio', 'Signal_VIX',
+                   'Signal_Count', 'MES_Contracts', 'Hedge_PnL', 'Portfolio_Value']
+SIGNAL_COLUMNS = ('Signal_CMI', 'Signal_VIX', 'Signal_Count')
+
+STRATEGY_PARAM_KEYS = ['capitale_iniziale', 'hedge_percentage_per_tranche', 'stop_loss_threshold_hedge',
+                       'micro_es_multiplier', 'cmi_ma_window', 'vix_ratio_upper_threshold',
+                       'vix_ratio_lower_threshold']
+
+
+def get_state_path():
+    """File di stato (sovrascrivibile con KRITERION_STATE_FILE)."""
+    return os.environ.get('KRITERION_STATE_FILE', STATE_FILE_DEFAULT)
+
+
+def params_fingerprint(params):
+    payload = json.dumps({k: float(params[k]) for k in STRATEGY_PARAM_KEYS if k in params}, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def load_state(path=None):
+    try:
+        with open(path or get_state_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(state, path=None):
+    path = path or get_state_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+# ==============================================================================
+# STATISTICHE CMI CORRENTI
+# ==============================================================================
+
+def _rebuild_sums(cmi, window):
+    """Ricalcola da zero le somme correnti dal buffer (ri-ancoraggio numerico)."""
+    values = np.array([row[1:] for row in cmi['rows']], dtype=float).reshape(-1, len(cmi['columns']))
+    cmi['sum'] = values.sum(axis=0).tolist()
+    cmi['sumsq'] = (values ** 2).sum(axis=0).tolist()
+    cmi['window_sum'] = values[-window:].sum(axis=0).tolist()
+
+
+def _push_cmi_row(cmi, date, values, window):
+    """Aggiunge una riga al campione ed espelle quelle uscite dalla finestra di SAMPLE_DAYS."""
+    rows = cmi['rows']
+    rows.append([date.strftime('%Y-%m-%d')] + list(values))
+    for k, v in enumerate(values):
+        cmi['sum'][k] += v
+        cmi['sumsq'][k] += v * v
+        cmi['window_sum'][k] += v
+    if len(rows) > window:
+        leaving = rows[-window - 1]
+        for k in range(len(values)):
+            cmi['window_sum'][k] -= leaving[k + 1]
+
+    cutoff = (date - datetime.timedelta(days=SAMPLE_DAYS)).strftime('%Y-%m-%d')
+    while rows and rows[0][0] < cutoff:
+        old = rows.pop(0)
+        for k in range(len(values)):
+            cmi['sum'][k] -= old[k + 1]
+            cmi['sumsq'][k] -= old[k + 1] ** 2
+        if len(rows) < window:
+            # La riga espulsa era anche nella finestra della media mobile
+            for k in range(len(values)):
+                cmi['window_sum'][k] -= old[k + 1]
+
+
+def _cmi_values(cmi, current, window):
+    """(CMI_ZScore, CMI_MA) dell'ultima riga dalle somme correnti; NaN se il campione e' corto."""
+    n = len(cmi['rows'])
+    if n < window:
+        return math.nan, math.nan
+    z_terms = []
+    ma_terms = []
+    for k, col in enumerate(cmi['columns']):
+        mean = cmi['sum'][k] / n
+        std = math.sqrt(max(cmi['sumsq'][k] / n - mean * mean, 0.0))
+        sign = CMI_SIGNS.get(col, 1.0)
+        z_terms.append(sign * (current[k] - mean) / std if std > 0 else math.nan)
+        ma_terms.append(sign * (cmi['window_sum'][k] / window - mean) / std if std > 0 else math.nan)
+    return sum(z_terms) / len(z_terms), sum(ma_terms) / len(ma_terms)
+
+
+# ==============================================================================
+# STORICO DEI VALORI NOTIFICATI
+# ==============================================================================
+
+def _history_row(date, values):
+    return [date] + [int(values[col]) if col in SIGNAL_COLUMNS else float(values[col]) for col in HISTORY_COLUMNS]
+
+
+def _push_history(state, values):
+    """Aggiunge la barra di last_signal allo storico ed espelle quelle oltre HISTORY_DAYS."""
+    rows = state['history']['rows']
+    rows.append(_history_row(values['date'], values))
+    cutoff = (pd.Timestamp(values['date']) - pd.Timedelta(days=HISTORY_DAYS)).strftime('%Y-%m-%d')
+    while rows and rows[0][0] < cutoff:
+        rows.pop(0)
+
+
+def history_frame(state):
+    """
+    Frame per barra dei valori calcolati dal bot (stesse colonne di run_backtest).
+
+    L'ultima riga coincide con state['last_signal']: chi pubblica questo frame
+    serve gli stessi numeri del messaggio Telegram.
+    """
+    history = state['history']
+    rows = history['rows']
+    df = pd.DataFrame([row[1:] for row in rows], columns=history['columns'],
+                      index=pd.DatetimeIndex([row[0] for row in rows], name='Date'))
+    for col in SIGNAL_COLUMNS:
+        df[col] = df[col].to_numpy(dtype=np.int8)
+    return df
+
+
+# ==============================================================================
+# SEED (RICALCOLO COMPLETO)
+# ==============================================================================
+
+@telemetry.timed('incremental.full_recompute')
+def _full_recompute(params, end_date, eodhd_api_key=None, fred_api_key=None):
+    """
+    Ricalcolo completo sugli ultimi SAMPLE_DAYS giorni prima dell'ultima barra, come il bot.
+
+    La finestra e' ancorata all'ultima barra disponibile (non alla data di
+    esecuzione), cosi' il ricalcolo e l'avanzamento incrementale usano lo
+    stesso campione anche nei giorni senza seduta.
+
+    Returns:
+        tuple: (stato, DataFrame con indicatori) oppure (None, None) se dati mancanti.
+    """
+    start_date = end_date - datetime.timedelta(days=SAMPLE_DAYS + TOP_UP_DAYS)
+    market_data_dfs, cmi_data_dict = load_strategy_data(start_date, end_date, eodhd_api_key, fred_api_key)
+    if not market_data_dfs:
+        return None, None
+
+    df = build_master_frame(market_data_dfs, cmi_data_dict)
+    if df.empty:
+        return None, None
+    return _window_state(df, params)
+
+
+def _window_state(df, params):
+    """Stato e frame con indicatori dalla finestra di SAMPLE_DAYS giorni che termina all'ultima barra di df."""
+    df = df[df.index >= df.index[-1] - pd.Timedelta(days=SAMPLE_DAYS)].copy()
+    cmi_cols = [col for col in FRED_SERIES_CMI.keys() if col in df.columns]
+    sample = df[cmi_cols].dropna()
+    last_values = df[cmi_cols].iloc[-1].tolist() if cmi_cols else []
+
+    df = compute_indicators(df, params)
+    if df is None:
+        return None, None
+
+    backtest = run_backtest_kernel(
+        df['SPY_Close'].to_numpy(), df['ES_Close'].to_numpy(), df['Signal_Count'].to_numpy(),
+        df['SPY_Open'].iloc[0], params['capitale_iniziale'],
+        params['hedge_percentage_per_tranche'], params['stop_loss_threshold_hedge'],
+        params['micro_es_multiplier']
+    )
+
+    ratio = df['VIX_Ratio'].to_numpy()
+    valid_ratio = ratio[~np.isnan(ratio)]
+    latch = bool(vix_hysteresis_signal(valid_ratio, params['vix_ratio_upper_threshold'],
+                                       params['vix_ratio_lower_threshold'])[-1]) if len(valid_ratio) else False
+
+    window = int(params['cmi_ma_window'])
+    cmi = {
+        'columns': cmi_cols,
+        'rows': [[d.strftime('%Y-%m-%d')] + list(v) for d, v in zip(sample.index, sample.to_numpy().tolist())],
+        'last_values': last_values,
+    }
+    _rebuild_sums(cmi, window)
+
+    history = df[['SPY_Close', 'ES_Close', 'CMI_ZScore', 'CMI_MA', 'Signal_CMI', 'VIX_Ratio', 'Signal_VIX',
+                  'Signal_Count']].assign(MES_Contracts=backtest['mes_contracts'], Hedge_PnL=backtest['hedge_pnl'],
+                                          Portfolio_Value=backtest['portfolio_value'])
+    dates = df.index.strftime('%Y-%m-%d').tolist()
+
+    last = df.iloc[-1]
+    state = {
+        'version': STATE_VERSION,
+        'params_key': params_fingerprint(params),
+        'last_date': df.index[-1].strftime('%Y-%m-%d'),
+        'bars_since_verify': 0,
+        'cmi': cmi,
+        'vix_latch': latch,
+        'hedge': backtest['final_state'],
+        'checkpoint': {'date': df.index[-1].strftime('%Y-%m-%d'), 'hedge': dict(backtest['final_state'])},
+        'last_signal': {
+            'date': df.index[-1].strftime('%Y-%m-%d'),
+            'Signal_CMI': int(last['Signal_CMI']),
+            'Signal_VIX': int(last['Signal_VIX']),
+            'Signal_Count': int(last['Signal_Count']),
+            'MES_Contracts': float(backtest['final_state']['es_contracts']),
+            'CMI_ZScore': float(last['CMI_ZScore']),
+            'CMI_MA': float(last['CMI_MA']),
+            'VIX_Ratio': float(last['VIX_Ratio']),
+        },
+        'history': {
+            'columns': HISTORY_COLUMNS,
+            'rows': [_history_row(d, values) for d, values in zip(dates, history.to_dict('records'))],
+        },
+    }
+    return state, df
+
+
+@telemetry.timed('incremental.seed')
+def seed_state(params, end_date, eodhd_api_key=None, fred_api_key=None, history_days=HISTORY_DAYS):
+    """
+    Stato iniziale con history_days giorni di storico (None se dati o indicatori mancano).
+
+    Il ricalcolo completo si fa sulla finestra che termina history_days giorni
+    prima dell'ultima barra; le barre successive vengono avanzate una alla
+    volta, come se il bot fosse girato ogni giorno. Lo storico pubblicato dopo
+    un seed copre cosi' subito tutto l'intervallo, con i valori che il bot
+    avrebbe notificato. Con meno dati si parte dalla sola ultima finestra.
+    """
+    start_date = end_date - datetime.timedelta(days=history_days + SAMPLE_DAYS + TOP_UP_DAYS)
+    market_data_dfs, cmi_data_dict = load_strategy_data(start_date, end_date, eodhd_api_key, fred_api_key)
+    if not market_data_dfs:
+        return None
+
+    df = build_master_frame(market_data_dfs, cmi_data_dict)
+    if df.empty:
+        return None
+    head = df[df.index <= df.index[-1] - pd.Timedelta(days=history_days)]
+    state = _window_state(head, params)[0] if not head.empty else None
+    if state is None:
+        return _window_state(df, params)[0]
+
+    for date, row in zip(*_bars_after(state, df)):
+        advance_state(state, date, row, params)
+    # Somme ri-ancorate e checkpoint all'ultima barra: la verifica riparte da qui
+    _rebuild_sums(state['cmi'], int(params['cmi_ma_window']))
+    state['bars_since_verify'] = 0
+    state['checkpoint'] = {'date': state['last_date'], 'hedge': dict(state['hedge'])}
+    return state
+
+
+# ==============================================================================
+# AVANZAMENTO INCREMENTALE
+# ==============================================================================
+
+def advance_state(state, date, row, params):
+    """
+    Avanza lo stato di una barra in O(1) e ne aggiorna 'last_signal'.
+
+    Args:
+        state (dict): Stato persistito, aggiornato in place.
+        date (pd.Timestamp): Data della nuova barra.
+        row (dict): Chiusure SPY/ES/VIX/VIX3M e valori macro (gia' forward-filled).
+        params (dict): Parametri della strategia.
+    """
+    cmi = state['cmi']
+    window = int(params['cmi_ma_window'])
+
+    current = [row[col] for col in cmi['columns']]
+    cmi['last_values'] = current
+    _push_cmi_row(cmi, date, current, window)
+    cmi_zscore, cmi_ma = _cmi_values(cmi, current, window)
+    signal_cmi = 1 if cmi_zscore > cmi_ma else 0
+
+    vix3m = row['VIX3M_Close']
+    vix_ratio = row['VIX_Close'] / vix3m if vix3m else math.nan
+    if not math.isnan(vix_ratio):
+        if vix_ratio > params['vix_ratio_upper_threshold']:
+            state['vix_latch'] = True
+        elif vix_ratio < params['vix_ratio_lower_threshold']:
+            state['vix_latch'] = False
+    signal_vix = 1 if state['vix_latch'] and not math.isnan(vix_ratio) else 0
+    signal_count = signal_cmi + signal_vix
+
+    step = advance_hedge_state(
+        state['hedge'], row['SPY_Close'], row['ES_Close'], signal_count,
+        params['hedge_percentage_per_tranche'], params['stop_loss_threshold_hedge'],
+        params['micro_es_multiplier']
+    )
+
+    state['last_date'] = date.strftime('%Y-%m-%d')
+    state['bars_since_verify'] += 1
+    state['last_signal'] = {
+        'date': state['last_date'],
+        'Signal_CMI': signal_cmi,
+        'Signal_VIX': signal_vix,
+        'Signal_Count': signal_count,
+        'MES_Contracts': float(step['mes_contracts']),
+        'CMI_ZScore': cmi_zscore,
+        'CMI_MA': cmi_ma,
+        'VIX_Ratio': vix_ratio,
+    }
+    _push_history(state, dict(state['last_signal'], SPY_Close=row['SPY_Close'], ES_Close=row['ES_Close'],
+                              Hedge_PnL=step['hedge_pnl'], Portfolio_Value=step['portfolio_value']))
+    return state['last_signal']
+
+
+def _bars_after(state, df):
+    """(date, righe) di df successive a state['last_date'], valori macro completati dallo stato."""
+    df = df[df.index > pd.Timestamp(state['last_date'])].copy()
+    for col, last_value in zip(state['cmi']['columns'], state['cmi']['last_values']):
+        if col in df.columns:
+            df[col] = df[col].fillna(last_value)
+        else:
+            df[col] = last_value
+    return df.index, df.to_dict('records')
+
+
+def _new_bars(state, end_date, eodhd_api_key, fred_api_key):
+    """Barre successive a state['last_date'] scaricate dall'ultima barra dello stato."""
+    last_date = pd.Timestamp(state['last_date'])
+    start_date = (last_date - pd.Timedelta(days=TOP_UP_DAYS)).date()
+    market_data_dfs, cmi_data_dict = load_strategy_data(start_date, end_date, eodhd_api_key, fred_api_key)
+    if not market_data_dfs:
+        return None
+    return _bars_after(state, build_master_frame(market_data_dfs, cmi_data_dict))
+
+
+def _replay_hedge(checkpoint, df, params):
+    """Rigioca la copertura dal checkpoint con i segnali di un ricalcolo completo."""
+    hedge = dict(checkpoint['hedge'])
+    after = df[df.index > pd.Timestamp(checkpoint['date'])]
+    for price_spy, price_es, target in zip(after['SPY_Close'].tolist(), after['ES_Close'].tolist(),
+                                           after['Signal_Count'].tolist()):
+        advance_hedge_state(hedge, price_spy, price_es, target, params['hedge_percentage_per_tranche'],
+                            params['stop_loss_threshold_hedge'], params['micro_es_multiplier'])
+    return hedge
+
+
+@telemetry.timed('incremental.verify')
+def verify_state(state, params, end_date, eodhd_api_key=None, fred_api_key=None):
+    """
+    Confronta lo stato incrementale con un ricalcolo completo alla stessa data.
+
+    Segnali e indicatori dell'ultima barra sono confrontati direttamente. La
+    copertura dipende dal percorso, quindi viene rigiocata dall'ultimo
+    checkpoint verificato con i segnali del ricalcolo e confrontata con lo
+    stato incrementale.
+
+    Returns:
+        tuple: (ok, dettagli delle differenze, stato corretto o None se il ricalcolo fallisce).
+    """
+    fresh, df = _full_recompute(params, end_date, eodhd_api_key, fred_api_key)
+    if fresh is None:
+        return False, {'error': 'ricalcolo completo fallito'}, None
+
+    ours, theirs = state['last_signal'], fresh['last_signal']
+    drift = {}
+    if ours['date'] != theirs['date'] or state['cmi']['columns'] != fresh['cmi']['columns']:
+        drift['date'] = (ours['date'], theirs['date'])
+    for key in ('Signal_CMI', 'Signal_VIX', 'Signal_Count'):
+        if ours[key] != theirs[key]:
+            drift[key] = (ours[key], theirs[key])
+    for key in ('CMI_ZScore', 'CMI_MA', 'VIX_Ratio'):
+        if not math.isclose(ours[key], theirs[key], rel_tol=SIGNAL_TOLERANCE, abs_tol=SIGNAL_TOLERANCE):
+            drift[key] = (ours[key], theirs[key])
+
+    checkpoint = state.get('checkpoint')
+    if checkpoint and pd.Timestamp(checkpoint['date']) >= df.index[0]:
+        hedge = _replay_hedge(checkpoint, df, params)
+        for key in ('current_tranches', 'hedge_stopped_out'):
+            if state['hedge'][key] != hedge[key]:
+                drift[key] = (state['hedge'][key], hedge[key])
+        if not math.isclose(state['hedge']['es_contracts'], hedge['es_contracts'],
+                            rel_tol=SIGNAL_TOLERANCE, abs_tol=SIGNAL_TOLERANCE):
+            drift['es_contracts'] = (state['hedge']['es_contracts'], hedge['es_contracts'])
+    else:
+        # Checkpoint uscito dalla finestra: si riparte dal percorso del ricalcolo
+        hedge = fresh['hedge']
+        drift['checkpoint'] = checkpoint['date'] if checkpoint else None
+
+    # Lo stato corretto tiene il percorso della copertura e riprende indicatori
+    # e somme correnti (ri-ancorate) dal ricalcolo
+    corrected = dict(fresh)
+    corrected['hedge'] = hedge
+    corrected['checkpoint'] = {'date': fresh['last_date'], 'hedge': dict(hedge)}
+    corrected['last_signal'] = dict(fresh['last_signal'], MES_Contracts=float(hedge['es_contracts']))
+
+    # Lo storico resta quello notificato; solo l'ultima barra prende i valori corretti
+    rows = state['history']['rows']
+    if rows and rows[-1][0] == fresh['last_date']:
+        last = dict(zip(HISTORY_COLUMNS, rows[-1][1:]))
+        last.update(corrected['last_signal'],
+                    Portfolio_Value=hedge['spy_shares'] * last['SPY_Close'] + hedge['cash_from_hedging'])
+        corrected['history'] = {'columns': HISTORY_COLUMNS,
+                                'rows': rows[:-1] + [_history_row(fresh['last_date'], last)]}
+    return not drift, drift, corrected
+
+
+def run_incremental_signal(params, end_date=None, state_path=None, eodhd_api_key=None, fred_api_key=None,
+                           verify_every=VERIFY_EVERY_BARS, force_full=False):
+    """
+    Produce il segnale dell'ultima barra avanzando lo stato persistito.
+
+    Returns:
+        tuple: (last_signal, info) dove info riporta modalita', barre nuove ed
+        esito della verifica; (None, info) se i dati non sono disponibili.
+    """
+    end_date = end_date or datetime.date.today()
+    info = {'mode': 'incremental', 'new_bars': 0, 'verified': False, 'drift': {}}
+
+    state = None if force_full else load_state(state_path)
+    if (state is None or state.get('version') != STATE_VERSION
+            or state.get('params_key') != params_fingerprint(params)):
+        info['mode'] = 'full'
+        state = seed_state(params, end_date, eodhd_api_key, fred_api_key)
+        if state is None:
+            return None, info
+    else:
+        new_bars = _new_bars(state, end_date, eodhd_api_key, fred_api_key)
+        if new_bars is None:
+            return None, info
+        dates, rows = new_bars
+        for date, row in zip(dates, rows):
+            advance_state(state, date, row, params)
+        info['new_bars'] = len(rows)
+
+        if state['bars_since_verify'] >= verify_every:
+            ok, drift, fresh = verify_state(state, params, end_date, eodhd_api_key, fred_api_key)
+            info['verified'] = ok
+            info['drift'] = drift
+            if fresh is not None:
+                if not ok:
+                    print(f"Deriva dello stato incrementale, risincronizzazione: {drift}")
+                state = fresh
+
+    save_state(state, state_path)
+    return state['last_signal'], info
@@ -0,0 +1,263 @@
+# src/indicator_calculator.py
+"""
+Primitive vettoriali per gli indicatori della strategia.
+"""
+
+import numpy as np
+
+# Barre per blocco delle somme cumulate ri-ancorate di PrefixSums
+REANCHOR_BLOCK = 4096
+
+
+def vix_hysteresis_signal(ratio, upper, lower):
+    """
+    Segnale con isteresi sul VIX Ratio, senza loop Python.
+
+    Il latch si accende quando ratio > upper, si spegne quando ratio < lower
+    e altrimenti mantiene lo stato precedente. Le barre con ratio NaN non
+    cambiano lo stato e valgono 0 (stessa semantica del loop originale).
+
+    Args:
+        ratio (array-like): Serie 1-D del rapporto VIX / VIX3M, oppure matrice
+            (n, p) di p percorsi con soglie scalari.
+        upper, lower (float | array-like): Soglie scalari, oppure vettori di
+            lunghezza k per valutare k coppie di soglie in un solo passaggio.
+
+    Returns:
+        np.ndarray: int8 della forma di ratio con soglie scalari, (n, k) altrimenti.
+    """
+    ratio = np.asarray(ratio, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    lower = np.asarray(lower, dtype=float)
+    batch = upper.ndim > 0 or lower.ndim > 0
+
+    values = ratio[:, None] if batch else ratio
+    n = len(ratio)
+    # Evento per barra: 1 = accensione, 0 = spegnimento, -1 = nessun cambio (anche NaN)
+    events = np.where(values > upper, 1, np.where(values < lower, 0, -1)).astype(np.int8)
+
+    # Forward-fill dell'ultimo evento tramite il massimo cumulato degli indici
+    positions = np.arange(n).reshape((n,) + (1,) * (values.ndim - 1))
+    last_event = np.where(events >= 0, positions, -1)
+    np.maximum.accumulate(last_event, axis=0, out=last_event)
+
+    state = np.take_along_axis(events, np.maximum(last_event, 0), axis=0) == 1
+    state &= last_event >= 0
+    state &= ~np.isnan(values)
+    return state.astype(np.int8)
+
+
+def vix_hysteresis_batch(ratio, threshold_pairs):
+    """
+    Valuta piu' coppie (upper, lower) sullo stesso VIX Ratio.
+
+    Args:
+        ratio (array-like): Serie 1-D del rapporto VIX / VIX3M.
+        threshold_pairs (array-like): Matrice (k, 2) di coppie (upper, lower).
+
+    Returns:
+        np.ndarray: int8 di forma (n, k), una colonna per coppia.
+    """
+    pairs = np.asarray(threshold_pairs, dtype=float).reshape(-1, 2)
+    return vix_hysteresis_signal(ratio, pairs[:, 0], pairs[:, 1])
+
+
+def running_zscore(values, window=None, min_periods=2):
+    """
+    Z-score point-in-time con statistiche correnti in O(n).
+
+    Ogni barra e' standardizzata con media e deviazione standard (ddof=0,
+    come scipy.stats.zscore) delle sole osservazioni fino a se stessa:
+    tutte (espandente) o le ultime window. Le somme cumulate sono calcolate
+    sui valori traslati della prima osservazione per limitare la
+    cancellazione numerica; la finestra mobile usa PrefixSums.
+
+    Args:
+        values (array-like): Serie (n,) o array (n, ...) senza NaN, standardizzato lungo l'asse 0.
+        window (int | None): Finestra mobile in barre; None = finestra espandente.
+        min_periods (int): Osservazioni minime; prima vale NaN.
+
+    Returns:
+        np.ndarray: Z-score della stessa forma di values.
+    """
+    x = np.asarray(values, dtype=float)
+    n = len(x)
+    if n == 0:
+        return x.copy()
+    if window is not None and window < n:
+        return PrefixSums(x).rolling_zscore([window], min_periods)[:, 0]
+    y = x - x[0]
+    sum1 = np.cumsum(y, axis=0)
+    sum2 = np.cumsum(y * y, axis=0)
+    count = np.arange(1, n + 1, dtype=float).reshape((n,) + (1,) * (x.ndim - 1))
+
+    mean = sum1 / count
+    variance = np.maximum(sum2 / count - mean * mean, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (y - mean) / np.sqrt(variance)
+    z[variance <= 0] = np.nan
+    z[:min(max(min_periods, 1) - 1, n)] = np.nan
+    return z
+
+
+class PrefixSums:
+    """
+    Somme cumulate di valori e quadrati, calcolate una volta per tante finestre.
+
+    Ogni statistica mobile su window barre e' una differenza di somme
+    cumulate, quindi O(n) per finestra qualunque sia la sua lunghezza. Per
+    non accumulare errore su storie lunghe le somme sono ri-ancorate a ogni
+    blocco di REANCHOR_BLOCK barre (almeno la finestra piu' lunga): dentro
+    un blocco si cumulano gli scarti dalla prima osservazione del blocco,
+    ripartendo da zero, e una finestra a cavallo di due blocchi porta la
+    parte nel blocco precedente sull'ancora di quello corrente. Le
+    differenze coinvolgono cosi' solo somme locali e l'errore non cresce
+    con n ne' con la deriva della serie. I NaN sono contati a parte (interi,
+    esatti): una finestra che ne contiene vale NaN come in pandas rolling.
+
+    Args:
+        values (array-like): Serie (n,) o array (n, ...), elaborato lungo l'asse 0.
+        block (int): Barre per blocco di ri-ancoraggio.
+    """
+
+    def __init__(self, values, block=REANCHOR_BLOCK):
+        x = np.asarray(values, dtype=float)
+        self.shape = x.shape
+        self.n = len(x)
+        self.x = x.reshape(self.n, -1)
+        self.missing = np.isnan(self.x)
+        self.observed = np.concatenate([np.zeros((1, self.x.shape[1]), dtype=np.int64),
+                                        np.cumsum(~self.missing, axis=0)])
+        self.block = int(block)
+        self._rows = np.arange(self.n)
+        self._blocks = {}
+
+    def _anchored(self, block):
+        """Ancora per barra e somme locali di scarti e quadrati per blocchi di block barre."""
+        if block not in self._blocks:
+            n, width = self.x.shape
+            padded = -(-n // block) * block
+            blocks = np.full((padded, width), np.nan)
+            blocks[:n] = self.x
+            blocks = blocks.reshape(-1, block, width)
+            has_value = ~np.isnan(blocks)
+            first = np.take_along_axis(blocks, np.argmax(has_value, axis=1)[:, None, :], axis=1)[:, 0]
+            # Blocchi tutti NaN: vale l'ancora precedente (0 se nessuna)
+            anchor = _ffill_rows(np.where(has_value.any(axis=1), first, np.nan))
+            deviations = np.where(has_value, blocks - anchor[:, None, :], 0.0)
+            self._blocks[block] = {
+                'anchor': anchor,
+                'anchor_rows': np.repeat(anchor, block, axis=0)[:n],
+                'sum1': np.cumsum(deviations, axis=1).reshape(padded, width)[:n],
+                'sum2': np.cumsum(deviations * deviations, axis=1).reshape(padded, width)[:n],
+            }
+        return self._blocks[block]
+
+    def window_sums(self, window, squares=True):
+        """
+        Somme sulle ultime window barre di ogni barra (meno all'inizio della serie).
+
+        Returns:
+            dict: 'bars' (barre nella finestra, (n, 1)), 'count' (osservazioni non NaN),
+            'anchor' (ancora del blocco della barra), 'sum1' e 'sum2' (somme degli scarti
+            dall'ancora e dei loro quadrati; sum2 solo con squares), forme (n, colonne).
+        """
+        window = int(window)
+        block = max(self.block, window)
+        anchored = self._anchored(block)
+        n = self.n
+        count = self.observed[1:].copy()
+        result = {
+            'bars': np.minimum(self._rows + 1, window)[:, None],
+            'count': count,
+            'anchor': anchored['anchor_rows'],
+            'sum1': anchored['sum1'].copy(),
+            'sum2': anchored['sum2'].copy() if squares else None,
+        }
+        if window >= n:
+            return result
+
+        count[window:] -= self.observed[1:n - window + 1]
+        result['sum1'][window:] -= anchored['sum1'][:-window]
+        if squares:
+            result['sum2'][window:] -= anchored['sum2'][:-window]
+        # Barre la cui finestra inizia nel blocco precedente (window <= block): la differenza
+        # sopra non vale, si somma invece la coda di quel blocco portata sull'ancora corrente
+        block_of = self._rows // block
+        i = np.flatnonzero(block_of[window:] != block_of[:-window]) + window
+        if len(i):
+            j = i - window
+            block_end = (block_of[j] + 1) * block - 1
+            carried = self.observed[block_end + 1] - self.observed[j + 1]
+            shift = anchored['anchor'][block_of[i]] - anchored['anchor'][block_of[j]]
+            tail1 = anchored['sum1'][block_end] - anchored['sum1'][j]
+            result['sum1'][i] = anchored['sum1'][i] + tail1 - carried * shift
+            if squares:
+                tail2 = anchored['sum2'][block_end] - anchored['sum2'][j]
+                result['sum2'][i] = anchored['sum2'][i] + tail2 - 2 * shift * tail1 + carried * shift * shift
+        return result
+
+    def _stats(self, windows, min_periods, squares):
+        for window in windows:
+            sums = self.window_sums(window, squares)
+            required = window if min_periods is None else max(min_periods, 1)
+            valid = (sums['count'] == sums['bars']) & (sums['bars'] >= required)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = sums['sum1'] / sums['count']
+                variance = np.maximum(sums['sum2'] / sums['count'] - mean * mean, 0.0) if squares else None
+            yield valid, sums['anchor'], mean, variance
+
+    def _output(self, windows):
+        return np.empty((len(windows), self.n) + self.x.shape[1:])
+
+    def _shaped(self, out):
+        # Finestre sull'asse 1: (n, len(windows), ...) come una colonna per finestra
+        return np.moveaxis(out.reshape((len(out), self.n) + self.shape[1:]), 0, 1)
+
+    def rolling_mean(self, windows, min_periods=None):
+        """
+        Medie mobili per ogni finestra in windows.
+
+        Args:
+            windows (list[int]): Lunghezze delle finestre in barre.
+            min_periods (int | None): Barre minime per una media; None = finestra piena.
+
+        Returns:
+            np.ndarray: Forma (n, len(windows), ...), NaN dove la finestra e' incompleta o ha NaN.
+        """
+        out = self._output(windows)
+        for k, (valid, anchor, mean, _) in enumerate(self._stats(windows, min_periods, False)):
+            np.add(anchor, mean, out=out[k])
+            out[k][~valid] = np.nan
+        return self._shaped(out)
+
+    def rolling_std(self, windows, min_periods=None):
+        """Deviazioni standard mobili (ddof=0) per ogni finestra, forma (n, len(windows), ...)."""
+        out = self._output(windows)
+        for k, (valid, _, _, variance) in enumerate(self._stats(windows, min_periods, True)):
+            np.sqrt(variance, out=out[k])
+            out[k][~valid] = np.nan
+        return self._shaped(out)
+
+    def rolling_zscore(self, windows, min_periods=None):
+        """
+        Z-score di ogni barra rispetto alla propria finestra (ddof=0, come running_zscore).
+
+        Returns:
+            np.ndarray: Forma (n, len(windows), ...), NaN se la finestra e' incompleta o costante.
+        """
+        out = self._output(windows)
+        for k, (valid, anchor, mean, variance) in enumerate(self._stats(windows, min_periods, True)):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.divide(self.x - anchor - mean, np.sqrt(variance), out=out[k])
+            out[k][~(valid & (variance > 0))] = np.nan
+        return self._shaped(out)
+
+
+def _ffill_rows(values):
+    """Forward-fill lungo l'asse 0 di una matrice (n, k); i NaN iniziali diventano 0."""
+    rows = np.arange(len(values))[:, None]
+    last = np.where(np.isnan(values), -1, rows)
+    np.maximum.accumulate(last, axis=0, out=last)
+    filled = np.take_along_axis(values, np.maximum(last, 0), axis=0)
+    return np.where(last >= 0, filled, 0.0)
@@ -0,0 +1,226 @@
+# src/metrics.py
+"""
+Metriche di performance della strategia e del benchmark.
+
+performance_matrix calcola tutte le statistiche in un solo passaggio
+vettoriale su una matrice di rendimenti (una colonna per strategia,
+combinazione di parametri o benchmark), cosi' sweep e walk-forward non
+iterano serie per serie. I risultati sono numerici: la formattazione e'
+compito del livello di presentazione (vedi format_metrics nella dashboard).
+
+Le statistiche dei cicli di copertura (hedge_cycles) sono riduzioni per
+segmento sul registro degli eventi del kernel (HedgeLedger), in O(eventi)
+invece che sulle colonne per barra del frame.
+"""
+
+import numpy as np
+import pandas as pd
+
+from src.backtest import ADD, ENTRY, LEDGER_ATTR, LEDGER_KINDS, REARM, REDUCE, STOP
+
+STAT_NAMES = ['total_return', 'cagr', 'volatility', 'sharpe', 'max_drawdown', 'calmar']
+HEDGE_METRIC_NAMES = ['hedge_trades', 'stop_loss_events', 'max_hedge_drawdown', 'max_adverse_excursion',
+                      'stop_loss_hit_rate']
+CYCLE_COLUMNS = ['entry_date', 'exit_date', 'bars', 'outcome', 'entry_price', 'exit_price', 'equity_at_entry',
+                 'max_tranches', 'max_contracts', 'adds', 'reductions', 'pnl', 'return', 'max_adverse_excursion',
+                 'worst_day']
+
+
+def performance_matrix(returns, trading_days=252):
+    """
+    Statistiche per colonna di una matrice di rendimenti giornalieri.
+
+    I NaN sono ignorati colonna per colonna (serie di lunghezza diversa
+    possono stare nella stessa matrice); l'input non viene modificato e i
+    DataFrame non vengono copiati in nuovi frame.
+
+    Args:
+        returns (np.ndarray | pd.DataFrame): Matrice (n_giorni, n_serie) o vettore.
+        trading_days (int): Giorni di borsa per anno.
+
+    Returns:
+        dict: {statistica: np.ndarray di lunghezza n_serie} per ogni nome in STAT_NAMES.
+    """
+    r = np.asarray(returns, dtype=float)
+    if r.ndim == 1:
+        r = r[:, None]
+    valid = ~np.isnan(r)
+    count = valid.sum(axis=0)
+    filled = np.where(valid, r, 0.0)
+
+    # Equity cumulata: i giorni mancanti non cambiano il valore ma sono esclusi dal drawdown
+    cumulative = filled + 1.0
+    np.cumprod(cumulative, axis=0, out=cumulative)
+    final = cumulative[-1].copy() if len(r) else np.ones(r.shape[1])
+    cumulative[~valid] = np.nan
+    cumulative_max = np.fmax.accumulate(cumulative, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cumulative -= cumulative_max
+        cumulative /= cumulative_max
+        max_drawdown = np.fmin.reduce(cumulative, axis=0) if len(r) else np.full(r.shape[1], np.nan)
+
+        num_years = count / trading_days
+        cagr = np.where(num_years > 0, final ** (1 / np.where(num_years > 0, num_years, 1)) - 1, 0.0)
+
+        mean = filled.sum(axis=0) / count
+        filled -= mean
+        filled[~valid] = 0.0
+        variance = np.einsum('ij,ij->j', filled, filled) / (count - 1)
+        volatility = np.sqrt(variance) * np.sqrt(trading_days)
+
+        sharpe = np.where(volatility > 0.0001, cagr / volatility, 0.0)
+        calmar = np.where(max_drawdown != 0, cagr / np.abs(max_drawdown), 0.0)
+
+    return {
+        'total_return': final - 1,
+        'cagr': cagr,
+        'volatility': volatility,
+        'sharpe': sharpe,
+        'max_drawdown': max_drawdown,
+        'calmar': calmar,
+    }
+
+
+def performance_table(returns, trading_days=252):
+    """performance_matrix su un DataFrame: una riga per colonna di input, una colonna per statistica."""
+    stats = performance_matrix(returns, trading_days)
+    return pd.DataFrame(stats, index=returns.columns, columns=STAT_NAMES)
+
+
+def return_stats(returns, trading_days=252):
+    """Statistiche numeriche (non formattate) di una singola serie di rendimenti giornalieri."""
+    return {name: float(values[0]) for name, values in performance_matrix(returns, trading_days).items()}
+
+
+def results_ledger(results_df):
+    """Registro degli eventi del frame di run_backtest, None se assente o di un altro frame (es. una fetta)."""
+    ledger = results_df.attrs.get(LEDGER_ATTR)
+    if ledger is None or ledger.n_bars != len(results_df) or ledger.dates is None:
+        return None
+    if not results_df.index[ledger.bar].equals(ledger.dates):
+        return None
+    return ledger
+
+
+def ledger_frame(ledger):
+    """Eventi del registro come DataFrame indicizzato per data, con il nome del tipo in 'kind'."""
+    return pd.DataFrame({
+        'kind': ledger.kind_names(),
+        'tranches': ledger.tranches,
+        'contracts': ledger.contracts,
+        'es_price': ledger.es_price,
+        'portfolio_value': ledger.portfolio_value,
+        'cycle_pnl': ledger.cycle_pnl,
+    }, index=ledger.dates if ledger.dates is not None else pd.Index(ledger.bar, name='bar'))
+
+
+def hedge_cycles(ledger):
+    """
+    Una riga per ciclo di copertura (da ENTRY a STOP, EXIT o MARK se ancora aperto).
+
+    Gli eventi di un ciclo sono contigui nel registro: ogni statistica e' una
+    riduzione np.*.reduceat sui segmenti che iniziano agli ENTRY.
+
+    Returns:
+        pd.DataFrame: Colonne CYCLE_COLUMNS. outcome e' il tipo dell'evento che chiude il
+        ciclo; pnl il PnL cumulato della copertura; return, max_adverse_excursion (minimo
+        del PnL cumulato, <= 0) e worst_day (peggior PnL giornaliero) sono in % dell'equity
+        all'entrata; max_contracts e' la posizione piu' corta (contratti negativi).
+    """
+    # REARM non appartiene a nessun ciclo; senza REARM ogni ciclo inizia con ENTRY
+    keep = ledger.kind != REARM
+    kind = ledger.kind[keep]
+    starts = np.flatnonzero(kind == ENTRY)
+    if not len(starts):
+        return pd.DataFrame(columns=CYCLE_COLUMNS)
+    ends = np.append(starts[1:], len(kind)) - 1
+    bar = ledger.bar[keep]
+    dates = ledger.dates[keep] if ledger.dates is not None else bar
+    equity = ledger.portfolio_value[keep][starts]
+    pnl = ledger.cycle_pnl[keep][ends]
+
+    return pd.DataFrame({
+        'entry_date': dates[starts],
+        'exit_date': dates[ends],
+        'bars': bar[ends] - bar[starts],
+        'outcome': np.array(LEDGER_KINDS, dtype=object)[kind[ends]],
+        'entry_price': ledger.es_price[keep][starts],
+        'exit_price': ledger.es_price[keep][ends],
+        'equity_at_entry': equity,
+        'max_tranches': np.maximum.reduceat(ledger.tranches[keep], starts),
+        'max_contracts': np.minimum.reduceat(ledger.contracts[keep], starts),
+        'adds': np.add.reduceat(kind == ADD, starts),
+        'reductions': np.add.reduceat(kind == REDUCE, starts),
+        'pnl': pnl,
+        'return': pnl / equity,
+        'max_adverse_excursion': np.minimum.reduceat(ledger.adverse[keep], starts) / equity,
+        'worst_day': np.minimum.reduceat(ledger.worst_day[keep], starts) / equity,
+    }, columns=CYCLE_COLUMNS)
+
+
+def cycle_metrics(cycles):
+    """
+    Metriche della copertura dai cicli di hedge_cycles.
+
+    max_hedge_drawdown resta la definizione storica (peggior PnL giornaliero in %
+    dell'equity all'entrata del ciclo, 0 se mai negativo), la stessa di
+    run_backtest_batch, sweep e Monte Carlo; il peggior PnL cumulato di un ciclo
+    e' max_adverse_excursion. stop_loss_hit_rate e' la quota di cicli chiusi da uno stop.
+    """
+    if cycles.empty:
+        return {'max_hedge_drawdown': np.nan, 'max_adverse_excursion': np.nan, 'stop_loss_hit_rate': np.nan}
+    closed = cycles['outcome'] != 'MARK'
+    stopped = cycles['outcome'] == LEDGER_KINDS[STOP]
+    return {
+        'max_hedge_drawdown': min(float(cycles['worst_day'].min()), 0.0),
+        'max_adverse_excursion': float(cycles['max_adverse_excursion'].min()),
+        'stop_loss_hit_rate': float(stopped.sum() / closed.sum()) if closed.any() else np.nan,
+    }
+
+
+def hedge_drawdown(results_df):
+    """
+    Peggior PnL giornaliero della copertura in % dell'equity all'entrata del ciclo.
+
+    Dal registro degli eventi se il frame lo porta, altrimenti dalle colonne per
+    barra (frame letti da artefatti o cache). Il vecchio calcolo per "ciclo"
+    raggruppa su Equity_at_Hedge_Entry, che run_backtest riempie in avanti: ogni
+    barra e' un gruppo a se', da cui la definizione giornaliera.
+    """
+    ledger = results_ledger(results_df)
+    if ledger is not None:
+        return cycle_metrics(hedge_cycles(ledger))['max_hedge_drawdown']
+    hedge_cycle_equity = results_df['Equity_at_Hedge_Entry'].ffill()
+    cycle_id = results_df['Equity_at_Hedge_Entry'].notna().cumsum()
+    cumulative_hedge_pnl = results_df['Hedge_PnL'].groupby(cycle_id).cumsum()
+    return (cumulative_hedge_pnl / hedge_cycle_equity).min()
+
+
+def calculate_metrics(strategy_returns, benchmark_returns, total_trades, stop_loss_events, results_df, trading_days=252):
+    """
+    Metriche numeriche di strategia e benchmark (SPY).
+
+    Returns:
+        tuple: (metriche strategia, metriche benchmark) come dict numerici; le metriche
+        della copertura (HEDGE_METRIC_NAMES) vengono dal registro degli eventi di
+        results_df e sono NaN se non calcolabili.
+    """
+    returns = pd.concat([strategy_returns, benchmark_returns], axis=1)
+    stats = performance_matrix(returns, trading_days)
+    strategy_stats = {name: float(values[0]) for name, values in stats.items()}
+    benchmark_stats = {name: float(values[1]) for name, values in stats.items()}
+
+    ledger = results_ledger(results_df)
+    if ledger is not None:
+        hedge_stats = cycle_metrics(hedge_cycles(ledger))
+    else:
+        hedge_stats = {'max_hedge_drawdown': hedge_drawdown(results_df), 'max_adverse_excursion': np.nan,
+                       'stop_loss_hit_rate': np.nan}
+    metrics = {'hedge_trades': total_trades, 'stop_loss_events': stop_loss_events, **hedge_stats}
+    metrics.update(strategy_stats)
+
+    bench_metrics = dict(benchmark_stats)
+    bench_metrics.update({name: np.nan for name in HEDGE_METRIC_NAMES})
+    bench_metrics.update({'hedge_trades': 0, 'stop_loss_events': 0})
+    return metrics, bench_metrics
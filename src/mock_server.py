@@ -0,0 +1,345 @@
+# src/mock_server.py
+"""
+Server HTTP locale che imita EODHD, FRED, Yahoo (chart JSON) e Telegram.
+
+Serve dati sintetici (src.synthetic_data) o registrati (una directory della
+cache locale) con latenza, errori e limiti di frequenza configurabili, cosi'
+il download concorrente, i retry e le notifiche si possono provare e
+misurare senza rete. Il client si collega impostando le variabili
+KRITERION_<SORGENTE>_BASE_URL stampate all'avvio (vedi base_url in
+src.data_fetcher e TELEGRAM_BASE_URL in src.telegram_notifier).
+
+Endpoint:
+
+    GET  /api/eod/{simbolo}?from=&to=             (EODHD)
+    GET  /fred/series/observations?series_id=...  (FRED)
+    GET  /v8/finance/chart/{ticker}?period1=&period2=  (Yahoo)
+    POST /bot{token}/sendMessage                  (Telegram)
+    GET  /_stats, /_messages                      (contatori e messaggi ricevuti)
+
+Uso da riga di comando:
+
+    python -m src.mock_server --port 8765 --latency 0.2 --error-rate 0.1 --rate-limit 5
+"""
+
+import argparse
+import datetime
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pandas as pd
+
+from src.data_fetcher import TICKER_MAPPING_EODHD
+from src.strategy import FRED_SERIES_CMI
+from src.synthetic_data import recorded_market_data, synthetic_market_data
+
+DEFAULT_START = '2005-01-03'
+
+ROUTES = [
+    ('eodhd', re.compile(r'^/api/eod/(?P<symbol>[^/]+)$')),
+    ('fred', re.compile(r'^/fred/series/observations$')),
+    ('yahoo', re.compile(r'^/v8/finance/chart/(?P<symbol>[^/]+)$')),
+    ('telegram', re.compile(r'^/bot(?P<token>[^/]+)/sendMessage$')),
+]
+
+
+# ==============================================================================
+# DATI SERVITI
+# ==============================================================================
+
+def build_dataset(market_data_dfs, cmi_data_dict):
+    """Indicizza le serie per simbolo EODHD, ticker Yahoo e series_id FRED."""
+    dataset = {'eodhd': {}, 'yahoo': {}, 'fred': {}}
+    for ticker, data in market_data_dfs.items():
+        dataset['yahoo'][ticker] = data
+        dataset['eodhd'][TICKER_MAPPING_EODHD.get(ticker, ticker)] = data
+    for name, series in cmi_data_dict.items():
+        dataset['fred'][FRED_SERIES_CMI.get(name, name)] = series
+    return dataset
+
+
+def synthetic_dataset(start=DEFAULT_START, end=None, seed=0):
+    """Dataset sintetico giornaliero da start a end (default: oggi)."""
+    end = end or datetime.date.today()
+    n_bars = len(pd.bdate_range(start, end))
+    return build_dataset(*synthetic_market_data(n_bars, 'B', start=start, seed=seed))
+
+
+def _between(frame, start, end):
+    if start:
+        frame = frame[frame.index >= pd.Timestamp(start)]
+    if end:
+        frame = frame[frame.index <= pd.Timestamp(end)]
+    return frame
+
+
+def _nan_to_none(values):
+    return [None if v != v else v for v in values]
+
+
+# ==============================================================================
+# SERVER
+# ==============================================================================
+
+class MockAPIServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer con dataset, fault injection e contatori condivisi.
+
+    Args:
+        address (tuple): (host, porta); porta 0 = scelta dal sistema.
+        dataset (dict): Output di build_dataset / synthetic_dataset.
+        latency (float): Ritardo fisso per richiesta, in secondi.
+        jitter (float): Ritardo aggiuntivo uniforme in [0, jitter].
+        error_rate (float): Probabilita' di risposta 500 (generatore con seme).
+        fail_first (int): Le prime N richieste di ogni URL distinto falliscono con 500
+            (deterministico anche con richieste concorrenti, utile per i retry).
+        rate_limit (float | None): Richieste/secondo per sorgente; oltre -> 429 con Retry-After.
+        seed (int): Seme per jitter ed errori casuali.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, dataset, latency=0.0, jitter=0.0, error_rate=0.0, fail_first=0,
+                 rate_limit=None, seed=0):
+        super().__init__(address, _Handler)
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.rate_limit = rate_limit
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._attempts = {}
+        self._buckets = {}
+        self.stats = {}
+        self.messages = []
+
+    def handle_error(self, request, client_address):
+        # Client che chiude per timeout durante la latenza simulata: non e' un errore del server
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def client_env(self):
+        """Variabili d'ambiente che puntano i client a questo server."""
+        return {
+            'KRITERION_EODHD_BASE_URL': f"{self.base_url}/api",
+            'KRITERION_FRED_BASE_URL': f"{self.base_url}/fred",
+            'KRITERION_YAHOO_BASE_URL': self.base_url,
+            'KRITERION_TELEGRAM_BASE_URL': self.base_url,
+        }
+
+    def _count(self, source, status, elapsed):
+        entry = self.stats.setdefault(source, {'requests': 0, 'status': {}, 'total_seconds': 0.0})
+        entry['requests'] += 1
+        entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+        entry['total_seconds'] += elapsed
+
+    def fault(self, source, request_key):
+        """Decide se la richiesta va rifiutata: (status, ritardo) con status None se va servita."""
+        with self._lock:
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+            if self.rate_limit:
+                # Token bucket per sorgente con capacita' pari a un secondo di richieste
+                now = time.monotonic()
+                capacity = max(1.0, self.rate_limit)
+                tokens, last = self._buckets.get(source, (capacity, now))
+                tokens = min(capacity, tokens + (now - last) * self.rate_limit)
+                if tokens < 1:
+                    self._buckets[source] = (tokens, now)
+                    return 429, delay
+                self._buckets[source] = (tokens - 1, now)
+
+            attempts = self._attempts.get(request_key, 0)
+            self._attempts[request_key] = attempts + 1
+            if attempts < self.fail_first:
+                return 500, delay
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return 500, delay
+        return None, delay
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            try:
+                return json.loads(raw or b'{}')
+            except ValueError:
+                return {}
+        return {k: v[-1] for k, v in parse_qs(raw.decode('utf-8')).items()}
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        start = time.perf_counter()
+        parsed = urlparse(self.path)
+        parsed = parsed._replace(path=unquote(parsed.path))
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        server = self.server
+
+        if parsed.path == '/_stats':
+            return self._send_json(200, server.stats)
+        if parsed.path == '/_messages':
+            return self._send_json(200, server.messages)
+
+        for source, pattern in ROUTES:
+            match = pattern.match(parsed.path)
+            if match:
+                break
+        else:
+            return self._send_json(404, {'error': f"endpoint sconosciuto: {parsed.path}"})
+
+        body = self._read_body() if method == 'POST' else {}
+        request_key = (parsed.path, tuple(sorted(query.items())), json.dumps(body, sort_keys=True))
+        status, delay = server.fault(source, request_key)
+        if delay:
+            time.sleep(delay)
+
+        if status == 429:
+            retry_after = 1
+            payload = ({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry later',
+                        'parameters': {'retry_after': retry_after}}
+                       if source == 'telegram' else {'error': 'rate limit'})
+            self._send_json(429, payload, {'Retry-After': str(retry_after)})
+        elif status == 500:
+            self._send_json(500, {'error': 'errore simulato'})
+        else:
+            status, payload = getattr(self, f"_serve_{source}")(match, query, body)
+            self._send_json(status, payload)
+        server._count(source, status, time.perf_counter() - start)
+
+    def _serve_eodhd(self, match, query, body):
+        data = self.server.dataset['eodhd'].get(match.group('symbol'))
+        if data is None:
+            return 404, {'error': 'Ticker Not Found.'}
+        frame = _between(data, query.get('from'), query.get('to'))
+        return 200, [
+            {'date': d.strftime('%Y-%m-%d'), 'open': o, 'high': h, 'low': l, 'close': c,
+             'adjusted_close': c, 'volume': v}
+            for d, o, h, l, c, v in zip(frame.index, *(_nan_to_none(frame[col].tolist())
+                                                       for col in ['Open', 'High', 'Low', 'Close', 'Volume']))
+        ]
+
+    def _serve_fred(self, match, query, body):
+        series = self.server.dataset['fred'].get(query.get('series_id'))
+        if series is None:
+            return 400, {'error_code': 400, 'error_message': 'Bad Request. The series does not exist.'}
+        series = _between(series, query.get('observation_start'), query.get('observation_end'))
+        # FRED rappresenta le osservazioni mancanti con '.'
+        return 200, {'observations': [
+            {'date': d.strftime('%Y-%m-%d'), 'value': '.' if v != v else str(v)}
+            for d, v in zip(series.index, series.tolist())
+        ]}
+
+    def _serve_yahoo(self, match, query, body):
+        data = self.server.dataset['yahoo'].get(match.group('symbol'))
+        if data is None:
+            return 404, {'chart': {'result': None, 'error': {'code': 'Not Found'}}}
+        start = pd.to_datetime(int(query.get('period1', 0)), unit='s')
+        end = pd.to_datetime(int(query['period2']), unit='s') if 'period2' in query else None
+        frame = _between(data, start, end)
+        return 200, {'chart': {'error': None, 'result': [{
+            'meta': {'symbol': match.group('symbol'), 'currency': 'USD'},
+            'timestamp': ((frame.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).tolist(),
+            'indicators': {'quote': [{col.lower(): _nan_to_none(frame[col].tolist())
+                                      for col in ['Open', 'High', 'Low', 'Close', 'Volume']}]},
+        }]}}
+
+    def _serve_telegram(self, match, query, body):
+        message = dict(body or query)
+        if not message.get('chat_id') or not message.get('text'):
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is empty'}
+        with self.server._lock:
+            message_id = len(self.server.messages) + 1
+            self.server.messages.append({'message_id': message_id, 'token': match.group('token'), **message})
+        return 200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': message['chat_id']},
+                                            'date': int(time.time()), 'text': message['text']}}
+
+
+def start_server(dataset=None, host='127.0.0.1', port=0, **options):
+    """
+    Avvia il server in un thread daemon.
+
+    Returns:
+        MockAPIServer: Da fermare con shutdown(); client_env() da applicare a os.environ.
+    """
+    server = MockAPIServer((host, port), dataset if dataset is not None else synthetic_dataset(), **options)
+    threading.Thread(target=server.serve_forever, name='mock-api', daemon=True).start()
+    return server
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server locale che imita EODHD, FRED, Yahoo e Telegram.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--recorded', default=None, metavar='CACHE_DIR',
+                        help="Serve le serie registrate in una directory della cache locale.")
+    parser.add_argument('--start', default=DEFAULT_START, help="Prima data dei dati sintetici.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fail-first', type=int, default=0)
+    parser.add_argument('--rate-limit', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.recorded:
+        dataset = build_dataset(*recorded_market_data(args.recorded))
+    else:
+        dataset = synthetic_dataset(args.start, seed=args.seed)
+
+    server = MockAPIServer((args.host, args.port), dataset, latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, fail_first=args.fail_first,
+                           rate_limit=args.rate_limit, seed=args.seed)
+    print("Server di prova in ascolto. Per collegare i client:")
+    for key, value in server.client_env().items():
+        print(f"  export {key}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
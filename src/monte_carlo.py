@@ -0,0 +1,369 @@
+# src/monte_carlo.py
+"""
+Test di robustezza Monte Carlo della copertura con block bootstrap.
+
+Dalla storia vengono estratti i rendimenti giornalieri congiunti di SPY, ES,
+VIX, VIX3M (rendimenti logaritmici) e delle serie macro del CMI (differenze,
+perche' spread e curva possono essere negativi). Blocchi di giorni
+consecutivi vengono ricampionati insieme per tutte le serie, cosi' la
+dipendenza tra mercato, volatilita' e macro e l'autocorrelazione dentro il
+blocco restano quelle osservate. Da ogni sequenza si ricostruisce un
+percorso di livelli, si ricalcolano CMI, media mobile e latch del VIX e si
+esegue la macchina a stati della copertura.
+
+I percorsi sono elaborati a blocchi come matrici (barre x percorsi): gli
+indicatori sono vettoriali e il backtest usa run_backtest_batch, che fa un
+solo loop sulle barre per tutti i percorsi del blocco. I blocchi girano su
+un pool di processi che condivide i dati sorgente tramite l'initializer;
+ogni blocco ha il suo generatore derivato dal seme, quindi il risultato non
+dipende dal numero di processi.
+
+Uso da riga di comando:
+
+    python -m src.monte_carlo --start 2005-01-01 --paths 10000 --block-length 20 \\
+        --method stationary --workers 8 --out mc_paths.csv
+"""
+
+import argparse
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.backtest import run_backtest_batch
+from src.indicator_calculator import PrefixSums, running_zscore, vix_hysteresis_signal
+from src.metrics import STAT_NAMES, calculate_metrics, performance_matrix
+from src.strategy import (FRED_SERIES_CMI, PIT_MIN_PERIODS, build_master_frame, compute_indicators,
+                          load_strategy_data, load_strategy_params, run_backtest)
+
+TRADING_DAYS = 252
+DEFAULT_BLOCK_LENGTH = 20
+PATHS_PER_CHUNK = 250
+BOOTSTRAP_METHODS = ['moving', 'stationary']
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+PRICE_COLUMNS = ['SPY_Close', 'ES_Close', 'VIX_Close', 'VIX3M_Close']
+HEDGE_METRICS = ['hedge_trades', 'stop_loss_events', 'max_hedge_drawdown']
+
+# Dati sorgente condivisi dai worker (impostati da init_worker)
+_SOURCE = None
+
+
+# ==============================================================================
+# DATI SORGENTE
+# ==============================================================================
+
+def prepare_source(df):
+    """
+    Rendimenti giornalieri congiunti da ricampionare.
+
+    Args:
+        df (pd.DataFrame): Frame di build_master_frame.
+
+    Returns:
+        dict: 'levels' (livelli iniziali), 'log_returns' (m, 4) per le chiusure di
+        PRICE_COLUMNS, 'open_gap' (m,) log(Open/Close) di SPY nello stesso giorno
+        (non cumulato), 'macro_diff' (m, k),
+        'macro_columns', 'index' delle barre storiche usate. None se mancano dati.
+    """
+    macro_columns = [col for col in FRED_SERIES_CMI.keys() if col in df.columns]
+    if not macro_columns or any(col not in df.columns for col in PRICE_COLUMNS + ['SPY_Open']):
+        return None
+    data = df[PRICE_COLUMNS + ['SPY_Open'] + macro_columns].dropna()
+    if len(data) < 2:
+        return None
+
+    prices = data[PRICE_COLUMNS].to_numpy()
+    macro = data[macro_columns].to_numpy()
+    open_gap = np.log(data['SPY_Open'].to_numpy() / data['SPY_Close'].to_numpy())
+    return {
+        'levels': {'prices': prices[0], 'macro': macro[0], 'open_gap': open_gap[0]},
+        'log_returns': np.diff(np.log(prices), axis=0),
+        'open_gap': open_gap[1:],
+        'macro_diff': np.diff(macro, axis=0),
+        'macro_columns': macro_columns,
+        'index': data.index,
+    }
+
+
+def bootstrap_indices(rng, n_source, n_steps, n_paths, block_length=DEFAULT_BLOCK_LENGTH, method='stationary'):
+    """
+    Indici dei giorni ricampionati, matrice (n_steps, n_paths).
+
+    'moving': blocchi di lunghezza fissa con inizio uniforme (moving block
+    bootstrap). 'stationary': blocchi di lunghezza geometrica di media
+    block_length e storia circolare (Politis-Romano), percorsi stazionari.
+    """
+    if method == 'moving':
+        block_length = min(block_length, n_source)
+        n_blocks = -(-n_steps // block_length)
+        starts = rng.integers(0, n_source - block_length + 1, (n_blocks, n_paths))
+        indices = starts[:, None, :] + np.arange(block_length)[None, :, None]
+        return indices.reshape(n_blocks * block_length, n_paths)[:n_steps]
+    if method == 'stationary':
+        new_block = rng.random((n_steps, n_paths)) < 1 / block_length
+        new_block[0] = True
+        starts = rng.integers(0, n_source, (n_steps, n_paths))
+        # Posizione dell'ultimo inizio di blocco, come nel latch del VIX
+        steps = np.arange(n_steps)[:, None]
+        block_start = np.where(new_block, steps, 0)
+        np.maximum.accumulate(block_start, axis=0, out=block_start)
+        return (np.take_along_axis(starts, block_start, axis=0) + steps - block_start) % n_source
+    raise ValueError(f"Metodo di bootstrap non supportato: {method}")
+
+
+def simulate_paths(source, indices):
+    """
+    Ricostruisce i livelli dei percorsi dagli indici ricampionati.
+
+    Returns:
+        dict: 'SPY_Open' e le colonne di PRICE_COLUMNS come matrici (n_steps + 1, n_paths),
+        'macro' come array (n_steps + 1, n_paths, k).
+    """
+    def cumulate(start, increments):
+        levels = np.empty((len(indices) + 1,) + increments.shape[1:])
+        levels[0] = start
+        np.cumsum(increments, axis=0, out=levels[1:])
+        levels[1:] += start
+        return levels
+
+    paths = {}
+    for j, col in enumerate(PRICE_COLUMNS):
+        paths[col] = np.exp(cumulate(np.log(source['levels']['prices'][j]), source['log_returns'][indices, j]))
+    open_gap = np.empty(paths['SPY_Close'].shape)
+    open_gap[0] = source['levels']['open_gap']
+    open_gap[1:] = source['open_gap'][indices]
+    paths['SPY_Open'] = paths['SPY_Close'] * np.exp(open_gap)
+    paths['macro'] = cumulate(source['levels']['macro'], source['macro_diff'][indices])
+    return paths
+
+
+# ==============================================================================
+# SEGNALI E BACKTEST DEI PERCORSI
+# ==============================================================================
+
+def path_signal_count(paths, params, macro_columns, zscore='full', zscore_window=None,
+                      min_periods=PIT_MIN_PERIODS):
+    """
+    Signal_Count di ogni percorso, come compute_indicators.
+
+    Args:
+        paths (dict): Output di simulate_paths.
+        params (dict): Parametri della strategia.
+        macro_columns (list): Nomi delle serie macro nell'ordine di paths['macro'].
+        zscore (str): 'full' (z-score sull'intero percorso, come compute_cmi_zscore)
+            oppure 'pit' (point-in-time, come compute_cmi_zscore_pit).
+
+    Returns:
+        tuple: (prima barra valida, matrice int64 (n_barre_valide, n_percorsi)); (None, None)
+        se la media mobile del CMI non ha barre valide.
+    """
+    macro = paths['macro']
+    if zscore == 'pit':
+        z = running_zscore(macro, zscore_window, min_periods)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (macro - macro.mean(axis=0)) / macro.std(axis=0)
+    signs = np.array([-1.0 if col == 'Yield_Curve_10Y2Y' else 1.0 for col in macro_columns])
+    cmi = (z * signs).mean(axis=2)
+    cmi_ma = PrefixSums(cmi).rolling_mean([int(params['cmi_ma_window'])])[:, 0]
+
+    valid = ~np.isnan(cmi_ma).all(axis=1)
+    if not valid.any():
+        return None, None
+    first = int(np.argmax(valid))
+
+    signal_cmi = cmi[first:] > cmi_ma[first:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vix_ratio = paths['VIX_Close'][first:] / np.where(paths['VIX3M_Close'][first:] == 0, np.nan,
+                                                          paths['VIX3M_Close'][first:])
+    signal_vix = vix_hysteresis_signal(vix_ratio, params['vix_ratio_upper_threshold'],
+                                       params['vix_ratio_lower_threshold'])
+    return first, signal_cmi.astype(np.int64) + signal_vix
+
+
+def evaluate_paths(paths, params, macro_columns, zscore='full', zscore_window=None,
+                   min_periods=PIT_MIN_PERIODS, trading_days=TRADING_DAYS):
+    """
+    Backtest e metriche di un blocco di percorsi.
+
+    Returns:
+        pd.DataFrame: Una riga per percorso con le metriche di calculate_metrics della
+        strategia e le statistiche del benchmark con prefisso 'benchmark_'.
+    """
+    first, signal_count = path_signal_count(paths, params, macro_columns, zscore, zscore_window, min_periods)
+    n_paths = paths['SPY_Close'].shape[1]
+    if signal_count is None:
+        return pd.DataFrame(np.nan, index=range(n_paths), columns=result_columns())
+
+    spy = paths['SPY_Close'][first:]
+    backtest = run_backtest_batch(
+        spy, paths['ES_Close'][first:], signal_count, paths['SPY_Open'][first],
+        params['capitale_iniziale'], params['hedge_percentage_per_tranche'],
+        params['stop_loss_threshold_hedge'], params['micro_es_multiplier']
+    )
+    portfolio = backtest['portfolio_value']
+    strategy_stats = performance_matrix(portfolio[1:] / portfolio[:-1] - 1, trading_days)
+    benchmark_stats = performance_matrix(spy[1:] / spy[:-1] - 1, trading_days)
+
+    rows = {
+        'hedge_trades': backtest['hedge_trades_count'],
+        'stop_loss_events': backtest['stop_loss_events'],
+        'max_hedge_drawdown': backtest['max_hedge_drawdown'],
+    }
+    rows.update(strategy_stats)
+    rows.update({f"benchmark_{name}": values for name, values in benchmark_stats.items()})
+    return pd.DataFrame(rows, columns=result_columns())
+
+
+def result_columns():
+    """Colonne del DataFrame dei percorsi."""
+    return HEDGE_METRICS + STAT_NAMES + [f"benchmark_{name}" for name in STAT_NAMES]
+
+
+# ==============================================================================
+# WORKER
+# ==============================================================================
+
+def init_worker(source):
+    """Initializer del pool: dati sorgente condivisi da tutti i blocchi del processo."""
+    global _SOURCE
+    _SOURCE = source
+
+
+def simulate_chunk(task):
+    """Genera e valuta un blocco di percorsi. task = (seed, n_paths, n_steps, params, options)."""
+    seed, n_paths, n_steps, params, options = task
+    rng = np.random.default_rng(seed)
+    indices = bootstrap_indices(rng, len(_SOURCE['log_returns']), n_steps, n_paths,
+                                options['block_length'], options['method'])
+    paths = simulate_paths(_SOURCE, indices)
+    return evaluate_paths(paths, params, _SOURCE['macro_columns'], options['zscore'],
+                          options['zscore_window'], options['min_periods'])
+
+
+# ==============================================================================
+# ESECUZIONE
+# ==============================================================================
+
+def run_monte_carlo(source, params, n_paths, n_steps=None, block_length=DEFAULT_BLOCK_LENGTH, method='stationary',
+                    zscore='full', zscore_window=None, min_periods=PIT_MIN_PERIODS, seed=None,
+                    max_workers=None, chunk_size=PATHS_PER_CHUNK):
+    """
+    Simula n_paths percorsi e ne calcola le metriche.
+
+    Args:
+        source (dict): Output di prepare_source.
+        params (dict): Parametri della strategia.
+        n_paths (int): Numero di percorsi.
+        n_steps (int | None): Giorni simulati per percorso (default: lunghezza della storia).
+        block_length (int): Lunghezza (media, per 'stationary') dei blocchi in giorni.
+        method (str): Uno di BOOTSTRAP_METHODS.
+        zscore, zscore_window, min_periods: Calcolo del CMI z-score (vedi path_signal_count).
+        seed (int | None): Seme; stesso seme -> stessi percorsi, con qualsiasi numero di processi.
+        max_workers (int | None): Processi del pool (default: numero di CPU).
+        chunk_size (int): Percorsi per blocco (limita la memoria per processo).
+
+    Returns:
+        pd.DataFrame: Una riga per percorso (vedi evaluate_paths).
+    """
+    n_steps = n_steps or len(source['log_returns'])
+    options = {'block_length': block_length, 'method': method, 'zscore': zscore,
+               'zscore_window': zscore_window, 'min_periods': min_periods}
+    sizes = [min(chunk_size, n_paths - start) for start in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(chunk_seed, size, n_steps, params, options) for chunk_seed, size in zip(seeds, sizes)]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(tasks) <= 1:
+        init_worker(source)
+        results = [simulate_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(source,)) as pool:
+            results = list(pool.map(simulate_chunk, tasks))
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=result_columns())
+
+
+def summarize(results, historical=None, quantiles=QUANTILES):
+    """
+    Distribuzione delle metriche: media, deviazione standard e quantili per colonna.
+
+    Args:
+        results (pd.DataFrame): Output di run_monte_carlo.
+        historical (dict | None): Metriche del backtest storico da affiancare.
+    """
+    summary = pd.DataFrame({'mean': results.mean(), 'std': results.std()})
+    for q in quantiles:
+        summary[f"p{int(round(q * 100))}"] = results.quantile(q)
+    if historical is not None:
+        summary['storico'] = pd.Series(historical)
+    return summary
+
+
+def historical_metrics(df, params):
+    """Metriche del backtest sulla storia reale, nelle stesse colonne di run_monte_carlo."""
+    frame = compute_indicators(df.copy(), params)
+    if frame is None:
+        return None
+    _, strategy_returns, benchmark_returns, trades, stops, results_df = run_backtest(frame, params)
+    metrics, bench_metrics = calculate_metrics(strategy_returns, benchmark_returns, trades, stops, results_df,
+                                               TRADING_DAYS)
+    metrics.update({f"benchmark_{name}": bench_metrics[name] for name in STAT_NAMES})
+    return metrics
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test Monte Carlo (block bootstrap) della strategia di copertura.")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--start', default='2005-01-01', help="Data inizio (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="Data fine (default: oggi)")
+    parser.add_argument('--paths', type=int, default=1000)
+    parser.add_argument('--years', type=float, default=None, help="Anni per percorso (default: lunghezza della storia).")
+    parser.add_argument('--block-length', type=int, default=DEFAULT_BLOCK_LENGTH)
+    parser.add_argument('--method', choices=BOOTSTRAP_METHODS, default='stationary')
+    parser.add_argument('--zscore', choices=['full', 'pit'], default='full')
+    parser.add_argument('--zscore-window', type=int, default=None, help="Finestra mobile per --zscore pit.")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=PATHS_PER_CHUNK)
+    parser.add_argument('--out', default=os.path.join('results', 'monte_carlo_paths.csv'),
+                        help="CSV di output (default nella cartella results/, ignorata da git).")
+    args = parser.parse_args(argv)
+
+    params = load_strategy_params(args.config)
+    start_date = datetime.date.fromisoformat(args.start)
+    end_date = datetime.date.fromisoformat(args.end) if args.end else datetime.date.today()
+
+    print(f"Download dati dal {start_date} al {end_date}...")
+    market_data_dfs, cmi_data_dict = load_strategy_data(start_date, end_date)
+    if not market_data_dfs:
+        print("ERRORE: download dati fallito.")
+        return 1
+    df = build_master_frame(market_data_dfs, cmi_data_dict)
+    source = prepare_source(df)
+    if source is None:
+        print("ERRORE: serie di mercato o macro mancanti.")
+        return 1
+
+    n_steps = int(round(args.years * TRADING_DAYS)) if args.years else None
+    print(f"Simulazione di {args.paths} percorsi ({args.method}, blocchi di {args.block_length} giorni)...")
+    results = run_monte_carlo(source, params, args.paths, n_steps, args.block_length, args.method,
+                              args.zscore, args.zscore_window, seed=args.seed, max_workers=args.workers,
+                              chunk_size=args.chunk_size)
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    results.to_csv(args.out, index=False)
+    print(f"{len(results)} percorsi salvati in {args.out}")
+
+    with pd.option_context('display.float_format', '{:.4f}'.format, 'display.width', 160):
+        print(summarize(results, historical_metrics(df, params)))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,275 @@
+# src/portfolio.py
+"""
+Motore di copertura multi-sottostante e multi-conto.
+
+La strategia storica copre SPY con Micro ES per un solo conto. Qui ogni
+"libro" e' una coppia (conto, sottostante): ad esempio SPY/MES, QQQ/MNQ o
+IWM/M2K, ciascuno con capitale, hedge % per tranche e stop loss del conto.
+
+- I ticker di tutti i sottostanti e gli input condivisi (VIX, VIX3M, FRED)
+  sono scaricati una sola volta, in parallelo e via cache.
+- Lo strato degli indicatori (CMI z-score, CMI_MA, latch del VIX) non
+  dipende dal sottostante: viene calcolato una volta sola.
+- La macchina a stati della copertura gira per tutti i libri insieme con
+  run_backtest_batch (una colonna per libro).
+
+I libri si configurano in config.ini con sezioni [UNDERLYING:<nome>] e
+[ACCOUNT:<nome>]; le chiavi mancanti di un conto sono lette da
+[STRATEGY_PARAMS]. Senza sezioni resta il solo libro storico SPY/Micro ES.
+
+    [UNDERLYING:QQQ]
+    ticker = QQQ
+    hedge_ticker = NQ=F
+    multiplier = 2
+    contract_name = Micro NQ
+
+    [ACCOUNT:cliente_a]
+    underlyings = SPY, QQQ
+    capitale_iniziale = 100000
+    hedge_percentage_per_tranche = 0.5
+    chat_id = 123456789
+
+Uso da riga di comando:
+
+    python -m src.portfolio --start 2024-01-01
+"""
+
+import argparse
+import configparser
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.backtest import run_backtest_batch
+from src.strategy import (ALL_TICKERS, build_master_frame, column_prefix, compute_indicators, load_strategy_data,
+                          load_strategy_params)
+
+UNDERLYING_SECTION = 'UNDERLYING:'
+ACCOUNT_SECTION = 'ACCOUNT:'
+DEFAULT_UNDERLYING = 'SPY'
+DEFAULT_ACCOUNT = 'base'
+
+# Sottostanti noti: (ticker, ticker del future di copertura, moltiplicatore del micro, nome contratto)
+UNDERLYING_PRESETS = {
+    'SPY': ('SPY', 'ES=F', 5.0, 'Micro ES'),
+    'QQQ': ('QQQ', 'NQ=F', 2.0, 'Micro NQ'),
+    'IWM': ('IWM', 'RTY=F', 5.0, 'Micro Russell'),
+}
+ACCOUNT_PARAMS = ['capitale_iniziale', 'hedge_percentage_per_tranche', 'stop_loss_threshold_hedge']
+
+
+# ==============================================================================
+# CONFIGURAZIONE
+# ==============================================================================
+
+def portfolio_configured(config_path='config.ini'):
+    """True se il config definisce sottostanti o conti oltre al libro storico."""
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return any(s.startswith((UNDERLYING_SECTION, ACCOUNT_SECTION)) for s in config.sections())
+
+
+def resolve_underlying(name, section=None, multiplier=None):
+    """Sottostante name dai preset, con le chiavi di section (o di un dict) che li sovrascrivono."""
+    ticker, hedge_ticker, preset_multiplier, contract_name = UNDERLYING_PRESETS.get(name, (name, None, None, name))
+    section = section or {}
+    underlying = {
+        'name': name,
+        'ticker': section.get('ticker', ticker),
+        'hedge_ticker': section.get('hedge_ticker', hedge_ticker),
+        'multiplier': float(section.get('multiplier', multiplier or preset_multiplier or 0)),
+        'contract_name': section.get('contract_name', contract_name),
+    }
+    if not underlying['hedge_ticker'] or underlying['multiplier'] <= 0:
+        raise ValueError(f"Sottostante {name}: servono hedge_ticker e multiplier.")
+    return underlying
+
+
+def load_portfolio_config(config_path='config.ini'):
+    """
+    Legge sottostanti e conti dal config.
+
+    Returns:
+        tuple: (parametri di [STRATEGY_PARAMS], {nome: sottostante}, lista di libri). Ogni libro
+        e' un dict con 'account', 'underlying', i parametri di ACCOUNT_PARAMS e 'chat_id' (o None).
+    """
+    params = load_strategy_params(config_path)
+    config = configparser.ConfigParser()
+    config.read(config_path)
+
+    underlyings = {}
+    for section in config.sections():
+        if section.startswith(UNDERLYING_SECTION):
+            name = section[len(UNDERLYING_SECTION):].strip()
+            underlyings[name] = resolve_underlying(name, config[section])
+    if DEFAULT_UNDERLYING not in underlyings:
+        # Libro storico: SPY coperto con il future di [DATA] e micro_es_multiplier
+        data = config['DATA'] if config.has_section('DATA') else {}
+        underlyings = {DEFAULT_UNDERLYING: resolve_underlying(DEFAULT_UNDERLYING, {
+            'ticker': data.get('spy_ticker', 'SPY'), 'hedge_ticker': data.get('es_ticker', 'ES=F'),
+        }, params.get('micro_es_multiplier')), **underlyings}
+
+    account_sections = [s for s in config.sections() if s.startswith(ACCOUNT_SECTION)]
+    accounts = {s[len(ACCOUNT_SECTION):].strip(): config[s] for s in account_sections}
+    if not accounts:
+        accounts = {DEFAULT_ACCOUNT: {'underlyings': ', '.join(underlyings)}}
+
+    books = []
+    for account, section in accounts.items():
+        names = [n.strip() for n in section.get('underlyings', DEFAULT_UNDERLYING).split(',') if n.strip()]
+        for name in names:
+            if name not in underlyings:
+                underlyings[name] = resolve_underlying(name)
+            book = {'account': account, 'underlying': name, 'chat_id': section.get('chat_id')}
+            for key in ACCOUNT_PARAMS:
+                book[key] = float(section.get(key, params[key]))
+            books.append(book)
+    return params, underlyings, books
+
+
+# ==============================================================================
+# DATI E INDICATORI CONDIVISI
+# ==============================================================================
+
+def portfolio_tickers(underlyings):
+    """Ticker da scaricare una sola volta: input della strategia piu' sottostanti e future."""
+    tickers = list(ALL_TICKERS)
+    for underlying in underlyings.values():
+        for ticker in (underlying['ticker'], underlying['hedge_ticker']):
+            if ticker not in tickers:
+                tickers.append(ticker)
+    return tickers
+
+
+def build_portfolio_frame(market_data_dfs, cmi_data_dict, underlyings):
+    """
+    Frame della strategia con Open/Close di tutti i sottostanti e dei future.
+
+    Le colonne dei ticker extra sono allineate nello stesso passaggio di
+    build_master_frame, sulle sedute del frame storico e con lo stesso
+    forward-fill limitato; si tengono le sole date in cui tutti i libri hanno
+    un prezzo.
+    """
+    df = build_master_frame(market_data_dfs, cmi_data_dict, portfolio_tickers(underlyings))
+    required = [f"{column_prefix(ticker)}_Close" for underlying in underlyings.values()
+                for ticker in (underlying['ticker'], underlying['hedge_ticker'])]
+    missing = [col for col in required if col not in df.columns]
+    if missing:
+        raise ValueError(f"Prezzi mancanti per: {', '.join(missing)}")
+    return df.dropna(subset=required)
+
+
+def load_portfolio_data(start_date, end_date, underlyings, eodhd_api_key=None, fred_api_key=None,
+                        progress_callback=None):
+    """Unico download per tutti i libri. Ritorna il frame di build_portfolio_frame o None."""
+    market_data_dfs, cmi_data_dict = load_strategy_data(
+        start_date, end_date, eodhd_api_key, fred_api_key, progress_callback, tickers=portfolio_tickers(underlyings)
+    )
+    if not market_data_dfs:
+        return None
+    return build_portfolio_frame(market_data_dfs, cmi_data_dict, underlyings)
+
+
+# ==============================================================================
+# BACKTEST DEI LIBRI
+# ==============================================================================
+
+def run_portfolio(df, params, underlyings, books):
+    """
+    Indicatori una volta, copertura di tutti i libri in un solo passaggio.
+
+    Args:
+        df (pd.DataFrame): Frame di build_portfolio_frame.
+        params (dict): Parametri degli indicatori (e default dei conti).
+        underlyings (dict): Sottostanti di load_portfolio_config.
+        books (list[dict]): Libri di load_portfolio_config.
+
+    Returns:
+        tuple: (DataFrame con una riga per libro e lo stato all'ultima barra,
+        DataFrame dei valori di portafoglio con una colonna (conto, sottostante) per libro),
+        oppure (None, None) se gli indicatori non sono calcolabili.
+    """
+    df = compute_indicators(df.copy(), params)
+    if df is None or df.empty:
+        return None, None
+
+    prices = {}
+    for name, underlying in underlyings.items():
+        prefix, hedge_prefix = column_prefix(underlying['ticker']), column_prefix(underlying['hedge_ticker'])
+        prices[name] = (df[f"{prefix}_Close"].to_numpy(), df[f"{hedge_prefix}_Close"].to_numpy(),
+                        df[f"{prefix}_Open"].iloc[0])
+
+    def column(field):
+        return np.array([book[field] for book in books])
+
+    names = [book['underlying'] for book in books]
+    backtest = run_backtest_batch(
+        np.column_stack([prices[name][0] for name in names]),
+        np.column_stack([prices[name][1] for name in names]),
+        df['Signal_Count'].to_numpy(),
+        np.array([prices[name][2] for name in names]),
+        column('capitale_iniziale'), column('hedge_percentage_per_tranche'), column('stop_loss_threshold_hedge'),
+        np.array([underlyings[name]['multiplier'] for name in names])
+    )
+
+    state = backtest['final_state']
+    last = df.iloc[-1]
+    summary = pd.DataFrame({
+        'account': [book['account'] for book in books],
+        'underlying': names,
+        'contract_name': [underlyings[name]['contract_name'] for name in names],
+        'date': df.index[-1].date(),
+        'Signal_CMI': int(last['Signal_CMI']),
+        'Signal_VIX': int(last['Signal_VIX']),
+        'Signal_Count': int(last['Signal_Count']),
+        'contracts': state['es_contracts'],
+        'current_tranches': state['current_tranches'],
+        'hedge_stopped_out': state['hedge_stopped_out'],
+        'portfolio_value': backtest['portfolio_value'][-1],
+        'hedge_trades': backtest['hedge_trades_count'],
+        'stop_loss_events': backtest['stop_loss_events'],
+        'stop_loss_threshold_hedge': column('stop_loss_threshold_hedge'),
+        'chat_id': [book['chat_id'] for book in books],
+    })
+    values = pd.DataFrame(backtest['portfolio_value'], index=df.index,
+                          columns=pd.MultiIndex.from_arrays([summary['account'], summary['underlying']]))
+    return summary, values
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Segnali e backtest di tutti i conti e sottostanti configurati.")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--start', default='2005-01-01', help="Data inizio (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="Data fine (default: oggi)")
+    parser.add_argument('--out', default=None, help="CSV dei valori di portafoglio per libro.")
+    args = parser.parse_args(argv)
+
+    params, underlyings, books = load_portfolio_config(args.config)
+    start_date = datetime.date.fromisoformat(args.start)
+    end_date = datetime.date.fromisoformat(args.end) if args.end else datetime.date.today()
+
+    print(f"Download dati dal {start_date} al {end_date} ({len(books)} libri)...")
+    df = load_portfolio_data(start_date, end_date, underlyings)
+    if df is None:
+        print("ERRORE: download dati fallito.")
+        return 1
+    summary, values = run_portfolio(df, params, underlyings, books)
+    if summary is None:
+        print("ERRORE: indicatori non calcolabili.")
+        return 1
+
+    with pd.option_context('display.width', 160, 'display.max_columns', None):
+        print(summary.drop(columns=['chat_id']))
+    if args.out:
+        values.to_csv(args.out)
+        print(f"Valori di portafoglio salvati in {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,470 @@
+# src/signal_service.py
+"""
+Servizio HTTP/JSON locale, in sola lettura, sui segnali precalcolati.
+
+Script di esecuzione e fogli di rischio leggono segnale, contratti target,
+equity e storico degli indicatori da qui invece che dal messaggio Telegram
+o dalla dashboard. Il servizio non calcola nulla per richiesta: serve il
+frame dell'artefatto pubblicato da src.artifact (run_backtest con i
+parametri di default), tenuto in memoria come snapshot immutabile.
+
+- Le risposte degli endpoint fissi sono serializzate una volta al
+  caricamento dello snapshot; quelle per intervallo di date finiscono in
+  una cache LRU legata allo snapshot.
+- Un thread di aggiornamento controlla il manifest ogni --refresh secondi
+  e, quando cambia, carica il nuovo artefatto e sostituisce lo snapshot
+  con un solo assegnamento: ogni richiesta vede per intero il vecchio o il
+  nuovo. Con --compute, se per la seduta corrente non c'e' un artefatto,
+  lo stesso thread lo pubblica (una volta per seduta), mai le richieste,
+  avanzando lo stato incrementale del bot: stessi numeri del messaggio.
+- Ogni risposta porta ETag e Last-Modified dello snapshot; If-None-Match e
+  If-Modified-Since danno 304 senza corpo.
+
+Endpoint (GET):
+
+    /health                                stato del servizio e dello snapshot
+    /manifest                              manifest dell'artefatto servito
+    /signal                                ultima barra: segnali, indicatori, contratti
+    /contracts                             contratti target e variazione rispetto alla barra precedente
+    /equity?start=&end=                    Portfolio_Value, Hedge_PnL e SPY_Close per data
+    /history?start=&end=&columns=a,b       storico degli indicatori (default HISTORY_COLUMNS)
+
+Uso da riga di comando:
+
+    python -m src.signal_service --port 8770
+    python -m src.signal_service --compute --config config.ini
+"""
+
+import argparse
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from src.artifact import (artifact_path, current_manifest, get_artifact_dir, open_artifact, publish_default_artifact,
+                          read_manifest)
+from src.data_cache import market_session_key
+from src.strategy import load_strategy_params
+
+SERVICE_PORT_DEFAULT = 8770
+REFRESH_SECONDS = 30
+RESPONSE_CACHE_SIZE = 256
+SIGNAL_COLUMNS = ['Signal_CMI', 'Signal_VIX', 'Signal_Count', 'CMI_ZScore', 'CMI_MA', 'VIX_Ratio',
+                  'MES_Contracts', 'SPY_Close', 'ES_Close', 'Portfolio_Value']
+HISTORY_COLUMNS = ['CMI_ZScore', 'CMI_MA', 'Signal_CMI', 'VIX_Ratio', 'Signal_VIX', 'Signal_Count', 'MES_Contracts']
+EQUITY_COLUMNS = ['Portfolio_Value', 'Hedge_PnL', 'SPY_Close']
+# Stessa soglia di bot_runner.hedge_status: contratti negativi = copertura short attiva
+ACTIVE_CONTRACTS_THRESHOLD = -0.01
+
+
+class RequestError(Exception):
+    """Richiesta non valida: diventa una risposta 400 con il messaggio."""
+
+
+def _json_bytes(payload):
+    return json.dumps(payload, separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+
+def _clean(values):
+    """Lista JSON di un array numpy: NaN -> null, interi come int."""
+    if values.dtype.kind in 'iub':
+        return values.tolist()
+    return [None if v != v else v for v in values.tolist()]
+
+
+def hedge_state(contracts, signal_count):
+    """'active', 'stop_loss' o 'flat', con la stessa logica di bot_runner.hedge_status."""
+    if contracts < ACTIVE_CONTRACTS_THRESHOLD:
+        return 'active'
+    if signal_count > 0:
+        return 'stop_loss'
+    return 'flat'
+
+
+# ==============================================================================
+# SNAPSHOT
+# ==============================================================================
+
+def load_snapshot(manifest, directory=None):
+    """
+    Snapshot immutabile dell'artefatto del manifest.
+
+    Returns:
+        dict: frame, manifest, etag, last_modified, date delle barre (stringhe ISO e
+        datetime64[D] per le ricerche), risposte gia' serializzate degli endpoint fissi
+        e la cache LRU delle risposte per intervallo.
+    """
+    frame = open_artifact(artifact_path(manifest, directory))
+    created = datetime.datetime.fromisoformat(manifest['created_at'])
+    etag = '"' + hashlib.sha1(f"{manifest['file']}|{manifest['created_at']}".encode()).hexdigest()[:16] + '"'
+    days = frame.index.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    snapshot = {
+        'frame': frame,
+        'manifest': manifest,
+        'etag': etag,
+        'last_modified': created.replace(microsecond=0),
+        'last_modified_header': email.utils.format_datetime(created.astimezone(datetime.timezone.utc), usegmt=True),
+        'loaded_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'days': days,
+        'dates': np.datetime_as_string(days, unit='D'),
+        'cache': OrderedDict(),
+        'cache_lock': threading.Lock(),
+    }
+    snapshot['bodies'] = {
+        '/manifest': _json_bytes(manifest),
+        '/signal': _json_bytes(_signal_payload(snapshot)),
+        '/contracts': _json_bytes(_contracts_payload(snapshot)),
+    }
+    return snapshot
+
+
+def _row(frame, position, columns):
+    row = {}
+    for col in columns:
+        if col in frame.columns:
+            value = frame[col].to_numpy()[position].item()
+            row[col] = None if value != value else value
+    return row
+
+
+def _signal_payload(snapshot):
+    frame, manifest = snapshot['frame'], snapshot['manifest']
+    if frame.empty:
+        return {'date': None, 'session': manifest.get('session')}
+    last = _row(frame, -1, SIGNAL_COLUMNS)
+    return {
+        'date': str(snapshot['dates'][-1]),
+        'session': manifest.get('session'),
+        'state': hedge_state(last.get('MES_Contracts') or 0.0, last.get('Signal_Count') or 0),
+        **last,
+        'params': manifest.get('params', {}),
+    }
+
+
+def _contracts_payload(snapshot):
+    frame = snapshot['frame']
+    if frame.empty or 'MES_Contracts' not in frame.columns:
+        return {'date': None}
+    contracts = frame['MES_Contracts'].to_numpy()
+    current = float(contracts[-1])
+    previous = float(contracts[-2]) if len(contracts) > 1 else 0.0
+    signal_count = int(frame['Signal_Count'].to_numpy()[-1]) if 'Signal_Count' in frame.columns else 0
+    return {
+        'date': str(snapshot['dates'][-1]),
+        'previous_date': str(snapshot['dates'][-2]) if len(contracts) > 1 else None,
+        'contracts': current,
+        'previous_contracts': previous,
+        'change': current - previous,
+        'signal_count': signal_count,
+        'state': hedge_state(current, signal_count),
+        'multiplier': snapshot['manifest'].get('params', {}).get('micro_es_multiplier'),
+    }
+
+
+def _parse_date(value, name):
+    if value is None:
+        return None
+    try:
+        return np.datetime64(datetime.date.fromisoformat(value), 'D')
+    except ValueError:
+        raise RequestError(f"{name} non valido: {value} (atteso YYYY-MM-DD)")
+
+
+def _range_payload(snapshot, query, columns):
+    """Colonne richieste sulle barre tra start ed end inclusi, in formato colonnare."""
+    start, end = _parse_date(query.get('start'), 'start'), _parse_date(query.get('end'), 'end')
+    days = snapshot['days']
+    lo = np.searchsorted(days, start, side='left') if start is not None else 0
+    hi = np.searchsorted(days, end, side='right') if end is not None else len(days)
+    frame = snapshot['frame']
+    unknown = [col for col in columns if col not in frame.columns]
+    if unknown:
+        raise RequestError(f"colonne sconosciute: {', '.join(unknown)}")
+    return {
+        'start': str(snapshot['dates'][lo]) if hi > lo else None,
+        'end': str(snapshot['dates'][hi - 1]) if hi > lo else None,
+        'rows': int(max(hi - lo, 0)),
+        'dates': snapshot['dates'][lo:hi].tolist(),
+        'columns': {col: _clean(frame[col].to_numpy()[lo:hi]) for col in columns},
+    }
+
+
+def render(snapshot, path, query):
+    """
+    Corpo JSON della risposta per path e query sullo snapshot.
+
+    Gli endpoint fissi sono gia' serializzati; quelli per intervallo passano
+    dalla cache LRU dello snapshot. Solleva KeyError per un path sconosciuto,
+    RequestError per parametri non validi.
+    """
+    body = snapshot['bodies'].get(path)
+    if body is not None:
+        return body
+    if path == '/history':
+        columns = [c.strip() for c in query.get('columns', '').split(',') if c.strip()] or \
+            [c for c in HISTORY_COLUMNS if c in snapshot['frame'].columns]
+    elif path == '/equity':
+        columns = [c for c in EQUITY_COLUMNS if c in snapshot['frame'].columns]
+    else:
+        raise KeyError(path)
+
+    key = (path, query.get('start'), query.get('end'), tuple(columns))
+    cache, lock = snapshot['cache'], snapshot['cache_lock']
+    with lock:
+        body = cache.get(key)
+        if body is not None:
+            cache.move_to_end(key)
+            return body
+    body = _json_bytes(_range_payload(snapshot, query, columns))
+    with lock:
+        cache[key] = body
+        if len(cache) > RESPONSE_CACHE_SIZE:
+            cache.popitem(last=False)
+    return body
+
+
+# ==============================================================================
+# AGGIORNAMENTO
+# ==============================================================================
+
+class SignalStore:
+    """
+    Snapshot corrente e suo aggiornamento.
+
+    snapshot e' sostituito per intero da refresh (un solo assegnamento), quindi
+    le richieste lo leggono senza lock. Se config_path e' indicato, refresh
+    pubblica l'artefatto quando manca quello della seduta corrente.
+    """
+
+    def __init__(self, directory=None, config_path=None):
+        self.directory = directory or get_artifact_dir()
+        self.config_path = config_path
+        self.snapshot = None
+        self.last_error = None
+        self._manifest_stat = None
+        self._published_session = None
+        self._lock = threading.Lock()
+
+    def _manifest_changed(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, 'manifest.json'))
+        except OSError:
+            return self.snapshot is not None
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key == self._manifest_stat:
+            return False
+        self._manifest_stat = key
+        return True
+
+    def _publish_if_missing(self):
+        session = market_session_key()
+        if self._published_session == session:
+            return
+        params = load_strategy_params(self.config_path)
+        params.setdefault('stop_loss_threshold_hedge', 0.05)
+        if current_manifest(params, session, self.directory) is None:
+            print(f"Nessun artefatto per la seduta {session}: pubblicazione in corso...")
+            publish_default_artifact(self.config_path, directory=self.directory)
+        # Anche se fallisce si ritenta solo alla seduta successiva o al riavvio
+        self._published_session = session
+
+    def refresh(self):
+        """Ricarica lo snapshot se il manifest e' cambiato. Ritorna True se lo snapshot e' nuovo."""
+        with self._lock:
+            try:
+                if self.config_path:
+                    self._publish_if_missing()
+                if not self._manifest_changed():
+                    return False
+                manifest = read_manifest(self.directory)
+                if manifest is None:
+                    return False
+                current = self.snapshot
+                if current is not None and (current['manifest']['file'], current['manifest']['created_at']) == \
+                        (manifest['file'], manifest['created_at']):
+                    return False
+                self.snapshot = load_snapshot(manifest, self.directory)
+                self.last_error = None
+                return True
+            except Exception as e:
+                # Si continua a servire lo snapshot precedente
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Aggiornamento snapshot fallito: {self.last_error}")
+                return False
+
+    def start_refresher(self, interval=REFRESH_SECONDS):
+        """Thread daemon che chiama refresh ogni interval secondi; ritorna l'Event per fermarlo."""
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                self.refresh()
+        threading.Thread(target=loop, name='signal-refresh', daemon=True).start()
+        return stop
+
+
+# ==============================================================================
+# SERVER HTTP
+# ==============================================================================
+
+class SignalService(ThreadingHTTPServer):
+    """Server del servizio: ogni richiesta legge store.snapshot."""
+
+    daemon_threads = True
+
+    def __init__(self, address, store):
+        super().__init__(address, _Handler)
+        self.store = store
+        self.started_at = time.time()
+        self._count_lock = threading.Lock()
+        self.requests = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, status):
+        with self._count_lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+
+    def request_counts(self):
+        with self._count_lock:
+            return {str(status): count for status, count in self.requests.items()}
+
+
+def _not_modified(headers, snapshot):
+    """True se i validatori della richiesta corrispondono allo snapshot (If-None-Match prevale)."""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or snapshot['etag'] in tags or f"W/{snapshot['etag']}" in tags
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        return snapshot['last_modified'] <= since
+    return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Intestazioni e corpo in un'unica scrittura, senza attese di Nagle/ACK ritardato
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+        self.server.count(status)
+
+    def _error(self, status, message):
+        self._send(status, _json_bytes({'error': message}))
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip('/') or '/'
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        store = self.server.store
+        snapshot = store.snapshot
+
+        if path == '/health':
+            return self._send(200 if snapshot is not None else 503, _json_bytes({
+                'status': 'ok' if snapshot is not None else 'no_data',
+                'session': market_session_key(),
+                'artifact_session': snapshot['manifest'].get('session') if snapshot else None,
+                'last_date': snapshot['manifest'].get('last_date') if snapshot else None,
+                'loaded_at': snapshot['loaded_at'] if snapshot else None,
+                'last_error': store.last_error,
+                'uptime_s': round(time.time() - self.server.started_at, 1),
+                'requests': self.server.request_counts(),
+            }))
+        if snapshot is None:
+            return self._error(503, "nessun artefatto pubblicato")
+
+        validators = {'ETag': snapshot['etag'], 'Last-Modified': snapshot['last_modified_header'],
+                      'Cache-Control': 'no-cache'}
+        try:
+            body = render(snapshot, path, query)
+        except KeyError:
+            return self._error(404, f"endpoint sconosciuto: {path}")
+        except RequestError as e:
+            return self._error(400, str(e))
+        if _not_modified(self.headers, snapshot):
+            return self._send(304, None, validators)
+        self._send(200, body, validators)
+
+
+def start_service(store, host='127.0.0.1', port=0):
+    """
+    Avvia il servizio in un thread daemon (lo snapshot va caricato prima con store.refresh()).
+
+    Returns:
+        SignalService: Da fermare con shutdown().
+    """
+    server = SignalService((host, port), store)
+    threading.Thread(target=server.serve_forever, name='signal-service', daemon=True).start()
+    return server
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servizio HTTP/JSON locale sui segnali precalcolati.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SERVICE_PORT_DEFAULT)
+    parser.add_argument('--dir', default=None, help="Cartella degli artefatti (default KRITERION_ARTIFACT_DIR).")
+    parser.add_argument('--refresh', type=float, default=REFRESH_SECONDS, help="Secondi tra i controlli del manifest.")
+    parser.add_argument('--compute', action='store_true',
+                        help="Pubblica l'artefatto della seduta se manca (una volta per seduta).")
+    parser.add_argument('--config', default='config.ini')
+    args = parser.parse_args(argv)
+
+    store = SignalStore(args.dir, args.config if args.compute else None)
+    store.refresh()
+    if store.snapshot is None:
+        print("Nessun artefatto disponibile: il servizio risponde 503 finche' non viene pubblicato.")
+    else:
+        print(f"Snapshot {store.snapshot['manifest']['file']} ({store.snapshot['manifest']['rows']} barre)")
+    store.start_refresher(args.refresh)
+
+    server = SignalService((args.host, args.port), store)
+    print(f"Servizio segnali su {server.base_url} (Ctrl+C per fermare)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
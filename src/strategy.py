@@ -0,0 +1,309 @@
+# src/strategy.py
+"""
+Core della strategia di copertura, senza dipendenze dall'interfaccia.
+
+    load_strategy_data -> build_master_frame -> compute_indicators -> run_backtest
+
+run_full_strategy concatena gli stadi ed e' usata sia dalla dashboard sia dal
+bot giornaliero. Il modulo non importa streamlit/plotly e carica le
+dipendenze pesanti opzionali (scipy, yfinance) solo quando servono.
+
+Ogni stadio e' uno span di src.telemetry ('strategy.*').
+
+compute_indicators e' a sua volta diviso in compute_cmi_zscore (indipendente
+dai parametri) e compute_signals (dipende da cmi_ma_window e dalle soglie VIX),
+cosi' sweep e test ripetuti possono ricalcolare solo la parte che cambia.
+"""
+
+import configparser
+import os
+
+import numpy as np
+import pandas as pd
+
+from src import telemetry
+from src.alignment import PRICE_FILL_LIMIT, align_sources, drop_incomplete
+from src.backtest import LEDGER_ATTR, run_backtest_kernel
+from src.data_fetcher import fetch_all_data
+from src.indicator_calculator import PrefixSums, running_zscore, vix_hysteresis_signal
+
+ALL_TICKERS = ['SPY', 'ES=F', '^VIX', '^VIX3M']
+FRED_SERIES_CMI = {'TED_Spread': 'TEDRATE', 'Yield_Curve_10Y2Y': 'T10Y2Y',
+                   'VIX': 'VIXCLS', 'High_Yield_Spread': 'BAMLH0A0HYM2'}
+COLONNE_ESSENZIALI = ['SPY_Open', 'SPY_Close', 'ES_Open', 'ES_Close', 'VIX_Close', 'VIX3M_Close']
+# Campi dei ticker usati dalla strategia: High, Low e Volume sono scartati subito
+MASTER_FIELDS = ['Open', 'Close']
+# Osservazioni minime prima del primo z-score point-in-time
+PIT_MIN_PERIODS = 252
+# Parametri letti da compute_signals: gli altri influenzano solo il backtest
+INDICATOR_PARAMS = ['cmi_ma_window', 'vix_ratio_upper_threshold', 'vix_ratio_lower_threshold']
+
+
+def load_strategy_params(config_path='config.ini'):
+    """Legge [STRATEGY_PARAMS] dal config convertendo in float dove possibile."""
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    params = dict(config['STRATEGY_PARAMS'])
+    for key, value in params.items():
+        try:
+            params[key] = float(value)
+        except (ValueError, TypeError):
+            pass
+    return params
+
+
+# ==============================================================================
+# 1-2. DATI DI MERCATO E MACRO
+# ==============================================================================
+
+@telemetry.timed('strategy.load_data')
+def load_strategy_data(start_date, end_date, eodhd_api_key=None, fred_api_key=None, progress_callback=None,
+                       tickers=None):
+    """
+    Scarica (in parallelo, via cache) ticker di mercato e serie FRED della strategia.
+    Le chiavi API non passate sono lette da EODHD_API_KEY e FRED_API_KEY.
+    """
+    eodhd_api_key = eodhd_api_key or os.environ.get("EODHD_API_KEY")
+    fred_api_key = fred_api_key or os.environ.get("FRED_API_KEY")
+    market_data_dfs, cmi_data_dict, _ = fetch_all_data(
+        list(tickers or ALL_TICKERS), FRED_SERIES_CMI, eodhd_api_key, fred_api_key, start_date, end_date,
+        progress_callback=progress_callback
+    )
+    return market_data_dfs, cmi_data_dict
+
+
+def column_prefix(ticker):
+    """Prefisso delle colonne di un ticker nel frame ('ES=F' -> 'ES', '^VIX' -> 'VIX')."""
+    return ticker.replace('=F', '').replace('^', '')
+
+
+@telemetry.timed('strategy.build_frame')
+def align_master_frame(market_data_dfs, cmi_data_dict, tickers=None, release_lags=None,
+                       price_fill_limit=PRICE_FILL_LIMIT):
+    """
+    Unisce prezzi e serie macro in un unico DataFrame sulle sedute del primo ticker.
+
+    L'allineamento e' quello di src.alignment: un blocco float64 allocato una
+    volta, prezzi riportati in avanti per al massimo price_fill_limit sedute,
+    serie FRED unite as-of con il loro ritardo di rilascio (release_lags). Di
+    ogni ticker si tengono solo i campi in MASTER_FIELDS; le barre a cui manca
+    ancora un prezzo essenziale vengono scartate.
+
+    Returns:
+        tuple: (DataFrame, rapporto sui buchi per colonna di align_sources).
+    """
+    price_columns = []
+    for ticker in tickers or ALL_TICKERS:
+        if ticker in market_data_dfs:
+            data = market_data_dfs[ticker]
+            prefix = column_prefix(ticker)
+            for col in MASTER_FIELDS:
+                if col in data.columns:
+                    price_columns.append((f'{prefix}_{col}', data[col]))
+    df, gaps = align_sources(price_columns, list((cmi_data_dict or {}).items()), release_lags, price_fill_limit)
+
+    # Senza il future si copre sui prezzi di SPY, come in origine
+    if 'ES_Close' not in df.columns and 'SPY_Close' in df.columns:
+        df['ES_Close'] = df['SPY_Close']
+        df['ES_Open'] = df['SPY_Open']
+    df, dropped = drop_incomplete(df, [c for c in COLONNE_ESSENZIALI if c in df.columns])
+    if dropped:
+        telemetry.incr('align.dropped_bars', dropped)
+    return df, gaps
+
+
+def build_master_frame(market_data_dfs, cmi_data_dict, tickers=None):
+    """Frame di align_master_frame senza il rapporto sui buchi."""
+    return align_master_frame(market_data_dfs, cmi_data_dict, tickers)[0]
+
+
+# ==============================================================================
+# 3. INDICATORI
+# ==============================================================================
+
+@telemetry.timed('strategy.cmi_zscore')
+def compute_cmi_zscore(df):
+    """Aggiunge CMI_ZScore a df (in place). Ritorna None se mancano le serie macro."""
+    cmi_cols = [col for col in FRED_SERIES_CMI.keys() if col in df.columns]
+    if not cmi_cols:
+        return None
+
+    from scipy.stats import zscore
+
+    cmi_data_clean = df[cmi_cols].dropna()
+    cmi_data_zscore = cmi_data_clean.apply(zscore)
+    if 'Yield_Curve_10Y2Y' in cmi_data_zscore.columns:
+        cmi_data_zscore['Yield_Curve_10Y2Y'] *= -1
+
+    df['CMI_ZScore'] = cmi_data_zscore.mean(axis=1)
+    return df
+
+
+@telemetry.timed('strategy.cmi_zscore')
+def compute_cmi_zscore_pit(df, window=None, min_periods=PIT_MIN_PERIODS):
+    """
+    Come compute_cmi_zscore ma point-in-time: ogni barra usa solo la storia
+    fino a se stessa (finestra espandente, o mobile di window barre), senza
+    informazione futura. Ritorna None se mancano le serie macro.
+    """
+    cmi_cols = [col for col in FRED_SERIES_CMI.keys() if col in df.columns]
+    if not cmi_cols:
+        return None
+
+    cmi_data_clean = df[cmi_cols].dropna()
+    cmi_data_zscore = running_zscore(cmi_data_clean.to_numpy(), window, min_periods)
+    signs = np.array([-1.0 if col == 'Yield_Curve_10Y2Y' else 1.0 for col in cmi_cols])
+
+    df['CMI_ZScore'] = pd.Series((cmi_data_zscore * signs).mean(axis=1), index=cmi_data_clean.index)
+    return df
+
+
+def cmi_ma_matrix(df, windows):
+    """
+    CMI_MA di df per piu' cmi_ma_window in un solo passaggio sulle somme cumulate.
+
+    Returns:
+        np.ndarray: Matrice (barre, len(windows)), una colonna per finestra nell'ordine dato.
+    """
+    return PrefixSums(df['CMI_ZScore'].to_numpy(dtype=float)).rolling_mean([int(w) for w in windows])
+
+
+def cmi_signal_matrix(df, windows):
+    """
+    CMI_MA e Signal_CMI di df per piu' cmi_ma_window, come matrici (barre x finestre).
+
+    Le barre senza CMI_MA (finestra incompleta) hanno Signal_CMI 0; compute_signals
+    le scarta.
+
+    Returns:
+        tuple: (pd.DataFrame di CMI_MA, pd.DataFrame int8 di Signal_CMI), colonne = finestre.
+    """
+    windows = [int(w) for w in windows]
+    cmi_ma = cmi_ma_matrix(df, windows)
+    signal = (df['CMI_ZScore'].to_numpy(dtype=float)[:, None] > cmi_ma).astype(np.int8)
+    return (pd.DataFrame(cmi_ma, index=df.index, columns=windows),
+            pd.DataFrame(signal, index=df.index, columns=windows))
+
+
+@telemetry.timed('strategy.signals')
+def compute_signals(df, params_dict, cmi_ma=None):
+    """
+    Aggiunge CMI_MA, segnali CMI/VIX e Signal_Count (in place). Ritorna None se vuoto.
+
+    cmi_ma, se passato, e' la colonna di cmi_ma_matrix per cmi_ma_window
+    allineata a df (sweep e walk-forward la calcolano una volta per tutte le
+    finestre della griglia).
+    """
+    if cmi_ma is None:
+        cmi_ma = cmi_ma_matrix(df, [params_dict['cmi_ma_window']])[:, 0]
+    df['CMI_MA'] = cmi_ma
+    df.dropna(subset=['CMI_MA'], inplace=True)
+
+    if df.empty:
+        return None
+
+    # Segnali e tranche in int8: valori 0-2
+    df['Signal_CMI'] = (df['CMI_ZScore'] > df['CMI_MA']).to_numpy(dtype=np.int8)
+
+    df['VIX_Ratio'] = df['VIX_Close'] / df['VIX3M_Close'].replace(0, np.nan)
+
+    df['Signal_VIX'] = vix_hysteresis_signal(
+        df['VIX_Ratio'].to_numpy(),
+        params_dict['vix_ratio_upper_threshold'],
+        params_dict['vix_ratio_lower_threshold']
+    )
+    df['Signal_Count'] = df['Signal_CMI'] + df['Signal_VIX']
+    return df
+
+
+def compute_indicators(df, params_dict):
+    """CMI z-score + segnali. Ritorna None se gli indicatori non sono calcolabili."""
+    if compute_cmi_zscore(df) is None:
+        return None
+    return compute_signals(df, params_dict)
+
+
+# ==============================================================================
+# 4. BACKTEST
+# ==============================================================================
+
+@telemetry.timed('strategy.backtest')
+def run_backtest(df, params_dict):
+    """
+    Esegue il backtest su un DataFrame con indicatori.
+
+    Returns:
+        tuple: (equity_curves, strategy_returns, benchmark_returns,
+        hedge_trades_count, stop_loss_events, df_con_risultati); il registro degli
+        eventi della copertura e' in df_con_risultati.attrs[LEDGER_ATTR] (vedi metrics.results_ledger).
+    """
+    CAPITALE_INIZIALE = params_dict['capitale_iniziale']
+
+    backtest = run_backtest_kernel(
+        df['SPY_Close'].to_numpy(), df['ES_Close'].to_numpy(), df['Signal_Count'].to_numpy(),
+        df['SPY_Open'].iloc[0], CAPITALE_INIZIALE,
+        params_dict['hedge_percentage_per_tranche'], params_dict['stop_loss_threshold_hedge'],
+        params_dict['micro_es_multiplier']
+    )
+    hedge_trades_count = backtest['hedge_trades_count']
+    stop_loss_events = backtest['stop_loss_events']
+
+    df['Hedge_PnL'] = backtest['hedge_pnl']
+    df['MES_Contracts'] = backtest['mes_contracts']
+    df['Equity_at_Hedge_Entry'] = backtest['equity_at_hedge_entry']
+    ledger = backtest['ledger']
+    ledger.dates = df.index[ledger.bar]
+    df.attrs[LEDGER_ATTR] = ledger
+
+    portfolio_value = pd.Series(backtest['portfolio_value'], index=df.index.rename('Date'), name='Portfolio_Value')
+    strategy_returns = portfolio_value.pct_change().rename('Strategy_Returns')
+
+    benchmark_returns = df['SPY_Close'].pct_change()
+    cumulative_benchmark = (1 + benchmark_returns).cumprod() * CAPITALE_INIZIALE
+    cumulative_benchmark.iloc[0] = CAPITALE_INIZIALE
+
+    equity_curves = pd.DataFrame({'Strategy_Equity': portfolio_value, 'Buy_And_Hold_Equity': cumulative_benchmark}).dropna()
+
+    # Stesso risultato del vecchio df.join(Portfolio_Value).ffill(), ma sul frame
+    # stesso invece che su una copia (come le altre colonne scritte sopra)
+    df['Portfolio_Value'] = backtest['portfolio_value']
+    df.ffill(inplace=True)
+    df_con_risultati = df
+
+    return equity_curves, strategy_returns.dropna(), benchmark_returns.dropna(), hedge_trades_count, stop_loss_events, df_con_risultati
+
+
+# ==============================================================================
+# PIPELINE COMPLETA
+# ==============================================================================
+
+@telemetry.timed('strategy.run_full')
+def run_full_strategy(params_dict, start_date, end_date, progress_callback=None,
+                      eodhd_api_key=None, fred_api_key=None):
+    """
+    Download, indicatori e backtest in un'unica chiamata.
+
+    Le chiavi API, se non passate, sono lette dalle variabili d'ambiente
+    (vedi load_strategy_data). progress_callback viene inoltrata a
+    fetch_all_data.
+
+    Returns:
+        tuple: come run_backtest, oppure sei None se dati o indicatori mancano.
+    """
+    # --- 1-2. DOWNLOAD CONCORRENTE DATI MERCATO E MACRO (FRED) ---
+    market_data_dfs, cmi_data_dict = load_strategy_data(
+        start_date, end_date, eodhd_api_key, fred_api_key, progress_callback=progress_callback
+    )
+    if not market_data_dfs:
+        print("Download dati fallito.")
+        return None, None, None, None, None, None
+
+    df = build_master_frame(market_data_dfs, cmi_data_dict)
+
+    # --- 3. CALCOLO INDICATORI ---
+    df = compute_indicators(df, params_dict)
+    if df is None:
+        return None, None, None, None, None, None
+
+    # --- 4. BACKTEST (KERNEL SU ARRAY) ---
+    return run_backtest(df, params_dict)
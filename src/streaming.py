@@ -0,0 +1,324 @@
+# src/streaming.py
+"""
+Modalita' streaming: latch del VIX Ratio e stop loss valutati barra per barra.
+
+Il backtest giornaliero controlla lo stop loss solo sulla chiusura dell'ES e
+aggiorna il latch del VIX una volta al giorno, mentre gli stop reali scattano
+durante la seduta. Qui un motore consuma barre a un minuto da una sorgente
+qualsiasi (generatore, replay di un file, coda alimentata da un websocket) e
+per ogni barra, in O(1) e con memoria costante:
+
+- aggiorna il latch con isteresi sul rapporto VIX/VIX3M;
+- combina il latch con il segnale CMI giornaliero (noto dalla seduta
+  precedente, vedi cmi_schedule) nella tranche target;
+- avanza la copertura con advance_hedge_state (stessa logica del kernel:
+  P&L sul prezzo ES della barra, stop sull'entrata del ciclo, aumento o
+  riduzione delle tranche, latch di stop-out fino a target 0).
+
+Gli eventi vengono emessi appena accadono (generatore o callback), senza
+essere accumulati: VIX_ON/VIX_OFF, CMI_ON/CMI_OFF, ENTRY, ADD, REDUCE, EXIT,
+STOP e REARM (target tornato a 0 dopo uno stop).
+
+Una barra e' una tupla (timestamp, SPY, ES, VIX, VIX3M) di prezzi di chiusura
+del minuto. Le barre con prezzi SPY/ES non validi sono scartate; una barra
+senza rapporto VIX valido mantiene il latch e il segnale VIX precedenti (nel
+giornaliero vale 0: al minuto un tick mancante non deve ridurre la copertura).
+
+Uso da riga di comando (replay di dati sintetici o di un CSV):
+
+    python -m src.streaming --years 3
+    python -m src.streaming --csv barre.csv --events 20
+"""
+
+import argparse
+import datetime
+import json
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.backtest import advance_hedge_state
+from src.strategy import load_strategy_params
+from src.synthetic_data import MINUTES_PER_SESSION, synthetic_market_data
+
+BAR_COLUMNS = ['SPY_Close', 'ES_Close', 'VIX_Close', 'VIX3M_Close']
+CSV_CHUNK_ROWS = 100_000
+TRADING_DAYS_PER_YEAR = 252
+
+
+# ==============================================================================
+# MOTORE
+# ==============================================================================
+
+class StreamingHedgeEngine:
+    """
+    Stato del latch VIX e della copertura aggiornato barra per barra.
+
+    Args:
+        params (dict): Parametri della strategia (soglie VIX, hedge %, stop loss, moltiplicatore,
+            capitale iniziale se state non e' dato).
+        state (dict | None): Stato della copertura nel formato 'final_state' di run_backtest_kernel
+            (es. state['hedge'] di src.incremental); senza stato il portafoglio parte alla prima
+            barra con capitale_iniziale investito in SPY.
+        vix_latch (bool): Stato iniziale del latch.
+        signal_cmi (int): Segnale CMI in vigore all'inizio.
+        cmi_schedule (dict | None): {datetime.date: Signal_CMI} da applicare dalla prima barra
+            di ogni giorno (vedi cmi_schedule_from_daily).
+        on_event (callable | None): on_event(evento) per ogni evento, oltre alla resa da run/stream.
+    """
+
+    def __init__(self, params, state=None, vix_latch=False, signal_cmi=0, cmi_schedule=None, on_event=None):
+        self.upper = float(params['vix_ratio_upper_threshold'])
+        self.lower = float(params['vix_ratio_lower_threshold'])
+        self.hedge_percentage = float(params['hedge_percentage_per_tranche'])
+        self.stop_loss = float(params['stop_loss_threshold_hedge'])
+        self.multiplier = float(params['micro_es_multiplier'])
+        self.capital = float(params.get('capitale_iniziale', 0.0))
+        self.state = dict(state) if state is not None else None
+        self.vix_latch = bool(vix_latch)
+        self.signal_cmi = int(signal_cmi)
+        self.cmi_schedule = cmi_schedule or {}
+        self.on_event = on_event
+
+        self.bars = 0
+        self.skipped_bars = 0
+        self.event_counts = {}
+        self.last_ts = None
+        self.last_spy = None
+        self._day = None
+
+    @classmethod
+    def from_incremental_state(cls, state, params, **kwargs):
+        """Motore che riparte dallo stato giornaliero persistito da src.incremental."""
+        return cls(params, state=state['hedge'], vix_latch=state['vix_latch'],
+                   signal_cmi=state['last_signal']['Signal_CMI'], **kwargs)
+
+    def _event(self, events, kind, ts, **fields):
+        event = {'ts': ts, 'kind': kind, **fields}
+        self.event_counts[kind] = self.event_counts.get(kind, 0) + 1
+        if self.on_event is not None:
+            self.on_event(event)
+        events.append(event)
+
+    def process(self, bar):
+        """
+        Elabora una barra (ts, SPY, ES, VIX, VIX3M) in O(1).
+
+        Returns:
+            list[dict]: Eventi generati dalla barra (lista vuota se nessun cambio di stato).
+        """
+        ts, price_spy, price_es, vix, vix3m = bar
+        events = []
+        if not (price_spy > 0 and price_es > 0):
+            self.skipped_bars += 1
+            return events
+
+        state = self.state
+        if state is None:
+            state = self.state = {
+                'spy_shares': self.capital / price_spy, 'cash_from_hedging': 0.0, 'es_contracts': 0.0,
+                'hedge_entry_price': 0.0, 'current_tranches': 0, 'hedge_stopped_out': False,
+                'last_es_close': price_es, 'hedge_trades_count': 0, 'stop_loss_events': 0,
+            }
+
+        # Segnale CMI giornaliero: cambia solo alla prima barra di un nuovo giorno
+        if self.cmi_schedule:
+            day = ts.date()
+            if day != self._day:
+                self._day = day
+                signal_cmi = self.cmi_schedule.get(day, self.signal_cmi)
+                if signal_cmi != self.signal_cmi:
+                    self.signal_cmi = signal_cmi
+                    self._event(events, 'CMI_ON' if signal_cmi else 'CMI_OFF', ts)
+
+        # Latch con isteresi (rapporto non valido: nessun cambio)
+        ratio = vix / vix3m if vix3m else math.nan
+        if ratio > self.upper:
+            if not self.vix_latch:
+                self.vix_latch = True
+                self._event(events, 'VIX_ON', ts, vix_ratio=ratio)
+        elif ratio < self.lower:
+            if self.vix_latch:
+                self.vix_latch = False
+                self._event(events, 'VIX_OFF', ts, vix_ratio=ratio)
+        target = self.signal_cmi + self.vix_latch
+
+        tranches_before = state['current_tranches']
+        stopped_before = state['hedge_stopped_out']
+        step = advance_hedge_state(state, price_spy, price_es, target, self.hedge_percentage,
+                                   self.stop_loss, self.multiplier)
+        tranches = state['current_tranches']
+        if step['stop_loss']:
+            self._event(events, 'STOP', ts, es_price=price_es, entry_price=state['hedge_entry_price'],
+                        portfolio_value=step['portfolio_value'])
+            tranches_before = 0
+        if stopped_before and not state['hedge_stopped_out']:
+            self._event(events, 'REARM', ts)
+        if tranches != tranches_before:
+            if tranches_before == 0:
+                kind = 'ENTRY'
+            elif tranches == 0:
+                kind = 'EXIT'
+            else:
+                kind = 'ADD' if tranches > tranches_before else 'REDUCE'
+            self._event(events, kind, ts, tranches=tranches, contracts=state['es_contracts'],
+                        es_price=price_es, portfolio_value=step['portfolio_value'])
+
+        self.bars += 1
+        self.last_ts = ts
+        self.last_spy = price_spy
+        return events
+
+    def stream(self, source):
+        """Generatore degli eventi prodotti dalle barre di source, man mano che accadono."""
+        process = self.process
+        for bar in source:
+            events = process(bar)
+            if events:
+                yield from events
+
+    def run(self, source):
+        """Consuma source fino alla fine scartando gli eventi (consegnati solo a on_event)."""
+        process = self.process
+        for bar in source:
+            process(bar)
+        return self.snapshot()
+
+    def snapshot(self):
+        """Stato corrente: latch, segnali, copertura e contatori."""
+        state = self.state or {}
+        portfolio_value = None
+        if state and self.last_spy is not None:
+            portfolio_value = state['spy_shares'] * self.last_spy + state['cash_from_hedging']
+        return {
+            'ts': self.last_ts,
+            'bars': self.bars,
+            'skipped_bars': self.skipped_bars,
+            'vix_latch': self.vix_latch,
+            'signal_cmi': self.signal_cmi,
+            'target': self.signal_cmi + self.vix_latch,
+            'hedge': dict(state),
+            'portfolio_value': portfolio_value,
+            'events': dict(self.event_counts),
+        }
+
+
+# ==============================================================================
+# SORGENTI DI BARRE
+# ==============================================================================
+
+def frame_bars(df):
+    """Barre dalle colonne BAR_COLUMNS di un DataFrame indicizzato per timestamp."""
+    columns = [df[col].to_numpy(dtype=float).tolist() for col in BAR_COLUMNS]
+    return zip(df.index, *columns)
+
+
+def csv_bars(path, chunk_rows=CSV_CHUNK_ROWS, timestamp_column=0):
+    """Replay di un CSV (timestamp + BAR_COLUMNS) a blocchi: memoria limitata a chunk_rows righe."""
+    for chunk in pd.read_csv(path, index_col=timestamp_column, parse_dates=True, chunksize=chunk_rows):
+        yield from frame_bars(chunk)
+
+
+def queue_bars(bar_queue, sentinel=None):
+    """Barre da una queue.Queue alimentata da un altro thread (es. client websocket) fino a sentinel."""
+    while True:
+        bar = bar_queue.get()
+        if bar is sentinel:
+            return
+        yield bar
+
+
+def synthetic_bars(n_bars, seed=0, chunk_days=TRADING_DAYS_PER_YEAR):
+    """
+    Barre a un minuto sintetiche, generate a blocchi di chunk_days sedute.
+
+    Ogni blocco usa un seme derivato e prosegue dai prezzi finali del
+    precedente, cosi' anche anni di minuti restano in memoria limitata.
+    """
+    chunk_bars = chunk_days * MINUTES_PER_SESSION
+    start = pd.Timestamp('2005-01-03')
+    levels = None
+    produced = 0
+    for block in range(-(-n_bars // chunk_bars)):
+        size = min(chunk_bars, n_bars - produced)
+        market_data_dfs, _ = synthetic_market_data(size, 'min', start=start, seed=seed + block)
+        df = pd.DataFrame({col: market_data_dfs[ticker]['Close']
+                           for col, ticker in zip(BAR_COLUMNS, ['SPY', 'ES=F', '^VIX', '^VIX3M'])})
+        if levels is not None:
+            # Continuita' dei prezzi tra blocchi: si riscala sul livello finale precedente
+            df = df * (levels / df.iloc[0].to_numpy())
+        levels = df.iloc[-1].to_numpy()
+        yield from frame_bars(df)
+        produced += size
+        start = (df.index[-1] + pd.offsets.BDay(1)).normalize()
+
+
+def cmi_schedule_from_daily(signal_cmi):
+    """
+    {giorno: Signal_CMI} dalla serie giornaliera, spostata di una seduta.
+
+    Il segnale CMI calcolato alla chiusura del giorno D e' quello in vigore
+    durante la seduta successiva: nessuna informazione futura nel replay.
+    """
+    shifted = signal_cmi.shift(1).dropna().astype(int)
+    return {ts.date(): int(value) for ts, value in shifted.items()}
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def _json_default(value):
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(type(value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a un minuto di latch VIX e stop loss della copertura.")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--csv', default=None, help="CSV con timestamp e colonne " + ", ".join(BAR_COLUMNS))
+    parser.add_argument('--years', type=float, default=1.0, help="Anni di barre sintetiche (senza --csv).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--signal-cmi', type=int, default=1, choices=[0, 1], help="Segnale CMI fisso.")
+    parser.add_argument('--events', type=int, default=10, help="Eventi da stampare.")
+    parser.add_argument('--out', default=None, help="File JSONL di tutti gli eventi.")
+    args = parser.parse_args(argv)
+
+    params = load_strategy_params(args.config)
+    params.setdefault('stop_loss_threshold_hedge', 0.05)
+    if args.csv:
+        source = csv_bars(args.csv)
+    else:
+        source = synthetic_bars(int(args.years * TRADING_DAYS_PER_YEAR * MINUTES_PER_SESSION), args.seed)
+
+    engine = StreamingHedgeEngine(params, signal_cmi=args.signal_cmi)
+    printed = 0
+    out = open(args.out, 'w', encoding='utf-8') if args.out else None
+    started = time.perf_counter()
+    try:
+        for event in engine.stream(source):
+            if printed < args.events:
+                print(json.dumps(event, default=_json_default))
+                printed += 1
+            if out is not None:
+                out.write(json.dumps(event, default=_json_default) + '\n')
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - started
+
+    snapshot = engine.snapshot()
+    minutes = snapshot['bars'] + snapshot['skipped_bars']
+    print(f"\n{minutes} barre in {elapsed:.2f}s ({minutes / max(elapsed, 1e-9):,.0f} barre/s, "
+          f"{minutes * 60 / max(elapsed, 1e-9):,.0f}x tempo reale)")
+    print(json.dumps(snapshot, indent=1, default=_json_default))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
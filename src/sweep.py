@@ -0,0 +1,261 @@
+# src/sweep.py
+"""
+Sweep dei parametri della strategia su un pool di processi.
+
+I dati di mercato e macro vengono scaricati una sola volta; il CMI z-score
+(indipendente dai parametri) e' calcolato una volta nel processo principale
+e il frame risultante e' condiviso in sola lettura con i worker tramite
+l'initializer del pool, insieme alle CMI_MA di tutte le cmi_ma_window della
+griglia, calcolate in un solo passaggio da cmi_ma_matrix. Ogni worker memorizza gli indicatori per
+(cmi_ma_window, soglie VIX), quindi le combinazioni che differiscono solo
+per hedge %, stop loss o capitale rieseguono soltanto il kernel del backtest.
+I worker restituiscono le serie dei rendimenti; le statistiche sono
+calcolate nel processo principale a blocchi di colonne con performance_matrix.
+
+Uso da riga di comando:
+
+    python -m src.sweep --start 2007-01-01 \\
+        --grid cmi_ma_window=126,189,252 \\
+        --grid vix_ratio_upper_threshold=0.94:1.00:0.02 \\
+        --grid stop_loss_threshold_hedge=0.03:0.10:0.01 \\
+        --workers 8 --out sweep.csv
+"""
+
+import argparse
+import datetime
+import itertools
+import os
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.metrics import STAT_NAMES, hedge_drawdown, performance_matrix
+from src.strategy import (INDICATOR_PARAMS, build_master_frame, cmi_ma_matrix, compute_cmi_zscore, compute_signals,
+                          load_strategy_data, load_strategy_params, run_backtest)
+
+SWEEPABLE_PARAMS = ['hedge_percentage_per_tranche', 'stop_loss_threshold_hedge', 'cmi_ma_window',
+                    'vix_ratio_upper_threshold', 'vix_ratio_lower_threshold', 'capitale_iniziale']
+INDICATOR_CACHE_SIZE = 32
+METRICS_BLOCK_SIZE = 512
+
+_BASE_DF = None
+_CMI_MA = {}
+_INDICATOR_CACHE = OrderedDict()
+_INDICATOR_CACHE_SIZE = INDICATOR_CACHE_SIZE
+
+
+# ==============================================================================
+# GRIGLIE DI PARAMETRI
+# ==============================================================================
+
+def parse_values(spec):
+    """'a,b,c' -> lista di valori; 'start:stop:step' -> range inclusivo."""
+    if ':' in spec:
+        start, stop, step = (float(x) for x in spec.split(':'))
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + k * step, 10) for k in range(count)]
+    return [float(x) for x in spec.split(',') if x.strip()]
+
+
+def cartesian_grid(space):
+    """Prodotto cartesiano di {parametro: lista di valori}."""
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+
+def random_grid(space, n_samples, seed=None):
+    """n_samples combinazioni estratte uniformemente dai valori di ciascun parametro."""
+    rng = random.Random(seed)
+    return [{name: rng.choice(values) for name, values in space.items()} for _ in range(n_samples)]
+
+
+# ==============================================================================
+# VALUTAZIONE NEI WORKER
+# ==============================================================================
+
+def init_worker(base_df, cache_size=INDICATOR_CACHE_SIZE, cmi_ma=None):
+    """
+    Initializer del pool: frame condiviso, CMI_MA precalcolate (vedi cmi_ma_columns) e
+    cache degli indicatori vuota.
+    """
+    global _BASE_DF, _CMI_MA, _INDICATOR_CACHE_SIZE
+    _BASE_DF = base_df
+    _CMI_MA = cmi_ma or {}
+    _INDICATOR_CACHE_SIZE = cache_size
+    _INDICATOR_CACHE.clear()
+
+
+def cmi_ma_columns(base_df, params_list):
+    """{cmi_ma_window: colonna CMI_MA} per tutte le finestre usate, da un'unica cmi_ma_matrix."""
+    windows = sorted({int(p['cmi_ma_window']) for p in params_list})
+    if base_df is None or not windows:
+        return {}
+    matrix = cmi_ma_matrix(base_df, windows)
+    return {window: np.ascontiguousarray(matrix[:, k]) for k, window in enumerate(windows)}
+
+
+def indicator_frame(params):
+    """Frame con segnali per i parametri degli indicatori, memorizzato nel worker (LRU)."""
+    key = tuple(float(params[name]) for name in INDICATOR_PARAMS)
+    if key in _INDICATOR_CACHE:
+        _INDICATOR_CACHE.move_to_end(key)
+        return _INDICATOR_CACHE[key]
+    df = compute_signals(_BASE_DF.copy(), params, _CMI_MA.get(int(params['cmi_ma_window'])))
+    _INDICATOR_CACHE[key] = df
+    if len(_INDICATOR_CACHE) > _INDICATOR_CACHE_SIZE:
+        _INDICATOR_CACHE.popitem(last=False)
+    return df
+
+
+def evaluate_params(params):
+    """
+    Esegue il backtest di una combinazione sul frame condiviso.
+
+    Returns:
+        tuple: (riga con parametri e metriche della copertura, rendimenti
+        giornalieri della strategia come np.ndarray o None se dati insufficienti).
+    """
+    row = dict(params)
+    df = indicator_frame(params)
+    if df is None or len(df) < 2:
+        row['error'] = 'dati insufficienti'
+        return row, None
+
+    # run_backtest scrive colonne sul frame: si lavora su una copia superficiale
+    _, strategy_returns, _, trades, stop_losses, df_results = run_backtest(df.copy(deep=False), params)
+    row['max_hedge_drawdown'] = hedge_drawdown(df_results)
+    row['hedge_trades'] = trades
+    row['stop_loss_events'] = stop_losses
+    return row, strategy_returns.to_numpy()
+
+
+def return_stats_table(returns_list, trading_days=252):
+    """Statistiche di tutte le serie, a blocchi di METRICS_BLOCK_SIZE colonne allineate in coda."""
+    length = max((len(r) for r in returns_list if r is not None), default=0)
+    stats = {name: np.full(len(returns_list), np.nan) for name in STAT_NAMES}
+    for start in range(0, len(returns_list), METRICS_BLOCK_SIZE):
+        block = returns_list[start:start + METRICS_BLOCK_SIZE]
+        # Finestre CMI diverse danno serie di lunghezza diversa: NaN in testa
+        matrix = np.full((length, len(block)), np.nan)
+        for j, r in enumerate(block):
+            if r is not None and len(r):
+                matrix[length - len(r):, j] = r
+        block_stats = performance_matrix(matrix, trading_days)
+        for name in STAT_NAMES:
+            stats[name][start:start + len(block)] = block_stats[name]
+    missing = np.array([r is None for r in returns_list], dtype=bool)
+    for name in STAT_NAMES:
+        stats[name][missing] = np.nan
+    return pd.DataFrame(stats, columns=STAT_NAMES)
+
+
+def prepare_base_frame(start_date, end_date, eodhd_api_key=None, fred_api_key=None):
+    """Scarica una volta i dati e calcola il CMI z-score condiviso da tutte le combinazioni."""
+    market_data_dfs, cmi_data_dict = load_strategy_data(start_date, end_date, eodhd_api_key, fred_api_key)
+    if not market_data_dfs:
+        return None
+    return compute_cmi_zscore(build_master_frame(market_data_dfs, cmi_data_dict))
+
+
+def run_sweep(base_df, base_params, combos, max_workers=None, chunksize=None):
+    """
+    Valuta in parallelo le combinazioni di parametri.
+
+    Args:
+        base_df (pd.DataFrame): Frame con CMI_ZScore (vedi prepare_base_frame).
+        base_params (dict): Parametri di default, sovrascritti da ciascuna combinazione.
+        combos (list[dict]): Combinazioni da valutare.
+        max_workers (int | None): Processi del pool (default: numero di CPU).
+        chunksize (int | None): Combinazioni per task inviato ai worker.
+
+    Returns:
+        pd.DataFrame: Una riga per combinazione con parametri e metriche numeriche.
+    """
+    # Ordinare per parametri degli indicatori massimizza i riusi della cache nei worker
+    full_params = [dict(base_params, **combo) for combo in combos]
+    order = sorted(range(len(full_params)),
+                   key=lambda k: tuple(float(full_params[k][n]) for n in INDICATOR_PARAMS))
+    ordered = [full_params[k] for k in order]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(ordered) // (max_workers * 4))
+
+    cmi_ma = cmi_ma_columns(base_df, ordered)
+    if max_workers == 1:
+        init_worker(base_df, cmi_ma=cmi_ma)
+        evaluated = [evaluate_params(p) for p in ordered]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(base_df, INDICATOR_CACHE_SIZE, cmi_ma)) as pool:
+            evaluated = list(pool.map(evaluate_params, ordered, chunksize=chunksize))
+
+    rows, returns_list = zip(*evaluated) if evaluated else ((), ())
+    rows = pd.DataFrame(list(rows))
+    stats = return_stats_table(list(returns_list))
+    # Stesso ordine di colonne di prima: parametri, statistiche, metriche della copertura
+    results = pd.concat([rows[[c for c in rows.columns if c in base_params or c in SWEEPABLE_PARAMS]], stats,
+                         rows[[c for c in rows.columns if c not in base_params and c not in SWEEPABLE_PARAMS]]],
+                        axis=1)
+    results.index = order
+    results = results.sort_index()
+    swept = [name for name in SWEEPABLE_PARAMS if any(name in combo for combo in combos)]
+    metric_cols = [c for c in results.columns if c not in base_params]
+    return results[swept + metric_cols].reset_index(drop=True)
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep parallelo dei parametri della strategia di copertura.")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--start', default='2007-01-01', help="Data inizio (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="Data fine (default: oggi)")
+    parser.add_argument('--grid', action='append', default=[], metavar='PARAM=VALORI',
+                        help="Valori di un parametro: 'a,b,c' oppure 'start:stop:step'. Ripetibile.")
+    parser.add_argument('--random', type=int, default=None, metavar='N',
+                        help="Estrae N combinazioni casuali invece del prodotto cartesiano.")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=os.path.join('results', 'sweep_results.csv'),
+                        help="CSV di output (default nella cartella results/, ignorata da git).")
+    args = parser.parse_args(argv)
+
+    space = {}
+    for item in args.grid:
+        name, _, spec = item.partition('=')
+        if name not in SWEEPABLE_PARAMS:
+            parser.error(f"Parametro non supportato: {name} (ammessi: {', '.join(SWEEPABLE_PARAMS)})")
+        space[name] = parse_values(spec)
+    if not space:
+        parser.error("Specificare almeno un --grid PARAM=VALORI")
+
+    combos = random_grid(space, args.random, args.seed) if args.random else cartesian_grid(space)
+    base_params = load_strategy_params(args.config)
+    start_date = datetime.date.fromisoformat(args.start)
+    end_date = datetime.date.fromisoformat(args.end) if args.end else datetime.date.today()
+
+    print(f"Download dati dal {start_date} al {end_date}...")
+    base_df = prepare_base_frame(start_date, end_date,
+                                 os.environ.get("EODHD_API_KEY"), os.environ.get("FRED_API_KEY"))
+    if base_df is None:
+        print("ERRORE: download dati o calcolo CMI fallito.")
+        return 1
+
+    print(f"Valutazione di {len(combos)} combinazioni...")
+    results = run_sweep(base_df, base_params, combos, max_workers=args.workers)
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    results.to_csv(args.out, index=False)
+    print(f"Risultati salvati in {args.out}")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results.sort_values('sharpe', ascending=False).head(10))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
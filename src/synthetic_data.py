@@ -0,0 +1,123 @@
+# src/synthetic_data.py
+"""
+Dati di mercato e macro sintetici, deterministici, per benchmark e test offline.
+recorded_market_data legge invece le serie registrate nella cache locale di
+una esecuzione reale, nella stessa forma.
+
+Le serie hanno la stessa forma dell'output di fetch_all_data (dict di
+DataFrame OHLCV per ticker e dict di Series FRED per nome colonna), cosi'
+possono entrare direttamente in build_master_frame. Il rapporto VIX/VIX3M
+oscilla attorno alle soglie di default e le serie macro hanno qualche
+osservazione mancante, per esercitare latch, tranche e stop loss come con i
+dati reali.
+"""
+
+import numpy as np
+import pandas as pd
+
+from src.data_cache import load_cached, use_cache_dir
+from src.strategy import ALL_TICKERS, FRED_SERIES_CMI
+
+DEFAULT_START = '2005-01-03'
+# Minuti di una seduta regolare USA (09:30-16:00)
+MINUTES_PER_SESSION = 390
+
+# Dimensioni predefinite usate dai benchmark: (numero di barre, frequenza).
+# '1y' include un anno di riscaldamento per la media mobile del CMI.
+FIXTURE_SIZES = {
+    '1y': (2 * 252, 'B'),
+    '20y': (20 * 252, 'B'),
+    'intraday': (3 * 252 * MINUTES_PER_SESSION, 'min'),
+}
+
+
+def synthetic_index(n_bars, freq='B', start=DEFAULT_START):
+    """Calendario di n_bars barre: giorni lavorativi ('B') o minuti di seduta ('min')."""
+    if freq == 'B':
+        return pd.bdate_range(start, periods=n_bars)
+    if freq == 'min':
+        n_days = -(-n_bars // MINUTES_PER_SESSION)
+        days = pd.bdate_range(start, periods=n_days)
+        offsets = pd.to_timedelta(np.arange(MINUTES_PER_SESSION), unit='min') + pd.Timedelta(hours=9, minutes=30)
+        index = (days.values[:, None] + offsets.values[None, :]).ravel()[:n_bars]
+        return pd.DatetimeIndex(index)
+    raise ValueError(f"Frequenza non supportata: {freq}")
+
+
+def _ohlcv(close, rng, bar_vol):
+    noise = np.abs(rng.normal(0, bar_vol, (3, len(close))))
+    open_ = close * (1 + rng.normal(0, bar_vol / 2, len(close)))
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) * (1 + noise[0]),
+        'Low': np.minimum(open_, close) * (1 - noise[1]),
+        'Close': close,
+        'Volume': rng.integers(1_000, 1_000_000, len(close)).astype(float),
+    })
+
+
+def synthetic_market_data(n_bars, freq='B', start=DEFAULT_START, seed=0):
+    """
+    Genera prezzi e serie macro sintetiche.
+
+    Args:
+        n_bars (int): Numero di barre di mercato.
+        freq (str): 'B' giornaliero, 'min' barre da un minuto in orario di seduta.
+        start (str): Prima data.
+        seed (int): Seme del generatore (stesso seme -> stessi dati).
+
+    Returns:
+        tuple: ({ticker: DataFrame OHLCV}, {nome colonna CMI: Series}) come fetch_all_data.
+    """
+    rng = np.random.default_rng(seed)
+    index = synthetic_index(n_bars, freq, start)
+    n = len(index)
+    bars_per_day = 1 if freq == 'B' else MINUTES_PER_SESSION
+    scale = 1 / np.sqrt(bars_per_day)
+
+    spy = 120 * np.exp(np.cumsum(rng.normal(0.0003 / bars_per_day, 0.012 * scale, n)))
+    es = spy * 10 * (1 + rng.normal(0, 0.001, n))
+    vix3m = 18 * np.exp(0.3 * np.cumsum(rng.normal(0, 0.03 * scale, n)))
+    phase = np.arange(n) / (37 * bars_per_day)
+    vix = vix3m * (0.92 + 0.08 * np.sin(phase) + rng.normal(0, 0.03, n))
+
+    market_data_dfs = {}
+    for ticker, close in zip(ALL_TICKERS, (spy, es, vix, vix3m)):
+        frame = _ohlcv(close, rng, 0.004 * scale)
+        frame.index = index.rename('Date')
+        market_data_dfs[ticker] = frame
+
+    # Macro: una osservazione per giorno lavorativo, riportata sulle barre intraday
+    days = pd.DatetimeIndex(index.normalize().unique())
+    cmi_data_dict = {}
+    for name in FRED_SERIES_CMI:
+        values = np.cumsum(rng.normal(0, 0.05, len(days))) + 2
+        values[rng.random(len(days)) < 0.02] = np.nan
+        series = pd.Series(values, index=days.rename('date'), name='value')
+        if freq != 'B':
+            series = series.reindex(index, method='ffill').rename_axis('date')
+        cmi_data_dict[name] = series
+
+    return market_data_dfs, cmi_data_dict
+
+
+def fixture(name, seed=0):
+    """Dati sintetici di una delle dimensioni predefinite in FIXTURE_SIZES."""
+    n_bars, freq = FIXTURE_SIZES[name]
+    return synthetic_market_data(n_bars, freq, seed=seed)
+
+
+def recorded_market_data(cache_dir):
+    """Serie di mercato e FRED registrate in una directory della cache locale."""
+    with use_cache_dir(cache_dir):
+        market_data_dfs = {}
+        for ticker in ALL_TICKERS:
+            data = load_cached(f"eod_{ticker}")
+            if data is not None and not data.empty:
+                market_data_dfs[ticker] = data
+        cmi_data_dict = {}
+        for name, series_id in FRED_SERIES_CMI.items():
+            data = load_cached(f"fred_{series_id}")
+            if data is not None and not data.empty:
+                cmi_data_dict[name] = data['value']
+    return market_data_dfs, cmi_data_dict
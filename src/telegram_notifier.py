@@ -1,38 +1,381 @@
 # src/telegram_notifier.py
+"""
+Invio dei messaggi Telegram con sessione persistente, limiti di frequenza,
+retry e outbox su disco.
+
+TelegramNotifier invia molti messaggi in parallelo rispettando i limiti di
+Telegram: un limite globale del bot (token bucket) e un intervallo minimo tra
+due messaggi alla stessa chat. I messaggi della stessa chat partono in ordine,
+chat diverse in parallelo. Su 429 e 5xx (ed errori di rete) il messaggio viene
+ritentato con backoff esponenziale, usando retry_after quando Telegram lo
+indica; un 429 sospende anche il limite globale, perche' il blocco e' per bot.
+
+I messaggi ancora non consegnati dopo i tentativi finiscono nell'outbox
+(JSONL, KRITERION_TELEGRAM_OUTBOX) con la seduta a cui si riferiscono e
+vengono rinviati da flush_outbox al run successivo, che riscrive l'outbox
+solo dopo l'invio; quelli di sedute precedenti (istruzioni di copertura
+superate) vengono scartati. Gli errori permanenti (4xx diversi da 429, es.
+chat inesistente) non vengono ritentati. Ogni consegna, riuscita o no, e' registrata con la
+latenza in un log JSONL (KRITERION_TELEGRAM_LOG).
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from src import telemetry
+from src.data_cache import market_session_key
+
+# Sovrascrivibile con KRITERION_TELEGRAM_BASE_URL (es. server locale di src.mock_server)
+TELEGRAM_BASE_URL = 'https://api.telegram.org'
+
+_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+OUTBOX_FILE_DEFAULT = os.path.join(_CACHE_DIR, 'telegram_outbox.jsonl')
+DELIVERY_LOG_DEFAULT = os.path.join(_CACHE_DIR, 'telegram_deliveries.jsonl')
+
+# Limiti documentati da Telegram: ~30 messaggi/s per bot, ~1 messaggio/s per chat
+GLOBAL_RATE_PER_SECOND = 30.0
+CHAT_INTERVAL_SECONDS = 1.0
+MAX_WORKERS = 8
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+MAX_RETRY_AFTER_SECONDS = 60.0
+REQUEST_TIMEOUT = 10
+
+
+def get_outbox_path():
+    """Outbox dei messaggi non consegnati (sovrascrivibile con KRITERION_TELEGRAM_OUTBOX)."""
+    return os.environ.get('KRITERION_TELEGRAM_OUTBOX', OUTBOX_FILE_DEFAULT)
+
+
+def get_delivery_log_path():
+    """Log delle consegne (sovrascrivibile con KRITERION_TELEGRAM_LOG)."""
+    return os.environ.get('KRITERION_TELEGRAM_LOG', DELIVERY_LOG_DEFAULT)
+
+
+def _chat_ids(chat_id):
+    """Una o piu' chat: stringa singola, separata da virgole o lista."""
+    if isinstance(chat_id, (list, tuple, set)):
+        return [str(c).strip() for c in chat_id if str(c).strip()]
+    return [c.strip() for c in str(chat_id).split(',') if c.strip()]
+
+
+class _RateLimiter:
+    """Token bucket thread-safe con sospensione (per i 429 globali)."""
 
-def send_telegram_message(message: str, bot_token: str, chat_id: str):
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class TelegramNotifier:
     """
-    Invia un messaggio a una chat Telegram specificata tramite un bot.
+    Client Telegram per un bot, riusabile tra invii (pool di connessioni).
+
+    Args:
+        bot_token (str): Token API del bot.
+        max_workers (int): Chat servite in parallelo.
+        global_rate (float): Messaggi al secondo per l'intero bot.
+        chat_interval (float): Secondi minimi tra due messaggi alla stessa chat.
+        max_retries (int): Tentativi aggiuntivi su 429, 5xx ed errori di rete.
+        outbox_path, log_path (str | None): File JSONL (default da get_outbox_path / get_delivery_log_path).
+    """
+
+    def __init__(self, bot_token, max_workers=MAX_WORKERS, global_rate=GLOBAL_RATE_PER_SECOND,
+                 chat_interval=CHAT_INTERVAL_SECONDS, max_retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT,
+                 outbox_path=None, log_path=None):
+        self.bot_token = bot_token
+        self.max_workers = max_workers
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.outbox_path = outbox_path or get_outbox_path()
+        self.log_path = log_path or get_delivery_log_path()
+        self.deliveries = []
+
+        self._limiter = _RateLimiter(global_rate)
+        self._file_lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def close(self):
+        self._session.close()
+
+    def _api_url(self):
+        base_url = os.environ.get("KRITERION_TELEGRAM_BASE_URL") or TELEGRAM_BASE_URL
+        return f"{base_url}/bot{self.bot_token}/sendMessage"
+
+    # --------------------------------------------------------------------------
+    # Invio
+    # --------------------------------------------------------------------------
+
+    def _post(self, message):
+        """Un tentativo: (stato HTTP o None, risposta JSON o None, secondi di attesa suggeriti o None)."""
+        payload = {'chat_id': message['chat_id'], 'text': message['text']}
+        if message.get('parse_mode'):
+            payload['parse_mode'] = message['parse_mode']
+        try:
+            response = self._session.post(self._api_url(), json=payload, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            return None, {'description': str(e)}, None
+        try:
+            body = response.json()
+        except ValueError:
+            body = {'description': response.text[:200]}
+        retry_after = None
+        if response.status_code == 429:
+            try:
+                retry_after = float((body.get('parameters') or {}).get('retry_after')
+                                    or response.headers.get('Retry-After') or 0) or None
+            except (AttributeError, TypeError, ValueError):
+                retry_after = None
+        return response.status_code, body, retry_after
+
+    def _deliver(self, message):
+        """Consegna un messaggio con retry; ritorna il record di consegna."""
+        started = time.perf_counter()
+        status, body = None, None
+        attempts = 0
+        for attempt in range(self.max_retries + 1):
+            self._limiter.acquire()
+            attempts += 1
+            status, body, retry_after = self._post(message)
+            if status == 200 and body.get('ok'):
+                break
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or attempt == self.max_retries:
+                break
+            telemetry.incr('telegram.retry', status=status if status is not None else 'error')
+            pause = BACKOFF_SECONDS * (2 ** attempt)
+            if retry_after:
+                pause = max(pause, min(retry_after, MAX_RETRY_AFTER_SECONDS))
+                self._limiter.pause(pause)
+            time.sleep(pause)
+
+        ok = status == 200 and bool(body.get('ok'))
+        return {
+            'id': message['id'],
+            'chat_id': message['chat_id'],
+            'ok': ok,
+            'status': status,
+            'attempts': attempts,
+            'latency_s': round(time.perf_counter() - started, 4),
+            'error': None if ok else (body or {}).get('description'),
+            'retryable': not ok and (status is None or status == 429 or status >= 500),
+            'sent_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        }
+
+    def _deliver_chat(self, messages):
+        """Messaggi di una chat, in ordine e distanziati di chat_interval."""
+        results = []
+        last_sent = None
+        for message in messages:
+            if last_sent is not None:
+                wait = self.chat_interval - (time.monotonic() - last_sent)
+                if wait > 0:
+                    time.sleep(wait)
+            results.append((message, self._deliver(message)))
+            last_sent = time.monotonic()
+        return results
+
+    def send_many(self, messages, parse_mode='Markdown'):
+        """
+        Invia molti messaggi in parallelo entro i limiti di frequenza.
+
+        Args:
+            messages (list): Coppie (chat_id, testo) oppure dict con 'chat_id', 'text'
+                e facoltativamente 'parse_mode', 'id' e 'session' (seduta del segnale,
+                default market_session_key()).
+            parse_mode (str | None): Formattazione di default ('Markdown' come in origine).
+
+        Returns:
+            list[dict]: Un record di consegna per messaggio, nell'ordine di input.
+        """
+        records, failed = self._send(messages, parse_mode)
+        self._append_jsonl(self.outbox_path, failed)
+        return records
+
+    def _send(self, messages, parse_mode):
+        """Invio e log delle consegne; ritorna (record, messaggi ancora da ritentare)."""
+        session = None
+        queue = []
+        for item in messages:
+            if isinstance(item, dict):
+                message = {'parse_mode': parse_mode, **item}
+            else:
+                message = {'chat_id': item[0], 'text': item[1], 'parse_mode': parse_mode}
+            message['chat_id'] = str(message['chat_id'])
+            message.setdefault('id', uuid.uuid4().hex)
+            if not message.get('session'):
+                session = session or market_session_key()
+                message['session'] = session
+            queue.append(message)
+
+        by_chat = {}
+        for message in queue:
+            by_chat.setdefault(message['chat_id'], []).append(message)
+
+        with telemetry.span('telegram.send_many', messages=len(queue), chats=len(by_chat)):
+            if len(by_chat) <= 1 or self.max_workers == 1:
+                chat_results = [self._deliver_chat(group) for group in by_chat.values()]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(by_chat))) as pool:
+                    chat_results = list(pool.map(self._deliver_chat, by_chat.values()))
+
+        delivered = {}
+        failed = []
+        for message, record in (pair for group in chat_results for pair in group):
+            delivered[message['id']] = record
+            telemetry.incr('telegram.sent' if record['ok'] else 'telegram.failed')
+            if not record['ok']:
+                telemetry.event('telegram.failed', chat_id=record['chat_id'], status=record['status'],
+                                error=record['error'], retryable=record['retryable'])
+            if record['retryable']:
+                failed.append(dict(message, attempts=record['attempts'], last_error=record['error']))
+        records = [delivered[message['id']] for message in queue]
+
+        self._append_jsonl(self.log_path, records)
+        self.deliveries.extend(records)
+        return records, failed
+
+    def send(self, chat_id, text, parse_mode='Markdown'):
+        """Invia un singolo messaggio; ritorna il record di consegna."""
+        return self.send_many([(chat_id, text)], parse_mode)[0]
+
+    # --------------------------------------------------------------------------
+    # Outbox
+    # --------------------------------------------------------------------------
+
+    def _append_jsonl(self, path, rows):
+        if not rows or not path:
+            return
+        with self._file_lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def pending(self):
+        """Messaggi in attesa nell'outbox."""
+        try:
+            with open(self.outbox_path, 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError):
+            return []
+
+    def _rewrite_outbox(self, rows):
+        """Sostituisce atomicamente l'outbox con rows (da chiamare con _file_lock)."""
+        os.makedirs(os.path.dirname(self.outbox_path) or '.', exist_ok=True)
+        tmp_path = f"{self.outbox_path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.outbox_path)
+
+    def flush_outbox(self, session=None):
+        """
+        Rinvia i messaggi dell'outbox della seduta corrente.
+
+        L'outbox viene riscritta solo dopo l'invio, con i soli messaggi ancora da
+        ritentare: se il processo si interrompe a meta' i messaggi restano li' (al
+        piu' un doppione al run successivo). I messaggi di sedute precedenti a
+        session (default market_session_key()) non vengono rinviati: sono istruzioni
+        superate, registrate nel log come scadute.
+
+        Returns:
+            list[dict]: Record di consegna dei messaggi rinviati.
+        """
+        session = session or market_session_key()
+        pending = self.pending()
+        if not pending:
+            return []
+        current = [m for m in pending if (m.get('session') or '') >= session]
+        expired = [m for m in pending if (m.get('session') or '') < session]
+
+        records, failed = [], []
+        if current:
+            keys = ('id', 'chat_id', 'text', 'parse_mode', 'session')
+            records, failed = self._send([{key: m.get(key) for key in keys} for m in current], None)
+        if expired:
+            now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+            telemetry.incr('telegram.expired', len(expired))
+            self._append_jsonl(self.log_path, [
+                {'id': m.get('id'), 'chat_id': m.get('chat_id'), 'ok': False, 'status': None, 'attempts': 0,
+                 'latency_s': 0.0, 'error': f"scaduto: seduta {m.get('session')} precedente a {session}",
+                 'retryable': False, 'sent_at': now}
+                for m in expired
+            ])
+            print(f"Outbox: {len(expired)} messaggi di sedute precedenti scartati.")
+
+        handled = {m.get('id') for m in pending}
+        with self._file_lock:
+            # Riletta sotto lock: restano le righe aggiunte nel frattempo da altri invii
+            self._rewrite_outbox([m for m in self.pending() if m.get('id') not in handled] + failed)
+        return records
+
+
+# Un notifier (e quindi un pool di connessioni) per token, riusato tra le chiamate
+_notifiers = {}
+_notifiers_lock = threading.Lock()
+
+
+def get_notifier(bot_token):
+    """TelegramNotifier condiviso per bot_token."""
+    with _notifiers_lock:
+        if bot_token not in _notifiers:
+            _notifiers[bot_token] = TelegramNotifier(bot_token)
+        return _notifiers[bot_token]
+
+
+def send_telegram_message(message: str, bot_token: str, chat_id):
+    """
+    Invia un messaggio a una o piu' chat Telegram tramite un bot.
 
     Args:
         message (str): Il testo del messaggio da inviare.
         bot_token (str): Il token API del bot di Telegram.
-        chat_id (str): L'ID della chat a cui inviare il messaggio.
-    
+        chat_id (str | list): ID della chat, piu' ID separati da virgole o una lista.
+
     Returns:
-        bool: True se il messaggio è stato inviato con successo, False altrimenti.
+        bool: True se il messaggio è stato inviato con successo a tutte le chat, False altrimenti.
     """
-    api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    
-    payload = {
-        'chat_id': chat_id,
-        'text': message,
-        'parse_mode': 'Markdown'  # Usiamo Markdown per grassetto, corsivo, etc.
-    }
-    
-    try:
-        response = requests.post(api_url, json=payload, timeout=10)
-        response_json = response.json()
-        
-        if response.status_code == 200 and response_json.get("ok"):
+    records = get_notifier(bot_token).send_many([(chat, message) for chat in _chat_ids(chat_id)])
+    for record in records:
+        if record['ok']:
             print("Messaggio Telegram inviato con successo!")
-            return True
+        elif record['status'] is None:
+            print(f"Errore di connessione all'API di Telegram: {record['error']}")
         else:
-            print(f"Errore nell'invio del messaggio Telegram: {response_json}")
-            return False
-            
-    except requests.exceptions.RequestException as e:
-        print(f"Errore di connessione all'API di Telegram: {e}")
-        return False
+            print(f"Errore nell'invio del messaggio Telegram: {record['error']}")
+    return bool(records) and all(record['ok'] for record in records)
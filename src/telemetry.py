@@ -0,0 +1,317 @@
+# src/telemetry.py
+"""
+Telemetria strutturata della pipeline: span temporizzati, contatori ed eventi.
+
+Le fasi della pipeline (download per ticker con la sorgente usata, serie
+FRED, join/ffill, indicatori, backtest, notifica) sono avvolte in span con
+durata, esito e attributi; cache hit, fallback, retry e le eccezioni che il
+codice assorbe per proseguire diventano contatori ed eventi invece di print
+o di `except: pass` silenziosi.
+
+Tutto viene raccolto in memoria (thread-safe: i download girano nel pool di
+thread) e a fine corsa write_metrics aggiunge un record JSON per corsa al
+file di metriche:
+
+- spans: per nome numero di chiamate, tempo totale e massimo, errori;
+- trace: i singoli span nell'ordine di chiusura (al massimo MAX_TRACE_SPANS);
+- counters: contatori con etichette, es. "cache.hit{key=eod_SPY}";
+- events: fallback, scadenze ed eccezioni assorbite, con i dettagli.
+
+Variabili d'ambiente:
+
+- KRITERION_METRICS_FILE: file JSONL delle metriche (default .cache/metrics.jsonl);
+- KRITERION_TELEMETRY_DISABLE=1: nessuna raccolta ne' scrittura;
+- KRITERION_PROFILE=cprofile|pyinstrument: profila il blocco di profile() e
+  salva il risultato in KRITERION_PROFILE_DIR (default .cache/profiles).
+
+Uso da riga di comando:
+
+    python -m src.telemetry show --last 5
+"""
+
+import argparse
+import contextlib
+import datetime
+import functools
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+_BASE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+METRICS_FILE_DEFAULT = os.path.join(_BASE_DIR, 'metrics.jsonl')
+PROFILE_DIR_DEFAULT = os.path.join(_BASE_DIR, 'profiles')
+MAX_TRACE_SPANS = 1000
+MAX_EVENTS = 500
+PROFILE_TOP_FUNCTIONS = 25
+
+_lock = threading.Lock()
+_local = threading.local()
+_run = None
+
+
+def get_metrics_path():
+    """File delle metriche (sovrascrivibile con KRITERION_METRICS_FILE)."""
+    return os.environ.get('KRITERION_METRICS_FILE', METRICS_FILE_DEFAULT)
+
+
+def enabled():
+    """La telemetria si disattiva impostando KRITERION_TELEMETRY_DISABLE=1."""
+    return os.environ.get('KRITERION_TELEMETRY_DISABLE', '').lower() not in ('1', 'true', 'yes')
+
+
+def _new_run(name):
+    return {
+        'run_id': uuid.uuid4().hex[:12],
+        'name': name,
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        't0': time.perf_counter(),
+        'spans': {},
+        'trace': [],
+        'counters': {},
+        'events': [],
+    }
+
+
+def reset(name=None):
+    """Inizia una nuova corsa scartando quanto raccolto finora."""
+    global _run
+    with _lock:
+        _run = _new_run(name)
+
+
+def _current_run():
+    global _run
+    if _run is None:
+        _run = _new_run(None)
+    return _run
+
+
+# ==============================================================================
+# SPAN, CONTATORI, EVENTI
+# ==============================================================================
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """
+    Misura il blocco come span name.
+
+    Restituisce il dict degli attributi, a cui il blocco puo' aggiungere
+    informazioni note solo alla fine (es. la sorgente del download). Le
+    eccezioni vengono registrate e rilanciate.
+    """
+    if not enabled():
+        yield attrs
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    error = None
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            run = _current_run()
+            stats = run['spans'].setdefault(name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'errors': 0})
+            stats['count'] += 1
+            stats['total_s'] += duration
+            stats['max_s'] = max(stats['max_s'], duration)
+            stats['errors'] += error is not None
+            if len(run['trace']) < MAX_TRACE_SPANS:
+                run['trace'].append({
+                    'name': name, 'parent': parent, 'thread': threading.current_thread().name,
+                    'start_s': round(start - run['t0'], 6), 'duration_s': round(duration, 6),
+                    'error': error, **attrs,
+                })
+
+
+def timed(name):
+    """Decoratore: ogni chiamata della funzione e' uno span name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _counter_key(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f"{k}={labels[k]}" for k in sorted(labels)) + '}'
+
+
+def incr(name, value=1, **labels):
+    """Incrementa il contatore name con le etichette date."""
+    if not enabled():
+        return
+    key = _counter_key(name, labels)
+    with _lock:
+        counters = _current_run()['counters']
+        counters[key] = counters.get(key, 0) + value
+
+
+def event(name, **attrs):
+    """Registra un evento puntuale (fallback, scadenze, eccezioni assorbite)."""
+    if not enabled():
+        return
+    with _lock:
+        run = _current_run()
+        if len(run['events']) < MAX_EVENTS:
+            run['events'].append({'name': name, 'at_s': round(time.perf_counter() - run['t0'], 6),
+                                  **{k: (v if isinstance(v, (int, float, bool, type(None))) else str(v))
+                                     for k, v in attrs.items()}})
+
+
+# ==============================================================================
+# RECORD DELLA CORSA
+# ==============================================================================
+
+def snapshot(**extra):
+    """Record JSON-serializzabile della corsa corrente (extra: campi aggiuntivi)."""
+    with _lock:
+        run = _current_run()
+        record = {
+            'run_id': run['run_id'],
+            'name': run['name'],
+            'started_at': run['started_at'],
+            'duration_s': round(time.perf_counter() - run['t0'], 6),
+            **extra,
+            'spans': {name: dict(stats, total_s=round(stats['total_s'], 6), max_s=round(stats['max_s'], 6))
+                      for name, stats in run['spans'].items()},
+            'counters': dict(run['counters']),
+            'events': list(run['events']),
+            'trace': list(run['trace']),
+        }
+    return record
+
+
+def write_metrics(path=None, **extra):
+    """Aggiunge il record della corsa al file di metriche e lo restituisce (None se disattivata)."""
+    if not enabled():
+        return None
+    record = snapshot(**extra)
+    path = path or get_metrics_path()
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+    except OSError as e:
+        print(f"Scrittura metriche fallita ({path}): {e}")
+    return record
+
+
+def format_summary(record):
+    """Riepilogo leggibile di un record: span per tempo totale, contatori ed eventi."""
+    lines = [f"Telemetria {record.get('name') or ''} {record['run_id']} "
+             f"({record['started_at']}, {record['duration_s']:.2f}s)"]
+    for name, stats in sorted(record['spans'].items(), key=lambda item: -item[1]['total_s']):
+        errors = f", {stats['errors']} errori" if stats['errors'] else ""
+        lines.append(f"  {name:<28} {stats['count']:>5}x  tot {stats['total_s']:8.3f}s  "
+                     f"max {stats['max_s']:8.3f}s{errors}")
+    for key, value in sorted(record['counters'].items()):
+        lines.append(f"  {key:<44} {value}")
+    for ev in record['events']:
+        details = ', '.join(f"{k}={v}" for k, v in ev.items() if k not in ('name', 'at_s'))
+        lines.append(f"  ! {ev['name']} @{ev['at_s']:.2f}s {details}")
+    return '\n'.join(lines)
+
+
+def read_metrics(path=None, last=None):
+    """Record del file di metriche (gli ultimi last se indicato)."""
+    try:
+        with open(path or get_metrics_path(), 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return []
+    return records[-last:] if last else records
+
+
+# ==============================================================================
+# PROFILAZIONE SU RICHIESTA
+# ==============================================================================
+
+@contextlib.contextmanager
+def profile(label):
+    """
+    Profila il blocco se KRITERION_PROFILE e' impostato ('cprofile' o 'pyinstrument').
+
+    cProfile salva <label>_<timestamp>.prof (apribile con pstats o snakeviz) e
+    stampa le funzioni piu' costose; pyinstrument salva un report HTML. Senza
+    pyinstrument installato si ripiega su cProfile.
+    """
+    mode = os.environ.get('KRITERION_PROFILE', '').lower()
+    if not mode:
+        yield None
+        return
+    directory = os.environ.get('KRITERION_PROFILE_DIR', PROFILE_DIR_DEFAULT)
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"{label}_{datetime.datetime.now():%Y%m%d_%H%M%S}")
+
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument non installato: uso cProfile.")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield profiler
+            finally:
+                profiler.stop()
+                with open(f"{stem}.html", 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+                print(f"Profilo salvato in {stem}.html")
+            return
+
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{stem}.prof")
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        print(out.getvalue())
+        print(f"Profilo salvato in {stem}.prof")
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mostra le metriche registrate dalle ultime corse.")
+    parser.add_argument('action', choices=['show'], nargs='?', default='show')
+    parser.add_argument('--file', default=None, help="File delle metriche (default KRITERION_METRICS_FILE).")
+    parser.add_argument('--last', type=int, default=1, help="Numero di corse da mostrare.")
+    parser.add_argument('--json', action='store_true', help="Stampa i record JSON invece del riepilogo.")
+    args = parser.parse_args(argv)
+
+    records = read_metrics(args.file, args.last)
+    if not records:
+        print("Nessuna metrica registrata.")
+        return 1
+    for record in records:
+        print(json.dumps(record, indent=1) if args.json else format_summary(record))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
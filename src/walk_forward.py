@@ -0,0 +1,284 @@
+# src/walk_forward.py
+"""
+Backtest walk-forward / rolling-origin della strategia di copertura.
+
+Il CMI z-score e' calcolato point-in-time (compute_cmi_zscore_pit, con
+statistiche correnti in O(n)): media mobile del CMI e latch del VIX sono
+gia' causali, quindi i segnali di tutta la storia si calcolano una volta
+per combinazione di parametri e ogni fold ne usa solo una fetta, senza
+informazione futura.
+
+Per ogni fold la griglia di parametri viene valutata sulla finestra di
+training (statistiche di tutte le combinazioni in un solo passaggio con
+performance_matrix), la combinazione migliore viene applicata alla finestra
+di test successiva partendo flat e i rendimenti out-of-sample dei fold sono
+concatenati. I fold girano in parallelo su un pool di processi che
+condivide il frame base tramite l'initializer, come lo sweep.
+
+Uso da riga di comando:
+
+    python -m src.walk_forward --start 2005-01-01 --train-years 5 --test-months 3 \\
+        --grid cmi_ma_window=126,189,252 --grid stop_loss_threshold_hedge=0.03:0.08:0.01 \\
+        --zscore rolling --zscore-window 756 --workers 8 --out wf_folds.csv
+"""
+
+import argparse
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.backtest import run_backtest_kernel
+from src.metrics import STAT_NAMES, return_stats
+from src.strategy import (INDICATOR_PARAMS, PIT_MIN_PERIODS, build_master_frame, compute_cmi_zscore_pit,
+                          load_strategy_data, load_strategy_params)
+from src.sweep import (SWEEPABLE_PARAMS, cartesian_grid, cmi_ma_columns, indicator_frame, init_worker,
+                       parse_values, random_grid, return_stats_table)
+
+TRADING_DAYS = 252
+DEFAULT_METRIC = 'sharpe'
+
+
+# ==============================================================================
+# FOLD
+# ==============================================================================
+
+def make_folds(index, train_bars, test_bars, step_bars=None, anchored=False):
+    """
+    Finestre train/test consecutive su un indice di barre.
+
+    Args:
+        index (pd.DatetimeIndex): Barre con segnali validi.
+        train_bars, test_bars (int): Lunghezze delle finestre in barre.
+        step_bars (int | None): Avanzamento tra fold (default: test_bars, test non sovrapposti).
+        anchored (bool): True = training espandente dall'inizio (rolling-origin ancorato).
+
+    Returns:
+        list[dict]: Un dict per fold con 'fold', 'train_start', 'train_end', 'test_start', 'test_end'.
+    """
+    step_bars = step_bars or test_bars
+    folds = []
+    test_start = train_bars
+    while test_start < len(index):
+        test_end = min(test_start + test_bars, len(index)) - 1
+        train_start = 0 if anchored else test_start - train_bars
+        folds.append({
+            'fold': len(folds),
+            'train_start': index[train_start], 'train_end': index[test_start - 1],
+            'test_start': index[test_start], 'test_end': index[test_end],
+        })
+        test_start += step_bars
+    return folds
+
+
+# ==============================================================================
+# VALUTAZIONE NEI WORKER
+# ==============================================================================
+
+def _slice_returns(params, start, end, include_previous=False):
+    """
+    Backtest che parte flat su [start, end] con i segnali gia' calcolati.
+
+    Usa direttamente il kernel sugli array (senza assemblare il DataFrame dei
+    risultati di run_backtest): nei fold si eseguono migliaia di backtest brevi.
+
+    Returns:
+        tuple: (rendimenti giornalieri della strategia come pd.Series, dict con
+        'benchmark', 'trades', 'stop_losses'), oppure (None, None) se la fetta e' vuota.
+    """
+    df = indicator_frame(params)
+    if df is None:
+        return None, None
+    lo = df.index.searchsorted(start)
+    hi = df.index.searchsorted(end, side='right')
+    # Partire dalla barra precedente fa cadere il primo rendimento proprio su start
+    lo = max(lo - 1, 0) if include_previous else lo
+    if hi - lo < 2:
+        return None, None
+
+    spy_close = df['SPY_Close'].to_numpy()[lo:hi]
+    backtest = run_backtest_kernel(
+        spy_close, df['ES_Close'].to_numpy()[lo:hi], df['Signal_Count'].to_numpy()[lo:hi],
+        df['SPY_Open'].iloc[lo], params['capitale_iniziale'], params['hedge_percentage_per_tranche'],
+        params['stop_loss_threshold_hedge'], params['micro_es_multiplier']
+    )
+    index = df.index[lo + 1:hi]
+    portfolio = backtest['portfolio_value']
+    strategy_returns = pd.Series(portfolio[1:] / portfolio[:-1] - 1, index=index)
+    benchmark_returns = pd.Series(spy_close[1:] / spy_close[:-1] - 1, index=index)
+    return strategy_returns, {'benchmark': benchmark_returns, 'trades': backtest['hedge_trades_count'],
+                              'stop_losses': backtest['stop_loss_events']}
+
+
+def evaluate_fold(task):
+    """
+    Ottimizza la griglia sul training del fold e applica la migliore al test.
+
+    Args:
+        task (tuple): (fold, combinazioni complete di parametri, metrica da massimizzare).
+
+    Returns:
+        tuple: (riga con date, parametri scelti e metriche, rendimenti di test della
+        strategia, rendimenti di test del benchmark); rendimenti None se il fold e' vuoto.
+    """
+    fold, combos, metric = task
+    train_returns = [_slice_returns(p, fold['train_start'], fold['train_end'])[0] for p in combos]
+    train_returns = [r.to_numpy() if r is not None else None for r in train_returns]
+    train_stats = return_stats_table(train_returns, TRADING_DAYS)
+
+    row = dict(fold)
+    scores = train_stats[metric].to_numpy()
+    if np.isnan(scores).all():
+        row['error'] = 'training vuoto'
+        return row, None, None
+
+    best = int(np.nanargmax(scores))
+    params = combos[best]
+    row.update({name: params[name] for name in SWEEPABLE_PARAMS if name in params})
+    row[f'train_{metric}'] = float(scores[best])
+
+    test_returns, extra = _slice_returns(params, fold['test_start'], fold['test_end'], include_previous=True)
+    if test_returns is None:
+        row['error'] = 'test vuoto'
+        return row, None, None
+    row.update({f'test_{name}': value for name, value in return_stats(test_returns, TRADING_DAYS).items()})
+    row['test_hedge_trades'] = extra['trades']
+    row['test_stop_loss_events'] = extra['stop_losses']
+    return row, test_returns, extra['benchmark']
+
+
+# ==============================================================================
+# ESECUZIONE
+# ==============================================================================
+
+def prepare_pit_frame(start_date, end_date, zscore_window=None, min_periods=PIT_MIN_PERIODS,
+                      eodhd_api_key=None, fred_api_key=None):
+    """Scarica i dati una volta e calcola il CMI z-score point-in-time."""
+    market_data_dfs, cmi_data_dict = load_strategy_data(start_date, end_date, eodhd_api_key, fred_api_key)
+    if not market_data_dfs:
+        return None
+    return compute_cmi_zscore_pit(build_master_frame(market_data_dfs, cmi_data_dict), zscore_window, min_periods)
+
+
+def run_walk_forward(base_df, base_params, combos, train_bars, test_bars, step_bars=None, anchored=False,
+                     metric=DEFAULT_METRIC, max_workers=None):
+    """
+    Esegue tutti i fold in parallelo.
+
+    Args:
+        base_df (pd.DataFrame): Frame con CMI_ZScore point-in-time (vedi prepare_pit_frame).
+        base_params (dict): Parametri di default, sovrascritti da ciascuna combinazione.
+        combos (list[dict]): Griglia da ottimizzare in ogni fold ([{}] = solo i default).
+        train_bars, test_bars, step_bars, anchored: Vedi make_folds.
+        metric (str): Statistica del training da massimizzare (una di STAT_NAMES).
+        max_workers (int | None): Processi del pool (default: numero di CPU).
+
+    Returns:
+        tuple: (DataFrame dei fold, rendimenti out-of-sample concatenati della
+        strategia, idem del benchmark).
+    """
+    full_params = [dict(base_params, **combo) for combo in combos]
+    # Le barre valide sono quelle con la finestra CMI piu' lunga della griglia
+    longest = max(full_params, key=lambda p: p['cmi_ma_window'])
+    cmi_ma = cmi_ma_columns(base_df, full_params)
+    init_worker(base_df, cmi_ma=cmi_ma)
+    valid_index = indicator_frame(longest).index
+    folds = make_folds(valid_index, train_bars, test_bars, step_bars, anchored)
+
+    indicator_keys = {tuple(float(p[name]) for name in INDICATOR_PARAMS) for p in full_params}
+    cache_size = len(indicator_keys) + 1
+    tasks = [(fold, full_params, metric) for fold in folds]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(tasks) <= 1:
+        init_worker(base_df, cache_size, cmi_ma)
+        results = [evaluate_fold(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(base_df, cache_size, cmi_ma)) as pool:
+            results = list(pool.map(evaluate_fold, tasks))
+
+    rows = pd.DataFrame([row for row, _, _ in results])
+    oos_strategy = [r for _, r, _ in results if r is not None]
+    oos_benchmark = [b for _, _, b in results if b is not None]
+    # Con step < test i fold si sovrappongono: per ogni data vale il fold piu' recente
+    oos_strategy = pd.concat(oos_strategy) if oos_strategy else pd.Series(dtype=float)
+    oos_benchmark = pd.concat(oos_benchmark) if oos_benchmark else pd.Series(dtype=float)
+    oos_strategy = oos_strategy[~oos_strategy.index.duplicated(keep='last')]
+    oos_benchmark = oos_benchmark[~oos_benchmark.index.duplicated(keep='last')]
+    return rows, oos_strategy, oos_benchmark
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest walk-forward della strategia di copertura.")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--start', default='2005-01-01', help="Data inizio (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="Data fine (default: oggi)")
+    parser.add_argument('--grid', action='append', default=[], metavar='PARAM=VALORI',
+                        help="Valori di un parametro: 'a,b,c' oppure 'start:stop:step'. Ripetibile.")
+    parser.add_argument('--random', type=int, default=None, metavar='N')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--train-years', type=float, default=5)
+    parser.add_argument('--test-months', type=float, default=3)
+    parser.add_argument('--step-months', type=float, default=None)
+    parser.add_argument('--anchored', action='store_true', help="Training espandente dall'inizio.")
+    parser.add_argument('--zscore', choices=['expanding', 'rolling'], default='expanding')
+    parser.add_argument('--zscore-window', type=int, default=3 * TRADING_DAYS, help="Barre per --zscore rolling.")
+    parser.add_argument('--metric', choices=STAT_NAMES, default=DEFAULT_METRIC)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=os.path.join('results', 'walk_forward_folds.csv'),
+                        help="CSV di output (default nella cartella results/, ignorata da git).")
+    args = parser.parse_args(argv)
+
+    space = {}
+    for item in args.grid:
+        name, _, spec = item.partition('=')
+        if name not in SWEEPABLE_PARAMS:
+            parser.error(f"Parametro non supportato: {name} (ammessi: {', '.join(SWEEPABLE_PARAMS)})")
+        space[name] = parse_values(spec)
+    if not space:
+        combos = [{}]
+    else:
+        combos = random_grid(space, args.random, args.seed) if args.random else cartesian_grid(space)
+
+    base_params = load_strategy_params(args.config)
+    start_date = datetime.date.fromisoformat(args.start)
+    end_date = datetime.date.fromisoformat(args.end) if args.end else datetime.date.today()
+
+    print(f"Download dati dal {start_date} al {end_date}...")
+    zscore_window = args.zscore_window if args.zscore == 'rolling' else None
+    base_df = prepare_pit_frame(start_date, end_date, zscore_window)
+    if base_df is None:
+        print("ERRORE: download dati o calcolo CMI fallito.")
+        return 1
+
+    bars_per_month = TRADING_DAYS / 12
+    train_bars = int(round(args.train_years * TRADING_DAYS))
+    test_bars = int(round(args.test_months * bars_per_month))
+    step_bars = int(round(args.step_months * bars_per_month)) if args.step_months else None
+
+    print(f"Walk-forward con {len(combos)} combinazioni per fold...")
+    folds, oos_strategy, oos_benchmark = run_walk_forward(
+        base_df, base_params, combos, train_bars, test_bars, step_bars, args.anchored,
+        args.metric, args.workers
+    )
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    folds.to_csv(args.out, index=False)
+    print(f"{len(folds)} fold salvati in {args.out}")
+
+    if len(oos_strategy) > 1:
+        summary = pd.DataFrame({'Strategia (OOS)': return_stats(oos_strategy, TRADING_DAYS),
+                                'Benchmark (SPY)': return_stats(oos_benchmark, TRADING_DAYS)})
+        print(f"Periodo out-of-sample: {oos_strategy.index[0].date()} - {oos_strategy.index[-1].date()}")
+        print(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,61 @@
+# tests/conftest.py
+"""Fixture comuni: dati sintetici con seme fisso e download della strategia offline."""
+
+import pandas as pd
+import pytest
+
+from src import incremental
+from src.synthetic_data import synthetic_market_data as make_synthetic_market_data
+
+SYNTHETIC_START = '2020-01-01'
+SYNTHETIC_BARS = 1100
+
+# Parametri di default del config.ini
+STRATEGY_PARAMS = {
+    'capitale_iniziale': 50000.0,
+    'hedge_percentage_per_tranche': 0.875,
+    'stop_loss_threshold_hedge': 0.05,
+    'micro_es_multiplier': 5.0,
+    'cmi_ma_window': 252.0,
+    'vix_ratio_upper_threshold': 0.96,
+    'vix_ratio_lower_threshold': 0.90,
+}
+
+
+@pytest.fixture
+def params():
+    return dict(STRATEGY_PARAMS)
+
+
+@pytest.fixture(scope='session')
+def synthetic_market_data():
+    """(market_data_dfs, cmi_data_dict) giornalieri sintetici, seme 7."""
+    return make_synthetic_market_data(SYNTHETIC_BARS, 'B', start=SYNTHETIC_START, seed=7)
+
+
+@pytest.fixture(scope='session')
+def synthetic_loader(synthetic_market_data):
+    """Sostituto di load_strategy_data: i dati sintetici tagliati all'intervallo richiesto."""
+    market_data_dfs, cmi_data_dict = synthetic_market_data
+
+    def load(start_date, end_date, eodhd_api_key=None, fred_api_key=None, *args, **kwargs):
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        return ({ticker: frame.loc[start:end] for ticker, frame in market_data_dfs.items()},
+                {name: series.loc[start:end] for name, series in cmi_data_dict.items()})
+
+    return load
+
+
+@pytest.fixture
+def offline_strategy_data(monkeypatch, tmp_path, synthetic_market_data, synthetic_loader):
+    """
+    load_strategy_data del motore incrementale servito dai dati sintetici
+    (tagliati all'intervallo richiesto, come il download) e stato, artefatti e
+    cache in tmp_path. Ritorna il calendario delle barre.
+    """
+    monkeypatch.setattr(incremental, 'load_strategy_data', synthetic_loader)
+    monkeypatch.setenv('KRITERION_STATE_FILE', str(tmp_path / 'strategy_state.json'))
+    monkeypatch.setenv('KRITERION_ARTIFACT_DIR', str(tmp_path / 'artifacts'))
+    monkeypatch.setenv('KRITERION_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('KRITERION_TELEMETRY_DISABLE', '1')
+    return next(iter(synthetic_market_data[0].values())).index
@@ -0,0 +1,127 @@
+# tests/test_alignment.py
+"""
+Allineamento point-in-time: ritardo di rilascio delle serie FRED, limite del
+forward-fill dei prezzi, rapporto sui buchi e scarto delle barre incomplete.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.alignment import GAP_REPORT_COLUMNS, PRICE_FILL_LIMIT, align_sources, drop_incomplete
+
+# Sedute di gennaio 2024 senza il 15 (Martin Luther King Day): FRED pubblica comunque quel giorno
+CALENDAR = pd.bdate_range('2024-01-02', '2024-01-31').drop(pd.Timestamp('2024-01-15'))
+FRED_DAYS = pd.bdate_range('2024-01-01', '2024-01-31')
+GAP_START, GAP_BARS = 5, PRICE_FILL_LIMIT + 2
+
+
+@pytest.fixture
+def aligned():
+    spy = pd.Series(np.arange(len(CALENDAR), dtype=float) + 100, index=CALENDAR)
+    es = spy.copy()
+    es.iloc[GAP_START:GAP_START + GAP_BARS] = np.nan
+    # Valore = giorno del mese dell'osservazione, per leggere quale osservazione e' visibile
+    vix = pd.Series(FRED_DAYS.day.astype(float), index=FRED_DAYS)
+    ted = vix.loc[:'2024-01-10']
+    high_yield = pd.Series([], dtype=float, index=pd.DatetimeIndex([]))
+    return align_sources([('SPY_Close', spy), ('ES_Close', es)],
+                         [('VIX', vix), ('TED_Spread', ted), ('High_Yield_Spread', high_yield)])
+
+
+# ==============================================================================
+# RITARDO DI RILASCIO
+# ==============================================================================
+
+def test_fred_observation_visible_one_business_day_later(aligned):
+    df, _ = aligned
+    previous_business_day = (CALENDAR - pd.offsets.BDay(1)).day.astype(float)
+    np.testing.assert_array_equal(df['VIX'].to_numpy(), previous_business_day)
+    # Venerdi' visibile lunedi'; l'osservazione del 15 (borsa chiusa) non va persa e vale il 16
+    assert df.loc['2024-01-08', 'VIX'] == 5
+    assert df.loc['2024-01-16', 'VIX'] == 15
+
+
+def test_release_lag_override():
+    vix = pd.Series(FRED_DAYS.day.astype(float), index=FRED_DAYS)
+    spy = [('SPY_Close', pd.Series(1.0, index=CALENDAR))]
+    same_day, gaps = align_sources(spy, [('VIX', vix)], release_lags=0)
+    np.testing.assert_array_equal(same_day['VIX'].to_numpy(), CALENDAR.day.astype(float))
+    assert gaps.loc['VIX', 'release_lag'] == 0
+
+    two_days, _ = align_sources(spy, [('VIX', vix)], release_lags={'VIX': 2})
+    assert two_days.loc['2024-01-09', 'VIX'] == 5
+
+
+# ==============================================================================
+# FORWARD-FILL LIMITATO DEI PREZZI
+# ==============================================================================
+
+def test_price_fill_stops_at_limit(aligned):
+    df, _ = aligned
+    es = df['ES_Close'].to_numpy()
+    last_seen = es[GAP_START - 1]
+    filled = es[GAP_START:GAP_START + PRICE_FILL_LIMIT]
+    assert (filled == last_seen).all()
+    assert np.isnan(es[GAP_START + PRICE_FILL_LIMIT:GAP_START + GAP_BARS]).all()
+    assert es[GAP_START + GAP_BARS] == df['SPY_Close'].iloc[GAP_START + GAP_BARS]
+
+
+# ==============================================================================
+# RAPPORTO SUI BUCHI
+# ==============================================================================
+
+def test_gap_report(aligned):
+    df, gaps = aligned
+    n = len(CALENDAR)
+    assert list(gaps.columns) == GAP_REPORT_COLUMNS
+    assert list(gaps.index) == list(df.columns)
+
+    spy = gaps.loc['SPY_Close']
+    assert (spy['observations'], spy['filled'], spy['unfilled'], spy['max_gap']) == (n, 0, 0, 0)
+    es = gaps.loc['ES_Close']
+    assert (es['source'], es['release_lag']) == ('market', -1)
+    assert (es['observations'], es['filled'], es['unfilled']) == (n - GAP_BARS, PRICE_FILL_LIMIT,
+                                                                  GAP_BARS - PRICE_FILL_LIMIT)
+    assert es['max_gap'] == GAP_BARS and es['stale_sessions'] == 0
+    assert (es['first'], es['last']) == (CALENDAR[0], CALENDAR[-1])
+
+    vix = gaps.loc['VIX']
+    assert (vix['source'], vix['release_lag']) == ('fred', 1)
+    assert (vix['observations'], vix['filled'], vix['unfilled'], vix['stale_sessions']) == (n, 0, 0, 0)
+    assert (vix['first'], vix['last']) == (FRED_DAYS[0], FRED_DAYS[-1])
+
+    # Serie dismessa: l'ultimo valore (del 10, visibile l'11) resta valido e invecchia
+    ted = gaps.loc['TED_Spread']
+    visible = (CALENDAR <= '2024-01-11').sum()
+    assert (ted['observations'], ted['filled'], ted['unfilled']) == (visible, n - visible, 0)
+    assert ted['stale_sessions'] == n - visible == ted['max_gap']
+    assert ted['last'] == pd.Timestamp('2024-01-10')
+    assert df['TED_Spread'].iloc[-1] == 10
+
+    never = gaps.loc['High_Yield_Spread']
+    assert (never['observations'], never['unfilled'], never['max_gap'], never['stale_sessions']) == (0, n, -1, -1)
+    assert pd.isna(never['first']) and df['High_Yield_Spread'].isna().all()
+
+
+# ==============================================================================
+# BARRE INCOMPLETE
+# ==============================================================================
+
+def test_drop_incomplete_head_returns_independent_frame():
+    df = pd.DataFrame({'SPY_Close': [np.nan, np.nan, 1.0, 2.0, 3.0], 'ES_Close': [1.0] * 5},
+                      index=CALENDAR[:5])
+    kept, dropped = drop_incomplete(df, ['SPY_Close', 'ES_Close'])
+    assert dropped == 2 and list(kept.index) == list(CALENDAR[2:5])
+    # Il chiamante aggiunge colonne e scrive sul frame: non deve essere una vista dell'originale
+    assert not np.shares_memory(kept['SPY_Close'].to_numpy(), df['SPY_Close'].to_numpy())
+    kept.loc[CALENDAR[2], 'SPY_Close'] = -1.0
+    assert df.loc[CALENDAR[2], 'SPY_Close'] == 1.0
+
+
+def test_drop_incomplete_inner_rows():
+    df = pd.DataFrame({'SPY_Close': [1.0, np.nan, 3.0, 4.0], 'ES_Close': [1.0, 2.0, 3.0, np.nan]},
+                      index=CALENDAR[:4])
+    kept, dropped = drop_incomplete(df, ['SPY_Close', 'ES_Close'])
+    assert dropped == 2 and list(kept.index) == [CALENDAR[0], CALENDAR[2]]
+    assert drop_incomplete(kept, ['SPY_Close'])[0] is kept
@@ -0,0 +1,107 @@
+# tests/test_backtest.py
+"""run_backtest_kernel contro il loop per riga originale di run_full_strategy."""
+
+import math
+
+import numpy as np
+import pytest
+
+from src.backtest import run_backtest_kernel
+
+N_BARS = 2500
+PARAMS = {
+    'capitale_iniziale': 50000.0,
+    'hedge_percentage_per_tranche': 0.875,
+    'micro_es_multiplier': 5.0,
+}
+
+
+def legacy_backtest(spy_close, es_close, signal_count, initial_spy_price, capital,
+                    hedge_percentage_per_tranche, stop_loss_threshold_hedge, micro_es_multiplier):
+    """Loop per riga di run_full_strategy prima del kernel (app/dashboard.py originale)."""
+    n = len(spy_close)
+    spy_shares = capital / initial_spy_price
+    cash_from_hedging = 0.0
+    es_contracts = 0
+    hedge_entry_price = 0.0
+    current_tranches = 0
+    hedge_trades_count = 0
+    hedge_stopped_out = False
+    stop_loss_events = 0
+    portfolio_value = [capital]
+    mes_contracts = [0.0]
+    hedge_pnl = [0.0] * n
+    equity_at_hedge_entry = [math.nan] * n
+
+    for i in range(1, n):
+        price_spy = spy_close[i]
+        price_es_curr = es_close[i]
+        price_es_prev = es_close[i - 1]
+        if current_tranches > 0:
+            daily_hedge_pnl = es_contracts * (price_es_curr - price_es_prev) * micro_es_multiplier
+            cash_from_hedging += daily_hedge_pnl
+            hedge_pnl[i] = daily_hedge_pnl
+            if price_es_curr > hedge_entry_price * (1 + stop_loss_threshold_hedge):
+                current_tranches = 0
+                es_contracts = 0
+                hedge_stopped_out = True
+                stop_loss_events += 1
+
+        target_tranches = signal_count[i]
+        if target_tranches == 0:
+            hedge_stopped_out = False
+        if not hedge_stopped_out:
+            if target_tranches > current_tranches:
+                tranches_to_add = target_tranches - current_tranches
+                portfolio_value_now = (spy_shares * price_spy) + cash_from_hedging
+                notional_per_tranche = portfolio_value_now * hedge_percentage_per_tranche
+                contracts_to_add = -(notional_per_tranche / (price_es_curr * micro_es_multiplier)) * tranches_to_add
+                if current_tranches == 0:
+                    hedge_entry_price = price_es_curr
+                    hedge_trades_count += 1
+                    equity_at_hedge_entry[i] = portfolio_value_now
+                es_contracts += contracts_to_add
+                current_tranches = target_tranches
+            elif target_tranches < current_tranches:
+                es_contracts = es_contracts * (target_tranches / current_tranches)
+                current_tranches = target_tranches
+
+        portfolio_value.append((spy_shares * price_spy) + cash_from_hedging)
+        mes_contracts.append(es_contracts)
+
+    return {
+        'portfolio_value': np.array(portfolio_value),
+        'mes_contracts': np.array(mes_contracts, dtype=float),
+        'hedge_pnl': np.array(hedge_pnl),
+        'equity_at_hedge_entry': np.array(equity_at_hedge_entry),
+        'hedge_trades_count': hedge_trades_count,
+        'stop_loss_events': stop_loss_events,
+    }
+
+
+@pytest.fixture(scope='module')
+def synthetic_bars():
+    """Chiusure SPY/ES e tranche target (0-2, persistenti come i segnali) con seme fisso."""
+    rng = np.random.default_rng(5)
+    spy = 120 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, N_BARS)))
+    es = spy * 10 * (1 + rng.normal(0, 0.001, N_BARS))
+    targets = np.zeros(N_BARS, dtype=np.int64)
+    for i in range(1, N_BARS):
+        targets[i] = rng.integers(0, 3) if rng.random() < 0.04 else targets[i - 1]
+    return spy, es, targets, spy[0] * 0.998
+
+
+@pytest.mark.parametrize('stop_loss', [0.05, 0.02, 0.005])
+def test_kernel_matches_legacy_loop(synthetic_bars, stop_loss):
+    spy, es, targets, initial = synthetic_bars
+    args = (initial, PARAMS['capitale_iniziale'], PARAMS['hedge_percentage_per_tranche'], stop_loss,
+            PARAMS['micro_es_multiplier'])
+    ours = run_backtest_kernel(spy, es, targets, *args)
+    legacy = legacy_backtest(spy.tolist(), es.tolist(), targets.tolist(), *args)
+
+    assert legacy['hedge_trades_count'] > 0 and legacy['stop_loss_events'] > 0
+    for key in ('portfolio_value', 'mes_contracts', 'hedge_pnl', 'equity_at_hedge_entry'):
+        np.testing.assert_array_equal(ours[key], legacy[key], err_msg=key)
+    assert ours['hedge_trades_count'] == legacy['hedge_trades_count']
+    assert ours['stop_loss_events'] == legacy['stop_loss_events']
+    assert ours['final_state']['es_contracts'] == legacy['mes_contracts'][-1]
@@ -0,0 +1,144 @@
+# tests/test_batch.py
+"""
+Archivio dei job batch: salto per hash degli input, ripresa dopo un crash
+(anche con l'ultima riga del registro troncata), nuovo tentativo dei job
+falliti e coda limitata dei job in volo.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from src import batch, portfolio
+
+START, END = '2020-01-01', '2024-03-29'
+
+
+@pytest.fixture
+def offline_batch(monkeypatch, tmp_path, synthetic_loader):
+    """Download del batch servito dai dati sintetici; ritorna la directory dell'archivio."""
+    monkeypatch.setattr(portfolio, 'load_strategy_data', synthetic_loader)
+    monkeypatch.setenv('KRITERION_TELEMETRY_DISABLE', '1')
+    batch._load_frame.cache_clear()
+    yield str(tmp_path / 'results')
+    batch._load_frame.cache_clear()
+
+
+def _jobs(params, stop_losses):
+    spec = {'id': 'sl', 'start': START, 'end': END, 'universe': ['SPY'],
+            'grid': {'stop_loss_threshold_hedge': stop_losses}}
+    return batch.expand_spec(spec, params)
+
+
+def _ledger_lines(store):
+    with open(os.path.join(store, batch.LEDGER_NAME), encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+# ==============================================================================
+# SALTO PER HASH DEGLI INPUT
+# ==============================================================================
+
+def test_second_run_skips_jobs_already_in_store(offline_batch, params):
+    store = offline_batch
+    jobs = _jobs(params, [0.03, 0.05])
+    assert batch.run_batch(jobs, store, max_workers=2) == {'ok': 2, 'failed': 0, 'skipped': 0}
+    keys = batch.completed_hashes(store)
+    assert len(keys) == 2
+    for table in batch.TABLES:
+        assert all(os.path.exists(os.path.join(store, table, f"{key}.parquet")) for key in keys)
+
+    # Stessi input -> stesso hash -> saltati; un parametro diverso e' un job nuovo
+    assert batch.run_batch(jobs, store, max_workers=1) == {'ok': 0, 'failed': 0, 'skipped': 2}
+    assert batch.run_batch(_jobs(params, [0.05, 0.08]), store, max_workers=1) == {'ok': 1, 'failed': 0,
+                                                                                   'skipped': 1}
+    assert len(_ledger_lines(store)) == 3
+    metrics = batch.read_store(store, 'metrics')
+    assert sorted(metrics['job_id']) == sorted(job['id'] for job in _jobs(params, [0.03, 0.05, 0.08]))
+
+
+# ==============================================================================
+# RIPRESA DOPO UN CRASH
+# ==============================================================================
+
+def test_resume_after_crash_with_truncated_ledger_line(offline_batch, params):
+    store = offline_batch
+    jobs = _jobs(params, [0.03, 0.05, 0.08])
+
+    def crash(row):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_batch(jobs, store, max_workers=1, on_result=crash)
+    assert len(batch.completed_hashes(store)) == 1
+    # Crash a meta' della scrittura della riga successiva
+    with open(os.path.join(store, batch.LEDGER_NAME), 'a', encoding='utf-8') as f:
+        f.write('{"hash": "troncata", "sta')
+
+    assert batch.run_batch(jobs, store, max_workers=1) == {'ok': 2, 'failed': 0, 'skipped': 1}
+    lines = _ledger_lines(store)
+    assert lines[1] == '{"hash": "troncata", "sta'
+    assert [json.loads(line)['status'] for i, line in enumerate(lines) if i != 1] == ['ok'] * 3
+    assert len(batch.read_ledger(store)) == 3
+    assert len(batch.completed_hashes(store)) == 3
+
+
+def test_failed_jobs_are_retried_on_next_run(offline_batch, params, monkeypatch):
+    store = offline_batch
+    jobs = _jobs(params, [0.03, 0.05])
+
+    with monkeypatch.context() as patch:
+        def broken(job, frame):
+            raise RuntimeError("guasto")
+
+        patch.setattr(batch, 'run_job', broken)
+        assert batch.run_batch(jobs, store, max_workers=1) == {'ok': 0, 'failed': 2, 'skipped': 0}
+    rows = batch.read_ledger(store)
+    assert [row['error'] for row in rows] == ["RuntimeError: guasto"] * 2
+    assert batch.completed_hashes(store) == set()
+
+    assert batch.run_batch(jobs, store, max_workers=1) == {'ok': 2, 'failed': 0, 'skipped': 0}
+    assert [row['status'] for row in batch.read_ledger(store)] == ['failed', 'failed', 'ok', 'ok']
+    assert set(batch.read_store(store, 'metrics')['job_id']) == {job['id'] for job in jobs}
+
+
+# ==============================================================================
+# CODA LIMITATA
+# ==============================================================================
+
+def test_pool_keeps_bounded_in_flight_queue(offline_batch, params, monkeypatch):
+    store = offline_batch
+    workers = 2
+    limit = workers * batch.IN_FLIGHT_PER_WORKER
+    in_flight = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+
+    class CountingPool(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            with lock:
+                in_flight['now'] += 1
+                in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            return super().submit(*args, **kwargs)
+
+    def finished(row):
+        with lock:
+            in_flight['now'] -= 1
+
+    def quick_job(job, frame):
+        time.sleep(0.01)
+        return {'ok': True, 'timeseries': pd.DataFrame({'equity': [1.0]}),
+                'metrics': pd.DataFrame({'underlying': ['SPY']}), 'duration_s': 0.01}
+
+    monkeypatch.setattr(batch, 'ProcessPoolExecutor', CountingPool)
+    monkeypatch.setattr(batch, '_run_job_safe', quick_job)
+    jobs = _jobs(params, [0.01 * k for k in range(1, 13)])
+
+    assert batch.run_batch(jobs, store, max_workers=workers, on_result=finished) == {'ok': 12, 'failed': 0,
+                                                                                     'skipped': 0}
+    assert in_flight['max'] == limit
+    assert in_flight['now'] == 0
@@ -0,0 +1,68 @@
+# tests/test_data_cache.py
+"""Cache su disco: coda scaricata, cache valida e cache vecchia quando la coda fallisce."""
+
+import datetime
+
+import pandas as pd
+import pytest
+
+from src import telemetry
+from src.data_cache import cached_download
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv('KRITERION_CACHE_DIR', str(tmp_path))
+    monkeypatch.delenv('KRITERION_CACHE_DISABLE', raising=False)
+    monkeypatch.delenv('KRITERION_TELEMETRY_DISABLE', raising=False)
+    telemetry.reset('test')
+    return tmp_path
+
+
+def _bars(start, end):
+    index = pd.bdate_range(start, end, name='Date')
+    return pd.DataFrame({'Close': range(len(index))}, index=index, dtype=float)
+
+
+def _counters():
+    return telemetry.snapshot()['counters']
+
+
+def test_tail_failure_returns_stale_cache(cache_dir):
+    today = datetime.date.today()
+    first_end = today - datetime.timedelta(days=10)
+    data, source = cached_download('eod_TEST', lambda s, e: (_bars(s, e), 'EODHD'),
+                                   today - datetime.timedelta(days=60), first_end)
+    assert source == 'EODHD'
+
+    # Coda aggiornata
+    data, source = cached_download('eod_TEST', lambda s, e: (_bars(s, e), 'EODHD'),
+                                   today - datetime.timedelta(days=60), today - datetime.timedelta(days=5))
+    assert source == 'Cache+EODHD'
+
+    # Download della coda fallito: dati della cache, segnati come vecchi
+    for failed in (None, pd.DataFrame()):
+        data, source = cached_download('eod_TEST', lambda s, e: (failed, 'EODHD'),
+                                       today - datetime.timedelta(days=60), today)
+        assert source == 'Cache(stale)'
+        assert data.index[-1] <= pd.Timestamp(today - datetime.timedelta(days=5))
+    counters = _counters()
+    assert counters['cache.stale{key=eod_TEST}'] == 2
+    assert 'cache.hit{key=eod_TEST}' not in counters
+
+
+def test_covered_range_is_a_plain_hit(cache_dir):
+    end = datetime.date.today() - datetime.timedelta(days=10)
+    start = end - datetime.timedelta(days=30)
+    cached_download('eod_TEST', lambda s, e: (_bars(s, e), 'EODHD'), start, end)
+    data, source = cached_download('eod_TEST', lambda s, e: pytest.fail('nessun download atteso'), start, end)
+    assert source == 'Cache'
+    assert _counters()['cache.hit{key=eod_TEST}'] == 1
+
+
+def test_bot_warns_when_last_bar_is_before_the_session():
+    from bot_runner import stale_data_warning
+    assert stale_data_warning('2026-10-16', '2026-10-16') == ""
+    warning = stale_data_warning('2026-10-15', '2026-10-16')
+    assert 'DATI NON AGGIORNATI' in warning and '2026-10-15' in warning
+    assert stale_data_warning(pd.Timestamp('2026-10-14'), '2026-10-16') != ""
@@ -0,0 +1,115 @@
+# tests/test_numeric_core.py
+"""
+Il nucleo numerico contro i riferimenti che sostituisce: il kernel a percorso
+singolo, pandas rolling e il ricalcolo completo (il kernel contro il loop per
+riga originale e' in test_backtest.py).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import incremental
+from src.backtest import run_backtest_batch, run_backtest_kernel
+from src.indicator_calculator import PrefixSums
+from src.strategy import build_master_frame, compute_indicators
+
+
+@pytest.fixture
+def indicator_frame(synthetic_market_data, params):
+    df = compute_indicators(build_master_frame(*synthetic_market_data), params)
+    assert df is not None and len(df) > 300
+    return df
+
+
+# ==============================================================================
+# BACKTEST SU PIU' PERCORSI
+# ==============================================================================
+
+def test_batch_matches_kernel_path_by_path(indicator_frame, params):
+    rng = np.random.default_rng(11)
+    n = len(indicator_frame)
+    n_paths = 6
+    # Percorsi diversi: prezzi perturbati, segnali propri e parametri per percorso
+    shocks = np.exp(np.cumsum(rng.normal(0, 0.004, (n, n_paths)), axis=0))
+    spy = indicator_frame['SPY_Close'].to_numpy()[:, None] * shocks
+    es = indicator_frame['ES_Close'].to_numpy()[:, None] * shocks
+    signal_count = indicator_frame['Signal_Count'].to_numpy()
+    signals = np.column_stack([np.roll(signal_count, 17 * k) for k in range(n_paths)])
+    initial = spy[0] * 0.999
+    capital = np.linspace(20_000, 120_000, n_paths)
+    hedge = np.linspace(0.5, 1.0, n_paths)
+    stop_loss = np.linspace(0.01, 0.08, n_paths)
+    multiplier = np.array([5.0, 5.0, 50.0, 5.0, 2.0, 5.0])
+
+    batch = run_backtest_batch(spy, es, signals, initial, capital, hedge, stop_loss, multiplier)
+    for k in range(n_paths):
+        single = run_backtest_kernel(spy[:, k], es[:, k], signals[:, k], initial[k], capital[k], hedge[k],
+                                     stop_loss[k], multiplier[k])
+        np.testing.assert_array_equal(batch['portfolio_value'][:, k], single['portfolio_value'])
+        assert batch['hedge_trades_count'][k] == single['hedge_trades_count']
+        assert batch['stop_loss_events'][k] == single['stop_loss_events']
+        for key, value in single['final_state'].items():
+            if key in batch['final_state']:
+                assert batch['final_state'][key][k] == value, key
+
+
+# ==============================================================================
+# SOMME CUMULATE RI-ANCORATE
+# ==============================================================================
+
+def test_prefix_sums_match_pandas_rolling_across_blocks():
+    rng = np.random.default_rng(3)
+    n, block = 600, 64
+    # Livello lontano da zero e deriva: l'errore delle somme cumulate si vedrebbe
+    values = 1e4 + np.cumsum(rng.normal(0.5, 1.0, (n, 2)), axis=0)
+    values[rng.random((n, 2)) < 0.01] = np.nan
+    windows = [5, 37, block]
+    sums = PrefixSums(values, block=block)
+    mean = sums.rolling_mean(windows)
+    std = sums.rolling_std(windows)
+    zscore = sums.rolling_zscore(windows)
+
+    for k, window in enumerate(windows):
+        rolling = pd.DataFrame(values).rolling(window)
+        expected_mean = rolling.mean().to_numpy()
+        expected_std = rolling.std(ddof=0).to_numpy()
+        expected_z = (values - expected_mean) / expected_std
+        # Qualche finestra valida deve stare a cavallo di un confine di blocco
+        straddling = (np.arange(n) % block < window - 1) & (np.arange(n) >= block)
+        assert (~np.isnan(expected_mean[straddling])).any()
+        np.testing.assert_allclose(mean[:, k], expected_mean, rtol=1e-12, atol=0)
+        np.testing.assert_allclose(std[:, k], expected_std, rtol=1e-7, atol=1e-9)
+        np.testing.assert_allclose(zscore[:, k], expected_z, rtol=1e-7, atol=1e-9)
+
+
+# ==============================================================================
+# MOTORE INCREMENTALE
+# ==============================================================================
+
+def test_incremental_matches_full_recompute(offline_strategy_data, params):
+    dates = offline_strategy_data
+    seed_bar, bars = 900, 40
+    _, info = incremental.run_incremental_signal(params, dates[seed_bar].date(), verify_every=10 ** 6)
+    assert info['mode'] == 'full'
+    checkpoint = incremental.load_state()['checkpoint']
+
+    for end in dates[seed_bar + 1:seed_bar + 1 + bars]:
+        last, info = incremental.run_incremental_signal(params, end.date(), verify_every=10 ** 6)
+        assert info == {'mode': 'incremental', 'new_bars': 1, 'verified': False, 'drift': {}}
+
+        fresh, df = incremental._full_recompute(params, end.date())
+        expected = fresh['last_signal']
+        assert last['date'] == expected['date']
+        for key in ('Signal_CMI', 'Signal_VIX', 'Signal_Count'):
+            assert last[key] == expected[key], key
+        for key in ('CMI_ZScore', 'CMI_MA', 'VIX_Ratio'):
+            assert last[key] == pytest.approx(expected[key], rel=1e-9, abs=1e-9), key
+
+    # Copertura: avanzamento O(1) == kernel rigiocato dal checkpoint con gli stessi segnali
+    state = incremental.load_state()
+    history = incremental.history_frame(state)
+    hedge = incremental._replay_hedge(checkpoint, history, params)
+    assert hedge == pytest.approx(state['hedge'], rel=1e-12)
+    np.testing.assert_allclose(state['cmi']['sum'], np.array([row[1:] for row in state['cmi']['rows']]).sum(axis=0),
+                               rtol=1e-9)
@@ -0,0 +1,55 @@
+# tests/test_signal_artifact.py
+"""L'artefatto pubblicato dal bot serve su /signal e /contracts gli stessi numeri del messaggio."""
+
+import json
+
+import pandas as pd
+
+from src.artifact import artifact_path, open_artifact, publish_state_artifact
+from src.incremental import HISTORY_DAYS, load_state, run_incremental_signal
+from src.signal_service import hedge_state, load_snapshot
+
+SEED_BAR = 930
+DAYS = 60
+
+
+def test_contracts_match_notified_signal(offline_strategy_data, params):
+    dates = offline_strategy_data
+    states = set()
+    for end in dates[SEED_BAR:SEED_BAR + DAYS]:
+        last, info = run_incremental_signal(params, end.date(), verify_every=10)
+        assert last is not None
+        manifest = publish_state_artifact(params)
+        snapshot = load_snapshot(manifest)
+
+        contracts = json.loads(snapshot['bodies']['/contracts'])
+        assert contracts['date'] == last['date']
+        assert contracts['contracts'] == last['MES_Contracts']
+        assert contracts['state'] == hedge_state(last['MES_Contracts'], last['Signal_Count'])
+        signal = json.loads(snapshot['bodies']['/signal'])
+        for key in ('Signal_CMI', 'Signal_VIX', 'Signal_Count', 'MES_Contracts'):
+            assert signal[key] == last[key]
+        states.add(contracts['state'])
+
+    # Il periodo passa per le verifiche periodiche e per tutti gli stati della copertura
+    assert load_state()['bars_since_verify'] < DAYS
+    assert states == {'active', 'stop_loss', 'flat'}
+
+
+def test_artifact_covers_history_right_after_seed(offline_strategy_data, params):
+    last, info = run_incremental_signal(params, offline_strategy_data[-1].date())
+    assert info['mode'] == 'full'
+    manifest = publish_state_artifact(params)
+    frame = open_artifact(artifact_path(manifest))
+
+    # Tutto lo storico (e quindi l'ultimo anno dei grafici della dashboard), non la sola finestra campione
+    assert manifest['rows'] == len(frame)
+    assert frame.index[-1] - frame.index[0] >= pd.Timedelta(days=HISTORY_DAYS - 7)
+    assert frame.index[-1].strftime('%Y-%m-%d') == last['date']
+    assert frame['MES_Contracts'].iloc[-1] == last['MES_Contracts']
+    assert not frame[['CMI_ZScore', 'CMI_MA', 'Signal_Count']].isna().any().any()
+
+
+def test_no_artifact_for_other_params(offline_strategy_data, params):
+    run_incremental_signal(params, offline_strategy_data[SEED_BAR].date())
+    assert publish_state_artifact(dict(params, stop_loss_threshold_hedge=0.1)) is None
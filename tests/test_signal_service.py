@@ -0,0 +1,76 @@
+# tests/test_signal_service.py
+"""Servizio HTTP sui segnali: risposte, validatori (304), errori e cambio di snapshot dopo refresh."""
+
+import pytest
+import requests
+
+from src.artifact import publish_state_artifact
+from src.incremental import run_incremental_signal
+from src.signal_service import SignalStore, start_service
+
+SEED_BAR = 930
+
+
+@pytest.fixture
+def service(offline_strategy_data, params):
+    dates = offline_strategy_data
+    run_incremental_signal(params, dates[SEED_BAR].date())
+    publish_state_artifact(params)
+    store = SignalStore()
+    assert store.refresh()
+    server = start_service(store, port=0)
+    yield server, store, dates
+    server.shutdown()
+    server.server_close()
+
+
+def test_responses_and_validators(service):
+    server, store, dates = service
+    url = server.base_url
+
+    response = requests.get(f"{url}/signal", timeout=5)
+    assert response.status_code == 200
+    assert response.json()['date'] == dates[SEED_BAR].strftime('%Y-%m-%d')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert etag == store.snapshot['etag']
+
+    for headers in ({'If-None-Match': etag}, {'If-None-Match': f'"altro", {etag}'},
+                    {'If-Modified-Since': last_modified}):
+        cached = requests.get(f"{url}/contracts", headers=headers, timeout=5)
+        assert cached.status_code == 304 and cached.content == b''
+        assert cached.headers['ETag'] == etag
+    # If-None-Match prevale su If-Modified-Since
+    stale = requests.get(f"{url}/contracts", headers={'If-None-Match': '"altro"', 'If-Modified-Since': last_modified},
+                         timeout=5)
+    assert stale.status_code == 200
+
+    history = requests.get(f"{url}/history", params={'start': dates[SEED_BAR - 9].strftime('%Y-%m-%d'),
+                                                      'columns': 'Signal_Count,MES_Contracts'}, timeout=5).json()
+    assert history['rows'] == 10 and list(history['columns']) == ['Signal_Count', 'MES_Contracts']
+
+    for path, query in (('/history', {'start': '2024-13-01'}), ('/history', {'columns': 'Nessuna'}),
+                        ('/equity', {'end': 'ieri'})):
+        error = requests.get(f"{url}{path}", params=query, timeout=5)
+        assert error.status_code == 400 and 'error' in error.json()
+    assert requests.get(f"{url}/sconosciuto", timeout=5).status_code == 404
+
+    health = requests.get(f"{url}/health", timeout=5).json()
+    assert health['status'] == 'ok' and health['requests']['304'] == 3
+
+
+def test_etag_changes_after_refresh(service, params):
+    server, store, dates = service
+    url = server.base_url
+    etag = requests.get(f"{url}/signal", timeout=5).headers['ETag']
+    assert not store.refresh()
+
+    run_incremental_signal(params, dates[SEED_BAR + 1].date())
+    publish_state_artifact(params)
+    assert store.refresh()
+
+    response = requests.get(f"{url}/signal", headers={'If-None-Match': etag}, timeout=5)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json()['date'] == dates[SEED_BAR + 1].strftime('%Y-%m-%d')
+    assert requests.get(f"{url}/signal", headers={'If-None-Match': response.headers['ETag']},
+                        timeout=5).status_code == 304
@@ -0,0 +1,112 @@
+# tests/test_streaming.py
+"""
+Motore streaming contro il kernel: alimentato con barre giornaliere deve
+riprodurre copertura, valore del portafoglio ed eventi di run_backtest_kernel;
+la sequenza STOP/REARM e' verificata su barre costruite a mano.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.backtest import run_backtest_kernel
+from src.strategy import build_master_frame, compute_indicators
+from src.streaming import StreamingHedgeEngine, frame_bars
+
+HEDGE_EVENTS = ('ENTRY', 'ADD', 'REDUCE', 'EXIT', 'STOP', 'REARM')
+
+
+@pytest.fixture
+def indicator_frame(synthetic_market_data, params):
+    df = compute_indicators(build_master_frame(*synthetic_market_data), params)
+    assert df is not None and len(df) > 300
+    return df
+
+
+# ==============================================================================
+# EQUIVALENZA CON IL KERNEL
+# ==============================================================================
+
+def test_daily_bars_match_backtest_kernel(indicator_frame, params):
+    df = indicator_frame
+    # Con rapporto VIX sempre valido il latch al minuto coincide con Signal_VIX giornaliero
+    assert df['VIX_Ratio'].notna().all()
+    spy, es = df['SPY_Close'].to_numpy(), df['ES_Close'].to_numpy()
+    initial = df['SPY_Open'].iloc[0]
+    kernel = run_backtest_kernel(spy, es, df['Signal_Count'].to_numpy(), initial, params['capitale_iniziale'],
+                                 params['hedge_percentage_per_tranche'], params['stop_loss_threshold_hedge'],
+                                 params['micro_es_multiplier'])
+    assert kernel['stop_loss_events'] > 0 and kernel['hedge_trades_count'] > 1
+
+    # Stato del kernel alla prima barra (che non opera): il motore parte dalla seconda
+    state = {'spy_shares': params['capitale_iniziale'] / initial, 'cash_from_hedging': 0.0, 'es_contracts': 0.0,
+             'hedge_entry_price': 0.0, 'current_tranches': 0, 'hedge_stopped_out': False,
+             'last_es_close': es[0], 'hedge_trades_count': 0, 'stop_loss_events': 0}
+    schedule = {ts.date(): int(value) for ts, value in df['Signal_CMI'].items()}
+    engine = StreamingHedgeEngine(params, state=state, vix_latch=bool(df['Signal_VIX'].iloc[0]),
+                                  signal_cmi=int(df['Signal_CMI'].iloc[0]), cmi_schedule=schedule)
+    bar_index = {ts: i for i, ts in enumerate(df.index)}
+
+    events, values, contracts = [], [], []
+    for bar in list(frame_bars(df))[1:]:
+        events.extend(engine.process(bar))
+        snapshot = engine.snapshot()
+        assert snapshot['target'] == df['Signal_Count'].iloc[bar_index[bar[0]]]
+        values.append(snapshot['portfolio_value'])
+        contracts.append(engine.state['es_contracts'])
+
+    np.testing.assert_allclose(values, kernel['portfolio_value'][1:], rtol=1e-12)
+    np.testing.assert_allclose(contracts, kernel['mes_contracts'][1:], rtol=1e-12)
+    for key, value in kernel['final_state'].items():
+        assert engine.state[key] == pytest.approx(value, rel=1e-12), key
+
+    ledger = kernel['ledger']
+    expected = [(int(bar), kind) for bar, kind in zip(ledger.bar, ledger.kind_names()) if kind != 'MARK']
+    assert [(bar_index[e['ts']], e['kind']) for e in events if e['kind'] in HEDGE_EVENTS] == expected
+
+
+# ==============================================================================
+# STOP E RIARMO
+# ==============================================================================
+
+def _bars(rows):
+    days = pd.bdate_range('2024-01-02', periods=len(rows))
+    return [(ts, *row) for ts, row in zip(days, rows)]
+
+
+def test_stop_then_rearm_sequence(params):
+    # (SPY, ES, VIX, VIX3M); stop loss al 5% sopra l'entrata a 100
+    bars = _bars([
+        (100.0, 100.0, 10.0, 20.0),  # CMI attivo -> ENTRY a 100
+        (99.0, 106.0, 10.0, 20.0),   # ES +6% -> STOP, latch di stop-out armato
+        (99.5, 101.0, 10.0, 20.0),   # target 1 ma stop-out: nessun rientro
+        (98.0, 102.0, 20.0, 20.0),   # VIX_ON -> target 2, ancora nessun rientro
+        (98.5, 101.0, 10.0, 20.0),   # CMI_OFF e VIX_OFF -> target 0 -> REARM
+        (99.0, 100.0, 10.0, 20.0),   # CMI_ON -> nuovo ENTRY
+    ])
+    schedule = {bars[4][0].date(): 0, bars[5][0].date(): 1}
+    delivered = []
+    engine = StreamingHedgeEngine(params, signal_cmi=1, cmi_schedule=schedule, on_event=delivered.append)
+
+    events = list(engine.stream(bars))
+    assert [(e['ts'], e['kind']) for e in events] == [
+        (bars[0][0], 'ENTRY'), (bars[1][0], 'STOP'), (bars[3][0], 'VIX_ON'), (bars[4][0], 'CMI_OFF'),
+        (bars[4][0], 'VIX_OFF'), (bars[4][0], 'REARM'), (bars[5][0], 'CMI_ON'), (bars[5][0], 'ENTRY'),
+    ]
+    assert delivered == events
+    assert events[1]['es_price'] == 106.0
+    snapshot = engine.snapshot()
+    assert snapshot['hedge']['stop_loss_events'] == 1 and snapshot['hedge']['hedge_trades_count'] == 2
+    assert snapshot['hedge']['hedge_entry_price'] == 100.0 and not snapshot['hedge']['hedge_stopped_out']
+
+
+def test_stop_with_target_zero_on_same_bar_does_not_rearm(params):
+    bars = _bars([
+        (100.0, 100.0, 10.0, 20.0),
+        (99.0, 106.0, 10.0, 20.0),   # stop e target 0 nella stessa barra
+        (99.0, 100.0, 10.0, 20.0),
+    ])
+    engine = StreamingHedgeEngine(params, signal_cmi=1, cmi_schedule={bars[1][0].date(): 0})
+
+    assert [e['kind'] for e in engine.stream(bars)] == ['ENTRY', 'CMI_OFF', 'STOP']
+    assert not engine.state['hedge_stopped_out']
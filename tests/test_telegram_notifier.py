@@ -0,0 +1,156 @@
+# tests/test_telegram_notifier.py
+"""
+Consegna Telegram contro src.mock_server: retry su 429 e 5xx, rinuncia sui 4xx
+e giro completo dell'outbox (accodamento, rinvio, scarto delle sedute passate).
+"""
+
+import json
+
+import pytest
+
+from src import mock_server, telegram_notifier, telemetry
+from src.data_cache import market_session_key
+
+EMPTY_DATASET = {'eodhd': {}, 'yahoo': {}, 'fred': {}}
+
+
+@pytest.fixture
+def telegram_server(monkeypatch):
+    servers = []
+
+    def start(**options):
+        server = mock_server.start_server(dataset=EMPTY_DATASET, **options)
+        servers.append(server)
+        for key, value in server.client_env().items():
+            monkeypatch.setenv(key, value)
+        return server
+
+    monkeypatch.setattr(telegram_notifier, 'BACKOFF_SECONDS', 0.01)
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_notifier(tmp_path):
+    notifiers = []
+
+    def make(**options):
+        options = {'chat_interval': 0.0, 'global_rate': 1000, 'max_retries': 3,
+                   'outbox_path': str(tmp_path / 'outbox.jsonl'),
+                   'log_path': str(tmp_path / 'deliveries.jsonl'), **options}
+        notifier = telegram_notifier.TelegramNotifier('TOKEN', **options)
+        notifiers.append(notifier)
+        return notifier
+
+    yield make
+    for notifier in notifiers:
+        notifier.close()
+
+
+def _read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ==============================================================================
+# RETRY
+# ==============================================================================
+
+def test_retries_after_429_honouring_retry_after(telegram_server, make_notifier):
+    server = telegram_server(rate_limit=1)
+    telemetry.reset('telegram.retry')
+    records = make_notifier().send_many([('1', 'primo'), ('1', 'secondo')])
+
+    assert [r['ok'] for r in records] == [True, True]
+    assert [r['attempts'] for r in records] == [1, 2]
+    # Il mock chiede retry_after = 1: il secondo messaggio aspetta almeno quello
+    assert records[1]['latency_s'] >= 0.9
+    assert server.stats['telegram']['status'] == {'200': 2, '429': 1}
+    assert telemetry.snapshot()['counters'].get('telegram.retry{status=429}') == 1
+    assert [m['text'] for m in server.messages] == ['primo', 'secondo']
+
+
+def test_retries_server_errors(telegram_server, make_notifier):
+    server = telegram_server(fail_first=2)
+    record = make_notifier().send('1', 'ciao')
+
+    assert record['ok'] and record['attempts'] == 3
+    assert server.stats['telegram']['status'] == {'500': 2, '200': 1}
+
+
+def test_gives_up_on_client_errors(telegram_server, make_notifier):
+    server = telegram_server()
+    notifier = make_notifier()
+    record = notifier.send('1', '')
+
+    assert not record['ok'] and not record['retryable']
+    assert record['status'] == 400 and record['attempts'] == 1
+    assert server.stats['telegram']['requests'] == 1
+    assert notifier.pending() == []
+
+
+# ==============================================================================
+# OUTBOX
+# ==============================================================================
+
+def test_outbox_round_trip(telegram_server, make_notifier):
+    server = telegram_server(fail_first=1)
+    notifier = make_notifier(max_retries=0)
+    record = notifier.send('1', 'copertura')
+
+    assert not record['ok'] and record['retryable'] and record['status'] == 500
+    pending = notifier.pending()
+    assert [(m['chat_id'], m['text']) for m in pending] == [('1', 'copertura')]
+    assert pending[0]['session'] == market_session_key() and pending[0]['attempts'] == 1
+
+    # Il rinvio riusa l'id originale e svuota l'outbox solo a consegna avvenuta
+    flushed = notifier.flush_outbox()
+    assert [(r['id'], r['ok']) for r in flushed] == [(pending[0]['id'], True)]
+    assert notifier.pending() == []
+    assert [m['text'] for m in server.messages] == ['copertura']
+
+
+def test_flush_keeps_messages_that_still_fail(telegram_server, make_notifier):
+    telegram_server(fail_first=3)
+    notifier = make_notifier(max_retries=0)
+    notifier.send('1', 'copertura')
+    queued = notifier.pending()
+
+    flushed = notifier.flush_outbox()
+    assert not flushed[0]['ok']
+    assert [(m['id'], m['attempts']) for m in notifier.pending()] == [(queued[0]['id'], 1)]
+
+
+def test_flush_interrupted_mid_send_keeps_outbox(telegram_server, make_notifier, monkeypatch):
+    telegram_server(fail_first=1)
+    notifier = make_notifier(max_retries=0)
+    notifier.send_many([('1', 'a'), ('2', 'b')])
+    queued = notifier.pending()
+    assert len(queued) == 2
+
+    def crash(message):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(notifier, '_deliver', crash)
+    with pytest.raises(KeyboardInterrupt):
+        notifier.flush_outbox()
+    assert notifier.pending() == queued
+
+
+def test_flush_drops_messages_of_past_sessions(telegram_server, make_notifier):
+    server = telegram_server()
+    notifier = make_notifier()
+    notifier._append_jsonl(notifier.outbox_path, [
+        {'id': 'old', 'chat_id': '1', 'text': 'ieri', 'parse_mode': None, 'session': '2000-01-03'},
+        {'id': 'legacy', 'chat_id': '1', 'text': 'senza seduta', 'parse_mode': None},
+        {'id': 'new', 'chat_id': '1', 'text': 'oggi', 'parse_mode': None, 'session': '2000-01-04'},
+    ])
+
+    flushed = notifier.flush_outbox(session='2000-01-04')
+    assert [r['id'] for r in flushed] == ['new']
+    assert [m['text'] for m in server.messages] == ['oggi']
+    assert notifier.pending() == []
+    expired = [r for r in _read_jsonl(notifier.log_path) if r['id'] in ('old', 'legacy')]
+    assert len(expired) == 2 and all(r['error'].startswith('scaduto') for r in expired)